@@ -0,0 +1,41 @@
+"""
+Communication network: nodes linked by weighted channels, persons attached to the nodes exchanging encoded messages.
+
+The names below are loaded on first access, so `import app` costs nothing and `import app.network` only loads the
+core modules. Optional subsystems (metrics, sharding, server, ...) are imported when they are first used.
+"""
+import importlib
+
+# public name -> module defining it
+_EXPORTS = {
+    "CommunicationNetwork": "network",
+    "Node": "network",
+    "InvalidNetworkException": "network",
+    "Person": "person",
+    "Key": "messaging",
+    "Message": "messaging",
+    "Priority": "messaging",
+    "InvalidContentException": "messaging",
+    "Registry": "registry",
+    "RegistryException": "registry",
+}
+
+_SUBMODULES = {"generator", "journal", "messaging", "metrics", "multicast", "network", "person", "profiling",
+               "ratelimit", "registry", "routing", "server", "sharding", "snapshot"}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module("." + _EXPORTS[name], __name__), name)
+    elif name in _SUBMODULES:
+        value = importlib.import_module("." + name, __name__)
+    else:
+        raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS) | _SUBMODULES)
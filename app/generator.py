@@ -0,0 +1,394 @@
+import math
+import random
+import time
+
+from .messaging import Key, Message, Priority
+from .network import CommunicationNetwork, Node
+from .person import Person
+from .snapshot import pack_values, unpack_values, SnapshotException
+
+MODELS = ("random_geometric", "barabasi_albert", "grid", "tree")
+
+TRAINING_TEXTS = [
+    "this is a simple text to train create the key",
+    "this is another text. this is another text. this is another text. bob",
+    "carol carol carol carol abcdefghijklmnopqrstuvwxyz",
+    "dave dave dave daaaaaaaaavvvvveeeee",
+    "the quick brown fox jumps over the lazy dog 0123456789",
+    "meet me at 15 near the old school",
+]
+
+PHRASES = [
+    "meet me at 15",
+    "the quick brown fox jumps over the lazy dog 42",
+    "see you at the old school",
+    " ".join(["the quick brown fox jumps over the lazy dog 42"] * 22),
+]
+
+# Trace events. Every event is a tuple whose first item is one of these, followed by _ARITY values
+SEND = 1  # sender, receiver, phrase index, priority
+BROADCAST = 2  # sender, phrase index, priority
+READ = 3  # person
+JOIN = 4  # person, node, training text index
+LEAVE = 5  # person
+LINK_DOWN = 6  # node, node
+LINK_UP = 7  # node, node, cost
+
+_ARITY = {SEND: 4, BROADCAST: 3, READ: 1, JOIN: 3, LEAVE: 1, LINK_DOWN: 2, LINK_UP: 3}
+_NAMES = {SEND: "send", BROADCAST: "broadcast", READ: "read", JOIN: "join", LEAVE: "leave", LINK_DOWN: "link_down",
+          LINK_UP: "link_up"}
+
+# share of each kind of event in a generated trace, link flaps count as a down and an up
+DEFAULT_MIX = {SEND: 0.6, BROADCAST: 0.02, READ: 0.25, JOIN: 0.05, LEAVE: 0.04, LINK_DOWN: 0.04}
+
+_MAGIC = b"CNWT"
+_VERSION = 1
+
+
+class GeneratorException(Exception):
+    """
+    A generic exception for problems while generating or replaying workloads
+    """
+
+    pass
+
+
+def _links_random_geometric(nodes, generator, max_cost, radius=None):
+    # nodes are points of the unit square linked to the ones closer than radius, the cost grows with the distance
+    if radius is None:
+        # about twice the connectivity threshold: 2 ln(nodes) neighbors on average
+        radius = min(1.0, math.sqrt(2 * math.log(max(nodes, 2)) / (math.pi * max(nodes, 1))))
+    points = [(generator.random(), generator.random()) for _ in range(nodes)]
+    cells = {}
+    for node_id, (x, y) in enumerate(points):
+        cells.setdefault((int(x / radius), int(y / radius)), []).append(node_id)
+    links = {}
+    for node_id, (x, y) in enumerate(points):
+        cell_x, cell_y = int(x / radius), int(y / radius)
+        for other_x in (cell_x - 1, cell_x, cell_x + 1):
+            for other_y in (cell_y - 1, cell_y, cell_y + 1):
+                for other in cells.get((other_x, other_y), ()):
+                    distance = math.dist(points[node_id], points[other])
+                    if other > node_id and distance <= radius:
+                        links[(node_id, other)] = 1 + int(distance / radius * (max_cost - 1))
+    # components too far apart are joined by their closest pair of points
+    parent = list(range(nodes))
+
+    def find(node_id):
+        while parent[node_id] != node_id:
+            parent[node_id] = parent[parent[node_id]]
+            node_id = parent[node_id]
+        return node_id
+    for node_1, node_2 in links:
+        parent[find(node_1)] = find(node_2)
+    components = {}
+    for node_id in range(nodes):
+        components.setdefault(find(node_id), []).append(node_id)
+    groups = list(components.values())
+    connected = groups[0] if groups else []
+    for group in groups[1:]:
+        node_1, node_2 = min(((a, b) for a in group for b in connected),
+                             key=lambda pair: math.dist(points[pair[0]], points[pair[1]]))
+        links[(min(node_1, node_2), max(node_1, node_2))] = max_cost
+        connected = connected + group
+    return links
+
+
+def _links_barabasi_albert(nodes, generator, max_cost, attachments=2):
+    # every new node links to `attachments` existing ones, picked proportionally to their degree
+    links = {}
+    targets = []  # one entry per link end, so that sampling it follows the degrees
+    for node_id in range(1, nodes):
+        chosen = set()
+        wanted = min(attachments, node_id)
+        while len(chosen) < wanted:
+            chosen.add(generator.choice(targets) if targets and generator.random() < 0.9
+                       else generator.randrange(node_id))
+        for other in chosen:
+            links[(other, node_id)] = generator.randint(1, max_cost)
+            targets += [other, node_id]
+    return links
+
+
+def _links_grid(nodes, generator, max_cost):
+    side = math.ceil(math.sqrt(nodes))
+    links = {}
+    for node_id in range(nodes):
+        if (node_id + 1) % side != 0 and node_id + 1 < nodes:
+            links[(node_id, node_id + 1)] = generator.randint(1, max_cost)
+        if node_id + side < nodes:
+            links[(node_id, node_id + side)] = generator.randint(1, max_cost)
+    return links
+
+
+def _links_tree(nodes, generator, max_cost, branching=None):
+    # k-ary tree, or a random recursive tree when branching is None
+    links = {}
+    for node_id in range(1, nodes):
+        parent = generator.randrange(node_id) if branching is None else (node_id - 1) // branching
+        links[(parent, node_id)] = generator.randint(1, max_cost)
+    return links
+
+
+_MODEL_LINKS = {"random_geometric": _links_random_geometric, "barabasi_albert": _links_barabasi_albert,
+                "grid": _links_grid, "tree": _links_tree}
+
+
+def build_network(model, nodes, seed=0, max_cost=10, **params):
+    """
+    Build a connected network with node ids 0..nodes-1
+    :param model: one of MODELS
+    :param nodes: number of nodes
+    :param seed: seed of the topology and of the link costs
+    :param max_cost: link costs are between 1 and max_cost
+    :param params: model parameters: radius (random_geometric), attachments (barabasi_albert), branching (tree)
+    :return: the network
+    """
+    if model not in _MODEL_LINKS:
+        raise GeneratorException("Unknown model " + str(model))
+    links = _MODEL_LINKS[model](nodes, random.Random(seed), max_cost, **params)
+    cn = CommunicationNetwork()
+    node_objects = [Node(node_id) for node_id in range(nodes)]
+    for node in node_objects:
+        cn.add(node)
+    for (node_1, node_2), cost in links.items():
+        cn.link(node_objects[node_1], node_objects[node_2], cost)
+    return cn
+
+
+def train_keys(texts=TRAINING_TEXTS):
+    """
+    :return: one trained Key per text
+    """
+    return [Key(text) for text in texts]
+
+
+def attach_persons(cn, persons, seed=0, keys=None, prefix="p"):
+    """
+    Attach persons prefix0..prefixN round robin to the nodes, with keys trained once and shared. They join in a
+    single CommunicationNetwork.join_network_many call, each key serialized once, so that a million persons do not
+    take longer than the workload itself
+    :param keys: the keys handed out in turn, train_keys() by default
+    :return: the list of persons
+    """
+    keys = train_keys() if keys is None else keys
+    serialized_keys = [Key.serialize(key) for key in keys]
+    node_ids = cn.node_index_list
+    placements = [(Person(prefix + str(index), keys[index % len(keys)]), node_ids[(index * 7 + seed) % len(node_ids)],
+                   serialized_keys[index % len(keys)]) for index in range(persons)]
+    cn.join_network_many(placements)
+    return [person for person, _, _ in placements]
+
+
+class Trace:
+    """
+    A workload: the network to build and the events to run on it
+    """
+
+    def __init__(self, model, nodes, persons, seed, events, phrases=PHRASES):
+        """
+        :param model: see build_network
+        :param nodes: number of nodes
+        :param persons: number of persons attached before the first event
+        :param seed: seed of the network
+        :param events: list of event tuples
+        :param phrases: the plain contents, events refer to them by index
+        """
+        self.model = model
+        self.nodes = nodes
+        self.persons = persons
+        self.seed = seed
+        self.events = events
+        self.phrases = list(phrases)
+
+    def build(self):
+        """
+        :return: the network of the trace with its persons attached
+        """
+        cn = build_network(self.model, self.nodes, self.seed)
+        attach_persons(cn, self.persons, self.seed)
+        return cn
+
+
+def _is_bridge(graph, node_1, node_2):
+    # is node_2 still reachable from node_1 without the direct link?
+    seen = {node_1}
+    stack = [node_1]
+    while stack:
+        node_id = stack.pop()
+        for neighbor in graph[node_id]:
+            if node_id == node_1 and neighbor == node_2:
+                continue
+            if neighbor == node_2:
+                return False
+            if neighbor not in seen:
+                seen.add(neighbor)
+                stack.append(neighbor)
+    return True
+
+
+def generate_trace(model, nodes, persons, events, seed=0, mix=None, flap_length=20):
+    """
+    Generate a workload whose events are all valid when replayed in order: senders, receivers and readers are
+    connected, and a link only goes down when the network stays connected without it.
+    The persons attached at the start stay and do the sending. Persons joining later (j0, j1, ...) receive, read,
+    leave and join again but do not send: a message must not outlive the key of its sender
+    :param model: see build_network
+    :param nodes: number of nodes
+    :param persons: persons attached before the first event
+    :param events: number of events
+    :param seed: seed of the network and of the events
+    :param mix: dict event kind -> share, DEFAULT_MIX by default
+    :param flap_length: number of events a link stays down
+    :return: the Trace
+    """
+    cn = build_network(model, nodes, seed)
+    generator = random.Random(seed + 1)
+    graph = {node_id: {neighbor: cost for neighbor, cost in links} for node_id, links in cn.network.items()}
+    senders = ["p" + str(index) for index in range(persons)]
+    churning = []  # joined persons currently connected
+    left = []
+    joined = 0
+    down = []  # (event index to bring it up, node, node, cost)
+    kinds, weights = zip(*sorted((mix or DEFAULT_MIX).items()))
+    trace = []
+
+    def anyone():
+        index = generator.randrange(len(senders) + len(churning))
+        return senders[index] if index < len(senders) else churning[index - len(senders)]
+
+    while len(trace) < events:
+        if down and down[0][0] <= len(trace):
+            _, node_1, node_2, cost = down.pop(0)
+            graph[node_1][node_2] = graph[node_2][node_1] = cost
+            trace.append((LINK_UP, node_1, node_2, cost))
+            continue
+        kind = generator.choices(kinds, weights)[0]
+        if (kind in (SEND, BROADCAST) and not senders) or (kind == LEAVE and not churning) or \
+                (kind == READ and not senders and not churning):
+            kind = JOIN
+        if kind == SEND:
+            trace.append((SEND, generator.choice(senders), anyone(), generator.randrange(len(PHRASES)),
+                          int(generator.choice(list(Priority)))))
+        elif kind == BROADCAST:
+            trace.append((BROADCAST, generator.choice(senders), generator.randrange(len(PHRASES)),
+                          int(generator.choice(list(Priority)))))
+        elif kind == READ:
+            trace.append((READ, anyone()))
+        elif kind == JOIN:
+            if left and generator.random() < 0.5:
+                person_id = left.pop(generator.randrange(len(left)))
+            else:
+                person_id = "j" + str(joined)
+                joined += 1
+            churning.append(person_id)
+            trace.append((JOIN, person_id, generator.randrange(nodes), generator.randrange(len(TRAINING_TEXTS))))
+        elif kind == LEAVE:
+            # swap with the last one so that removing is O(1)
+            index = generator.randrange(len(churning))
+            churning[index], churning[-1] = churning[-1], churning[index]
+            person_id = churning.pop()
+            left.append(person_id)
+            trace.append((LEAVE, person_id))
+        elif kind == LINK_DOWN:
+            node_1 = generator.randrange(nodes)
+            if not graph[node_1]:
+                continue
+            node_2 = generator.choice(list(graph[node_1]))
+            if _is_bridge(graph, node_1, node_2):
+                continue
+            cost = graph[node_1].pop(node_2)
+            del graph[node_2][node_1]
+            down.append((len(trace) + flap_length, node_1, node_2, cost))
+            trace.append((LINK_DOWN, node_1, node_2))
+    return Trace(model, nodes, persons, seed, trace)
+
+
+def write_trace(path, trace):
+    """
+    Save the trace: header, phrases and the events flattened in one pack_values block each
+    """
+    flat = []
+    for event in trace.events:
+        flat.extend(event)
+    with open(path, "wb") as file:
+        file.write(_MAGIC)
+        file.write(pack_values([_VERSION, trace.model, trace.nodes, trace.persons, trace.seed]))
+        file.write(pack_values(trace.phrases))
+        file.write(pack_values(flat))
+
+
+def read_trace(path):
+    """
+    :return: the Trace saved by write_trace
+    - Fails with a GeneratorException if the file is not a trace
+    """
+    with open(path, "rb") as file:
+        data = file.read()
+    if data[:len(_MAGIC)] != _MAGIC:
+        raise GeneratorException("Not a workload trace")
+    try:
+        header, offset = unpack_values(data, len(_MAGIC))
+        phrases, offset = unpack_values(data, offset)
+        flat, offset = unpack_values(data, offset)
+    except SnapshotException as error:
+        raise GeneratorException("Corrupted workload trace: " + str(error))
+    version, model, nodes, persons, seed = header
+    if version != _VERSION:
+        raise GeneratorException("Unsupported trace version " + str(version))
+    events = []
+    position = 0
+    while position < len(flat):
+        kind = flat[position]
+        arity = _ARITY[kind]
+        events.append(tuple(flat[position:position + arity + 1]))
+        position += arity + 1
+    return Trace(model, nodes, persons, seed, events, phrases)
+
+
+def replay(trace, cn=None):
+    """
+    Run the events of the trace back to back, as fast as possible
+    :param cn: the network to run them on, trace.build() by default (not timed)
+    :return: dict with "events", "seconds", "events_per_second" and "counts" (event name -> number)
+    """
+    if cn is None:
+        cn = trace.build()
+    keys = {}
+    nodes = cn.nodes
+    persons = cn.persons
+    phrases = trace.phrases
+    counts = dict.fromkeys(_NAMES.values(), 0)
+    start = time.perf_counter()
+    for event in trace.events:
+        kind = event[0]
+        if kind == SEND:
+            _, sender, receiver, phrase, priority = event
+            person = persons[sender]
+            cn.send(Message(sender, person._key.encode(phrases[phrase]), Priority(priority), receiver,
+                            sequence=person.next_sequence()))
+        elif kind == BROADCAST:
+            _, sender, phrase, priority = event
+            person = persons[sender]
+            cn.broadcast(Message(sender, person._key.encode(phrases[phrase]), Priority(priority), None,
+                                 sequence=person.next_sequence()))
+        elif kind == READ:
+            persons[event[1]].get_all_messages()
+        elif kind == JOIN:
+            _, person_id, node_id, text = event
+            # keys are trained once per text, joining does not include training
+            if text not in keys:
+                keys[text] = Key(TRAINING_TEXTS[text])
+            cn.join_network(Person(person_id, keys[text]), node_id)
+        elif kind == LEAVE:
+            cn.leave_network(persons[event[1]])
+        elif kind == LINK_DOWN:
+            cn.unlink(nodes[event[1]], nodes[event[2]])
+        elif kind == LINK_UP:
+            cn.link(nodes[event[1]], nodes[event[2]], event[3])
+        else:
+            raise GeneratorException("Unknown event " + str(kind))
+        counts[_NAMES[kind]] += 1
+    seconds = time.perf_counter() - start
+    return {"events": len(trace.events), "seconds": seconds,
+            "events_per_second": len(trace.events) / seconds if seconds > 0 else float("inf"), "counts": counts}
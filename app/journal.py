@@ -0,0 +1,270 @@
+import os
+import struct
+import threading
+import time
+from collections import deque
+
+from .messaging import Key, Message, Priority
+from .person import Person
+from .snapshot import pack_values, unpack_values, SnapshotException
+from . import snapshot
+
+# Records are written in batches (one batch per group commit):
+#   payload length (u32) | record count (u32) | operations (u8 each) | arities (u8 each) | pack_values(all values)
+# a batch torn by a crash is dropped as a whole, it was never acknowledged as durable anyway
+_BATCH = struct.Struct("<II")
+
+ADD = 1
+REMOVE = 2
+LINK = 3
+UNLINK = 4
+JOIN = 5
+LEAVE = 6
+RECEIVE = 7
+READ = 8
+CHECKPOINT = 9
+GROUP_CREATE = 10
+GROUP_DELETE = 11
+GROUP_ADD = 12
+GROUP_REMOVE = 13
+MOVE = 14
+
+
+class JournalException(Exception):
+    """
+    A generic exception for problems in the journal
+    """
+
+    pass
+
+
+class Journal:
+    """
+    Append-only write-ahead log of the network mutations and message deliveries.
+    Records are kept in memory and written + fsynced together (group commit) by a background flusher thread every
+    sync_interval seconds, or as soon as the batch is full. The sending thread only queues the record.
+    """
+
+    def __init__(self, path, sync_interval=0.05, batch_size=8192, clock=time.monotonic, background=True):
+        """
+        :param path: the journal file, created if missing, appended otherwise
+        :param sync_interval: max seconds a record can wait before being fsynced (0 means every record, fsynced by
+            append itself)
+        :param batch_size: max number of records kept in memory before a commit
+        :param clock: time source of flush_due, e.g. a fake clock in tests
+        :param background: start the flusher thread. Without it the pending records are only committed by
+            flush_due, commit, checkpoint and close (and by append once the batch is full)
+        """
+        self.path = path
+        self.sync_interval = sync_interval
+        self.batch_size = batch_size
+        self._clock = clock
+        self._stream = open(path, "ab")
+        # appended by the senders and popped by commit, both atomic: appending takes no lock
+        self._pending = deque()
+        self._oldest = None # clock() when the oldest pending record was appended
+        self._condition = threading.Condition(threading.Lock())
+        self._write_lock = threading.Lock() # batches are written one at a time, in the order they were taken
+        self._closed = False
+        self._next_checkpoint = _last_checkpoint(path) + 1
+        self._flusher = None
+        if background and sync_interval > 0:
+            self._flusher = threading.Thread(target=self._flush_loop, name="journal-flusher", daemon=True)
+            self._flusher.start()
+
+    def append(self, operation, *values):
+        """
+        Add a record to the current batch. It is durable at most sync_interval seconds later
+        :param operation: one of the record operations (ADD, LINK, RECEIVE, ...)
+        :param values: the values describing the operation
+        :return:
+        """
+        if self._closed:
+            raise JournalException("The journal is closed")
+        pending = self._pending
+        if not pending:
+            self._oldest = self._clock()
+        pending.append((operation, values))
+        if self.sync_interval <= 0:
+            self.commit()
+        elif len(pending) >= self.batch_size:
+            if self._flusher is None:
+                self.commit()
+            else:
+                with self._condition:
+                    self._condition.notify()
+
+    def flush_due(self):
+        """
+        Commit the pending records if the batch is full or the oldest one has waited sync_interval
+        :return: True if a batch was committed
+        """
+        pending = self._pending
+        if pending and (len(pending) >= self.batch_size or self._clock() - self._oldest >= self.sync_interval):
+            self.commit()
+            return True
+        return False
+
+    def _flush_loop(self):
+        # a commit every sync_interval: a record appended right after a commit waits for the next one
+        while True:
+            with self._condition:
+                if not self._closed:
+                    self._condition.wait(self.sync_interval)
+                if self._closed:
+                    return
+            self.commit()
+
+    def commit(self):
+        """
+        Write and fsync every pending record
+        :return:
+        """
+        with self._write_lock:
+            pending = self._pending
+            batch = [pending.popleft() for _ in range(len(pending))]
+            if batch:
+                operations = bytes(operation for operation, _ in batch)
+                arities = bytes(len(values) for _, values in batch)
+                payload = operations + arities + pack_values([value for _, values in batch for value in values])
+                self._stream.write(_BATCH.pack(len(payload), len(batch)) + payload)
+                self._stream.flush()
+                os.fsync(self._stream.fileno())
+
+    def checkpoint(self):
+        """
+        Write a durable checkpoint marker. Everything before it is covered by the snapshot tagged with the returned id
+        :return: the checkpoint id
+        """
+        checkpoint_id = self._next_checkpoint
+        self._next_checkpoint += 1
+        self.append(CHECKPOINT, checkpoint_id)
+        self.commit()
+        return checkpoint_id
+
+    def close(self):
+        """
+        Stop the flusher and commit what is left
+        """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.commit()
+        self._stream.close()
+
+
+def read_records(path):
+    """
+    Read all the complete records of a journal. A torn record at the end (crash in the middle of a write) is ignored
+    :param path: the journal file
+    :return: list of (operation, values)
+    """
+    with open(path, "rb") as stream:
+        buffer = stream.read()
+    records = []
+    offset = 0
+    while offset + _BATCH.size <= len(buffer):
+        length, count = _BATCH.unpack_from(buffer, offset)
+        start = offset + _BATCH.size
+        if start + length > len(buffer):
+            break
+        operations = buffer[start:start + count]
+        arities = buffer[start + count:start + 2 * count]
+        try:
+            values, _ = unpack_values(buffer[start + 2 * count:start + length], 0)
+        except (SnapshotException, struct.error, ValueError):
+            break
+        position = 0
+        for operation, arity in zip(operations, arities):
+            records.append((operation, values[position:position + arity]))
+            position += arity
+        offset = start + length
+    return records
+
+
+def _last_checkpoint(path):
+    if not os.path.exists(path):
+        return 0
+    last = 0
+    for operation, values in read_records(path):
+        if operation == CHECKPOINT:
+            last = values[0]
+    return last
+
+
+def _apply(network, operation, values, node_class):
+    if operation == ADD:
+        network.add(node_class(values[0]))
+    elif operation == REMOVE:
+        try:
+            network.remove(network.nodes[values[0]])
+        except Exception:
+            # the original remove failed after changing the network, we replay the same outcome
+            pass
+    elif operation == LINK:
+        network.link(network.nodes[values[0]], network.nodes[values[1]], values[2])
+    elif operation == UNLINK:
+        network.unlink(network.nodes[values[0]], network.nodes[values[1]])
+    elif operation == JOIN:
+        network.join_network(Person(values[0], Key.from_serialized(values[2])), values[1])
+    elif operation == LEAVE:
+        network.leave_network(network.persons[values[0]])
+    elif operation == RECEIVE:
+        node_id, sender, content, priority, receiver = values[:5]
+        deadline = values[5] if len(values) > 5 else None
+        sequence = values[6] if len(values) > 6 else None
+        message = Message(sender, content, Priority(priority), receiver, deadline=deadline, sequence=sequence)
+        # the persons who got it, when they are not all the ones receive would find
+        recipients = values[7:]
+        if recipients:
+            network.nodes[node_id].replay_receive(message, recipients)
+        else:
+            network.nodes[node_id].receive(message)
+    elif operation == READ:
+        network.nodes[values[0]]._clear_mailbox(values[1])
+    elif operation == GROUP_CREATE:
+        network.create_group(values[0])
+    elif operation == GROUP_DELETE:
+        network.delete_group(values[0])
+    elif operation == GROUP_ADD:
+        network.add_to_group(values[0], values[1])
+    elif operation == GROUP_REMOVE:
+        network.remove_from_group(values[0], values[1])
+    elif operation == MOVE:
+        network.move_person(network.persons[values[0]], values[1])
+    elif operation != CHECKPOINT:
+        raise JournalException("Unknown journal operation " + str(operation))
+
+
+def recover(snapshot_path, journal_path, network_class, node_class):
+    """
+    Rebuild a network after a crash: load the snapshot and replay the journal from the checkpoint the snapshot was
+    taken at.
+    :param snapshot_path: the last snapshot, or None to start from an empty network
+    :param journal_path: the journal file
+    :param network_class: class of the network to build
+    :param node_class: class of the nodes to build
+    :return: the recovered network (with no journal attached)
+    """
+    if snapshot_path is not None and os.path.exists(snapshot_path):
+        network = snapshot.load(snapshot_path, network_class, node_class)
+        checkpoint_id = snapshot.read_checkpoint(snapshot_path)
+    else:
+        network = network_class()
+        checkpoint_id = 0
+    records = read_records(journal_path) if os.path.exists(journal_path) else []
+    start = 0
+    if checkpoint_id:
+        for index, (operation, values) in enumerate(records):
+            if operation == CHECKPOINT and values[0] == checkpoint_id:
+                start = index + 1
+                break
+        else:
+            raise JournalException("Checkpoint " + str(checkpoint_id) + " not found in the journal")
+    for operation, values in records[start:]:
+        _apply(network, operation, values, node_class)
+    return network
@@ -0,0 +1,270 @@
+import threading
+import time
+
+from .messaging import Key
+
+# Histogram buckets are log-linear (HDR style): values below 32ns have their own bucket, above that every power of
+# two is split in 16 sub buckets, i.e. ~6% precision over the whole range
+_SUB_BUCKETS = 16
+_QUANTILES = (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("p999", 0.999))
+
+
+def bucket_of(value):
+    """
+    :param value: a non negative integer (nanoseconds)
+    :return: the index of the bucket holding the value
+    """
+    shift = value.bit_length() - 5
+    if shift <= 0:
+        return value
+    return shift * _SUB_BUCKETS + (value >> shift)
+
+
+def bucket_bounds(index):
+    """
+    :param index: a bucket index
+    :return: (lowest value, highest value) of the bucket
+    """
+    if index < 2 * _SUB_BUCKETS:
+        return index, index
+    shift = index // _SUB_BUCKETS - 1
+    mantissa = index - shift * _SUB_BUCKETS
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+class _ThreadRecorder:
+    """
+    What a single thread recorded. Only its own thread writes into it, so recording needs no lock
+    """
+
+    def __init__(self):
+        self.histograms = {}  # name -> {bucket: count}
+        self.totals = {}  # name -> [count, sum, min, max]
+        self.counters = {}  # name -> value
+
+
+class Metrics:
+    """
+    Call counts, latency histograms and counters of an instrumented network.
+    Every thread records in its own recorder, recorders are merged only when a snapshot is taken.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._recorders = []
+        self._lock = threading.Lock()
+
+    def _recorder(self):
+        recorder = getattr(self._local, "recorder", None)
+        if recorder is None:
+            recorder = self._local.recorder = _ThreadRecorder()
+            with self._lock:
+                self._recorders.append(recorder)
+        return recorder
+
+    def record(self, name, nanoseconds):
+        """
+        Record one call of the operation
+        :param name: name of the operation
+        :param nanoseconds: duration of the call
+        :return:
+        """
+        recorder = self._recorder()
+        histogram = recorder.histograms.get(name)
+        if histogram is None:
+            histogram = recorder.histograms[name] = {}
+            recorder.totals[name] = [0, 0, nanoseconds, nanoseconds]
+        bucket = bucket_of(nanoseconds)
+        histogram[bucket] = histogram.get(bucket, 0) + 1
+        totals = recorder.totals[name]
+        totals[0] += 1
+        totals[1] += nanoseconds
+        if nanoseconds < totals[2]:
+            totals[2] = nanoseconds
+        if nanoseconds > totals[3]:
+            totals[3] = nanoseconds
+
+    def increment(self, name, amount=1):
+        """
+        Increase a counter
+        :param name: the counter name, or (name, ((label, value), ...)) for a labelled counter
+        :param amount: how much to add
+        :return:
+        """
+        counters = self._recorder().counters
+        counters[name] = counters.get(name, 0) + amount
+
+    def timed(self, name, function):
+        """
+        Wrap a callable so that every call is recorded under name
+        :param name: name of the operation
+        :param function: the callable to time
+        :return: the wrapper
+        """
+        record = self.record
+        clock = time.perf_counter_ns
+
+        def timed_call(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(name, clock() - start)
+        timed_call.__wrapped__ = function
+        return timed_call
+
+    def _merged(self):
+        with self._lock:
+            recorders = list(self._recorders)
+        histograms = {}
+        totals = {}
+        counters = {}
+        for recorder in recorders:
+            # other threads may still be recording: copy first, retry if a dict was resized meanwhile
+            while True:
+                try:
+                    recorder_histograms = {name: dict(histogram) for name, histogram in list(recorder.histograms.items())}
+                    recorder_totals = {name: list(values) for name, values in list(recorder.totals.items())}
+                    recorder_counters = dict(recorder.counters)
+                    break
+                except RuntimeError:
+                    continue
+            for name, histogram in recorder_histograms.items():
+                merged = histograms.setdefault(name, {})
+                for bucket, count in histogram.items():
+                    merged[bucket] = merged.get(bucket, 0) + count
+            for name, values in recorder_totals.items():
+                if name not in totals:
+                    totals[name] = values
+                else:
+                    merged = totals[name]
+                    merged[0] += values[0]
+                    merged[1] += values[1]
+                    merged[2] = min(merged[2], values[2])
+                    merged[3] = max(merged[3], values[3])
+            for name, value in recorder_counters.items():
+                counters[name] = counters.get(name, 0) + value
+        return histograms, totals, counters
+
+    def snapshot(self, mailbox_depths=None):
+        """
+        Merge what every thread recorded
+        :param mailbox_depths: dict node_id -> number of queued messages, added as it is
+        :return: dict with "calls", "latency" (seconds), "counters" and "mailbox_depth"
+        """
+        histograms, totals, counters = self._merged()
+        latency = {}
+        for name, histogram in histograms.items():
+            count, total, lowest, highest = totals[name]
+            entry = {"count": count, "sum": total / 1e9, "min": lowest / 1e9, "max": highest / 1e9}
+            ordered = sorted(histogram.items())
+            for label, quantile in _QUANTILES:
+                rank = quantile * count
+                seen = 0
+                for bucket, bucket_count in ordered:
+                    seen += bucket_count
+                    if seen >= rank:
+                        entry[label] = bucket_bounds(bucket)[1] / 1e9
+                        break
+            entry["buckets"] = [(bucket_bounds(bucket)[1] / 1e9, bucket_count) for bucket, bucket_count in ordered]
+            latency[name] = entry
+        return {
+            "calls": {name: values[0] for name, values in totals.items()},
+            "latency": latency,
+            "counters": counters,
+            "mailbox_depth": dict(mailbox_depths or {}),
+        }
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def to_prometheus(snapshot, prefix="communication_network"):
+    """
+    Render a snapshot in the Prometheus text exposition format
+    :param snapshot: a dict returned by Metrics.snapshot
+    :param prefix: prefix of every metric name
+    :return: the text
+    """
+    lines = ["# TYPE " + prefix + "_calls_total counter"]
+    for name, count in sorted(snapshot["calls"].items()):
+        lines.append(prefix + '_calls_total{op="' + _label(name) + '"} ' + str(count))
+    lines.append("# TYPE " + prefix + "_latency_seconds histogram")
+    for name, entry in sorted(snapshot["latency"].items()):
+        cumulative = 0
+        for upper, count in entry["buckets"]:
+            cumulative += count
+            lines.append(prefix + '_latency_seconds_bucket{op="' + _label(name) + '",le="' + repr(upper) + '"} ' +
+                         str(cumulative))
+        lines.append(prefix + '_latency_seconds_bucket{op="' + _label(name) + '",le="+Inf"} ' + str(entry["count"]))
+        lines.append(prefix + '_latency_seconds_sum{op="' + _label(name) + '"} ' + repr(entry["sum"]))
+        lines.append(prefix + '_latency_seconds_count{op="' + _label(name) + '"} ' + str(entry["count"]))
+    if snapshot["counters"]:
+        lines.append("# TYPE " + prefix + "_events_total counter")
+        for name, value in sorted(snapshot["counters"].items(), key=lambda item: str(item[0])):
+            if isinstance(name, tuple):
+                labels = "".join("," + key + '="' + _label(part) + '"' for key, part in name[1])
+                lines.append(prefix + '_events_total{event="' + _label(name[0]) + '"' + labels + "} " + str(value))
+            else:
+                lines.append(prefix + '_events_total{event="' + _label(name) + '"} ' + str(value))
+    lines.append("# TYPE " + prefix + "_mailbox_depth gauge")
+    for node_id, depth in snapshot["mailbox_depth"].items():
+        lines.append(prefix + '_mailbox_depth{node="' + _label(node_id) + '"} ' + str(depth))
+    return "\n".join(lines) + "\n"
+
+
+# Key.encode/decode are instrumented on the class (readers decode with the key objects cached by Registry.get_key, not
+# the ones of the persons), every enabled Metrics receives the timings. With nothing enabled the original methods are put back, so there is no overhead at all.
+_KEY_ORIGINALS = {"encode": Key.encode, "decode": Key.decode}
+_key_sinks = []
+
+
+def _key_hook(name, function):
+    clock = time.perf_counter_ns
+
+    def timed_call(*args, **kwargs):
+        start = clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = clock() - start
+            for sink in _key_sinks:
+                sink.record(name, elapsed)
+    timed_call.__wrapped__ = function
+    return timed_call
+
+
+def instrument_keys(metrics):
+    if metrics in _key_sinks:
+        return
+    _key_sinks.append(metrics)
+    if len(_key_sinks) == 1:
+        for method, function in _KEY_ORIGINALS.items():
+            setattr(Key, method, _key_hook("key." + method, function))
+
+
+def uninstrument_keys(metrics):
+    if metrics not in _key_sinks:
+        return
+    _key_sinks.remove(metrics)
+    if not _key_sinks:
+        for method, function in _KEY_ORIGINALS.items():
+            setattr(Key, method, function)
+
+
+def instrument(target, attribute, metrics, name):
+    """
+    Replace a bound method of target with a timed one (an instance attribute, the class is untouched)
+    """
+    if attribute in vars(target):
+        return
+    setattr(target, attribute, metrics.timed(name, getattr(target, attribute)))
+
+
+def uninstrument(target, attribute):
+    """
+    Put back the original method, i.e. drop the instance attribute set by instrument
+    """
+    if attribute in vars(target):
+        delattr(target, attribute)
@@ -0,0 +1,89 @@
+import heapq
+
+from .routing import shortest_paths, path_to
+
+
+class MulticastException(Exception):
+    """
+    A generic exception for problems while delivering to a group
+    """
+
+    pass
+
+
+def _minimum_spanning_tree(vertices, weight):
+    """
+    Prim on a complete graph
+    :param vertices: list of vertices
+    :param weight: function (u, v) -> cost of the edge
+    :return: list of (u, v) edges
+    """
+    if not vertices:
+        return []
+    best = {vertex: (weight(vertices[0], vertex), vertices[0]) for vertex in vertices[1:]}
+    edges = []
+    while best:
+        vertex = min(best, key=lambda candidate: best[candidate][0])
+        _, parent = best.pop(vertex)
+        edges.append((parent, vertex))
+        for other in best:
+            cost = weight(vertex, other)
+            if cost < best[other][0]:
+                best[other] = (cost, vertex)
+    return edges
+
+
+def steiner_tree(graph, terminals):
+    """
+    Approximate minimum Steiner tree (Kou, Markowsky and Berman heuristic, at most twice the optimum):
+    1. minimum spanning tree of the complete graph of the terminals weighted by shortest path distance
+    2. every edge of it replaced by its shortest path
+    3. minimum spanning tree of the resulting subgraph
+    4. leaves that are not terminals removed
+    :param graph: dict node_id -> list of (neighbor, cost)
+    :param terminals: the node ids that must be connected
+    :return: the tree as a dict node_id -> list of neighbor node ids
+    """
+    terminals = list(dict.fromkeys(terminals))
+    if len(terminals) <= 1:
+        return {terminal: [] for terminal in terminals}
+    paths = {terminal: shortest_paths(graph, terminal) for terminal in terminals}
+    for terminal in terminals[1:]:
+        if terminal not in paths[terminals[0]][0]:
+            raise MulticastException("Node " + str(terminal) + " is not reachable")
+
+    # steps 1 and 2
+    costs = {}
+    for u, v in _minimum_spanning_tree(terminals, lambda u, v: paths[u][0][v]):
+        path = path_to(paths[u][1], v)
+        for a, b in zip(path, path[1:]):
+            cost = min(link_cost for neighbor, link_cost in graph[a] if neighbor == b)
+            costs[(a, b)] = costs[(b, a)] = cost
+    # step 3, the subgraph is small: Prim with an adjacency dict
+    adjacency = {}
+    for a, b in costs:
+        adjacency.setdefault(a, []).append(b)
+    tree = {terminals[0]: []}
+    heap = [(costs[(terminals[0], b)], order, terminals[0], b) for order, b in enumerate(adjacency[terminals[0]])]
+    heapq.heapify(heap)
+    counter = len(heap)
+    while heap:
+        _, _, a, b = heapq.heappop(heap)
+        if b in tree:
+            continue
+        tree[a].append(b)
+        tree[b] = [a]
+        for c in adjacency[b]:
+            if c not in tree:
+                heapq.heappush(heap, (costs[(b, c)], counter, b, c))
+                counter += 1
+    # step 4
+    wanted = set(terminals)
+    leaves = [node_id for node_id, neighbors in tree.items() if len(neighbors) == 1 and node_id not in wanted]
+    while leaves:
+        leaf = leaves.pop()
+        (neighbor,) = tree.pop(leaf)
+        tree[neighbor].remove(leaf)
+        if len(tree[neighbor]) == 1 and neighbor not in wanted:
+            leaves.append(neighbor)
+    return tree
@@ -1,356 +1,1613 @@
-from registry import Registry, RegistryException
-from messaging import Priority
-from collections import defaultdict
-
-class InvalidNetworkException(Exception):
-    """
-    A generic exception for problems in the network
-    """
-    pass
-
-class Node:
-    def __init__(self, node_id):
-        """
-        Default constructor. If you need to set attributed, use explicit setters/getters. Do not add parameters here
-        :param node_id:
-        """
-        # Data members
-        self.node_id = node_id  
-        # for the all messages at a purticular node
-        # Format: person_if -> list of messages
-        self.messages = defaultdict(lambda: [])
-
-    # Being checked in test_smoke_tests.py
-    def receive(self, message):
-        """
-        Receive a message
-        :param message: an object with sender, priority, content, and recipient fields
-        :return:
-        """
-        # if none it means message is boradcasted and needs to be send to everyone
-        if message.receiver is None:
-            all_person_list = self.network._registry.database[self.node_id] # getting list of persons on that node
-            for key in all_person_list:
-                # check is person same as sender?
-                if message.sender != key:
-                    self.messages[key].append(message)
-        else:
-            # if not then only send message to the node
-            self.messages[message.receiver].append(message)
-
-    # Being checked in test_smoke_tests.py 
-    def get_all_messages(self, person):
-        """
-        Retrieve all the messages waiting to be read. If there are no messages, return an empty list
-        :param person: who received the messages (both direct and broadcast)
-        :return: the list of messages ordered by arrival time and priority
-        """
-
-        reading_messages = []
-        # loops for getting High and medium priority first and low
-        for message in self.messages[person.get_person_id()]:
-            if message.priority == Priority.HIGH:
-                reading_messages.append(message)
-        for message in self.messages[person.get_person_id()]:
-            if message.priority == Priority.MEDIUM:
-                reading_messages.append(message)
-        for message in self.messages[person.get_person_id()]:
-            if message.priority == Priority.LOW:
-                reading_messages.append(message)
-        # deleting messages from list as messages that are read hsort not be shown again
-        self.delete_specific_messages(person)
-        return reading_messages
-
-    # Being checked in test_smoke_tests.py via getting_all_messages function
-    def delete_specific_messages(self, person):
-        # delete messages of a specific person
-        self.messages[person.get_person_id()] = []
-
-
-class CommunicationNetwork:
-    def __init__(self):
-        """
-        Default initializer. The network contains nodes, links and the registry
-        """
-        self._registry = Registry()
-        self.network = {} # For storing graph in adjacency list
-        self.nodes = {} # For storing the nodes against their index
-        self.node_index_list = [] # for storing index of the nodes
-        self.persons = {} # For storing Persons
-
-    # Being checked in test_smoke_tests.py
-    # NOTE: REVIEWED `node_id` as a Node instance
-    def add(self, node):
-        """
-        Add a new node to the network. Fail with an InvalidNetworkException if a node with the same node_id exists.
-        :param node:
-        :return:
-        """
-        # checking if nodes are in list
-        if node.node_id in self.node_index_list:
-            raise InvalidNetworkException("Node already exist in the network")
-        # adding node to the network
-        self.network[node.node_id] = [] 
-        self.nodes[node.node_id] = node
-        self.node_index_list.append(node.node_id)
-
-    # Being checked in test_smoke_tests.py via delete remove function
-    def check_nodes_reachable(self):
-        """For checking if all nodes are reachable"""
-        visited = []  # for checking if a node is visited or not
-        if len(self.node_index_list) != 0:
-            # calling recursive function that traverse avery node(DFS)
-            CommunicationNetwork.check_node_at_index(self.network, visited, self.node_index_list[0])
-            # if length is equal to len of nodes then it means all nodes are reachable
-            if len(visited) != len(self.network):
-                return False
-        return True  
-    
-    # Helper function for checking - being chekced via check_nodes_reachable
-    def check_node_at_index(graph, visited, index):
-        if index in visited:
-            return
-        visited.append(index)
-        # traversing neighbors nodes
-        for node in graph[index]:
-            CommunicationNetwork.check_node_at_index(graph, visited, node[0])
-
-    # being checked in test_network.py
-    def remove(self, node):
-        """
-        Remove the node with the given node_id from the network. Do nothing if the node does not exist.
-        Disconnect all the persons that are attached to this node and discard any "unread" message.
-        Fail with an InvalidNetworkException if the network becomes invalid after removing the node.
-        :param node:
-        :return:
-        """
-        if node.node_id not in self.node_index_list:
-            raise InvalidNetworkException("Node not in the network")
-        # traversing all nodes
-        for key in self.network.keys():
-            for tup in self.network[key]:
-                # if node is in network
-                if node.node_id == tup[0]:
-                    self.network[key].remove(tup)
-        # deleting from network
-        del(self.network[node.node_id])
-        del(self.nodes[node.node_id])
-        self.node_index_list.remove(node.node_id)
-        # checking if all of the nodes are reachable
-        if self.check_nodes_reachable() == False:
-            raise InvalidNetworkException("All nodes are not reachable!")
-
-
-        
-    # Being checked in test_smoke_tests.py
-    def link(self, node_1, node_2, cost):
-        """
-        Connect the two nodes using an undirected/bi-directional link with a given cost.
-        - Fail with an InvalidNetworkException if the nodes are the same (no self-loop)
-        - Fail with an InvalidNetworkException if any of the nodes does not exist
-        - Fail with an InvalidNetworkException if the nodes are already linked
-        - Fail with an InvalidNetworkException if the cost is not positive
-        :param node_1:
-        :param node_2:
-        :param cost: non-zero, positive value
-        :return:
-        """
-        # checking different cases in which there should be exception
-        if node_1.node_id == node_2.node_id:
-            raise InvalidNetworkException("Same nodes!")
-        if node_1.node_id not in self.node_index_list or node_2.node_id not in self.node_index_list:
-            raise InvalidNetworkException("one of the node not exist")
-        if (node_1.node_id, cost) in self.network[node_2.node_id]:
-            raise InvalidNetworkException("Link already exists")
-        if cost < 0 :
-            raise InvalidNetworkException("Cost is negative")
-        # finally appending it to the network
-        self.network[node_1.node_id].append((node_2.node_id, cost))
-        self.network[node_2.node_id].append((node_1.node_id, cost))
-    
-    # being checked in test_network.py
-    def unlink(self, node_1, node_2):
-        """
-        Disconnect the two nodes. Do nothing if the nodes do not exist or are not connected
-        :param node_1:
-        :param node_2:
-        :return:
-        """
-        # checking if these nodes exist 
-        if node_1.node_id in self.node_index_list and node_2.node_id in self.node_index_list:
-            # traversing network
-            for tup in self.network[node_1.node_id]:
-                if node_2.node_id == tup[0]:
-                    # removing the link
-                    self.network[node_1.node_id].remove(tup)
-            for tup in self.network[node_2.node_id]:
-                # removing the link
-                if node_1.node_id == tup[0]:
-                    self.network[node_2.node_id].remove(tup)
-
-    # being checked in test_network.py
-    def is_valid(self): 
-        """
-        Validate the network
-        :return: True if the network is connected, i.e., each node is reachable from any other node (except itself)
-        """
-        return self.check_nodes_reachable()
-
-    # Being checked in test_smoke_tests.py
-    def broadcast(self, message):
-        """
-        Send the message from the sender to all connected recipients (but not the sender). Note: message.receiver must be None.
-        - Fail if message.receiver is not None
-        - Fail if message.sender is not registered in the network
-        :param message: an object with sender, priority, content, and recipient fields.
-        :return:
-        """
-        # checking the sender receiver is none
-        if message.receiver is not None:
-            raise Exception("Reciever is not none")
-        # person is connected ?
-        if self._registry.is_connected(message.sender) == False:
-            raise Exception("Sender is not connected to network")
-        # sending message to all nodes
-        for node in self.node_index_list:
-            # getting shortest path
-            shortest_path = self.get_shortest_path(message,node)
-            self.nodes[node].network = self # giving access to network for communication
-            # actually sending the message
-            self.nodes[node].receive(message)
-            # forwarding the message one by one
-            for i in range(len(shortest_path)):
-                self.forward(message, int(shortest_path[i]))
-            
-    # Being checked in test_smoke_tests.py via get_short_path function
-    def find_shortest_for_all(graph, vertex):
-        visited = []    # for checking if purticular node is visited
-        unvisited = list(graph.keys())
-        short_cost_table = {}    # for storing low_cost_path
-        for node in unvisited:
-            # storing arbitrary infinity (9999999999) value at index
-            # Dijkarstra Technique
-            short_cost_table[node] = [999999999999, vertex]
-        short_cost_table[vertex][0] = 0
-        # calling recursive function for (DFS) on graph
-        CommunicationNetwork.check_short_cost_at_index(graph, visited, unvisited, vertex, short_cost_table)
-        return short_cost_table
-    
-    # Being checked in test_smoke_tests.py via send function
-    def get_shortest_path(self, message, receiver):
-        # getting sender node from registry
-        sender_node = self._registry.get_node_id(message.sender)
-        # using Dijkstra Algorithm
-        shortest_path_table = CommunicationNetwork.find_shortest_for_all(self.network, sender_node)
-        temp = receiver
-        shortest_path = str(temp)
-        while True:
-            temp = shortest_path_table[temp][1]
-            if temp == sender_node:
-                break
-            # saving shortes path from table to a string
-            shortest_path += str(temp)
-        shortest_path = shortest_path[::-1] # revesing the string
-        return shortest_path
-
-    # Being checked in test_smoke_tests.py via find_shortest_for_all function
-    def check_short_cost_at_index(graph, visited, unvisited, vertex, short_cost_table):
-        # base case for recursion
-        if vertex in visited:
-            return
-        # adding to visited
-        visited.append(vertex)
-        unvisited.remove(vertex)
-        # travesing neighbors nodes
-        for node in graph[vertex]:
-            # checking if cost is lower
-            if node[1] + short_cost_table[vertex][0] < short_cost_table[node[0]][0]:
-                short_cost_table[node[0]][0] = node[1] + short_cost_table[vertex][0]
-                short_cost_table[node[0]][1] = vertex
-            # if not visited then visiting it
-            if node[0] not in visited:
-                CommunicationNetwork.check_short_cost_at_index(graph, visited, unvisited, node[0], short_cost_table)
-                visited.remove(node[0])
-                unvisited.append(node[0])
-
-    # Being checked in test_smoke_tests.py
-    def send(self, message):
-        """
-        Send the message from the sender to the recipient specified inside the message (i.e., message.receiver)
-        - Fail if message.receiver is not registered
-        - Fail if message.sender is not registered in the network
-        :param message: an object with sender, priority, content, and recipient fields
-        :return:
-        """
-        # sender and recepient are connected?
-        if self._registry.is_connected(message.sender) == False:
-            raise Exception("Sender is not connected to network")
-        if message.receiver is not None:
-            if self._registry.is_connected(message.receiver) == False:
-                raise Exception("Receiver is not connected to network")
-            receiver_node = self._registry.get_node_id(message.receiver)
-            shortest_path = self.get_shortest_path(message, receiver_node)
-            # forwarding the message
-            for i in range(len(shortest_path)):
-                self.forward(message, self.nodes[int(shortest_path[i])])
-            # actually sending the message
-            self.nodes[receiver_node].receive(message)
-            
-    # being checked in test_smoke_tests.py via send and broadcast
-    def forward(self, message, node):
-        """
-        Simulate the forward of the message to an (intermediate) node.
-        :param message:
-        :param node: node which the message is forwarded to
-        :return:
-        """
-        # just for showing that the message is being forward using shortest path
-        pass
-    
-    # being checked in test_smoke_tests.py
-    def join_network(self, person, node_id):
-        """
-        Register the person in the network, including adding all the information to the Registry
-        :param person: the person object that must be registered in the network at the given node
-        :param node_id: the id of the node which will become the gateway for the person
-        :return:
-        """
-        # adding to network
-        self.persons[person.get_person_id()] = person
-        # storing persons serailized key in registry
-        self._registry.insert(person.get_person_id(), node_id, person.get_serialized_key())
-        person.network = self # giving person the access to the network
-
-    # being checked in test_network.py 
-    def leave_network(self, person):
-        """
-        Remove this person and all the unread messages from the network and delete all the infos from the Registry
-        :param person:
-        :return:
-        """
-        # deleting person from the network persons
-        del(self.persons[person.get_person_id()])
-        # fetching node from the registry
-        node_id = self._registry.get_node_id(person.get_person_id())
-        # deleting messages from the node
-        if node_id is not None:
-            self.nodes[node_id].delete_specific_messages(person)
-        else:
-            raise RegistryException("Node not found")
-        # deleting from the registry
-        self._registry.delete(person.get_person_id())
-
-    # being checked in test_smoke_tests.py and test_network.py
-    def get_all_messages(self, person): 
-        """
-        Retrieve all the messages waiting to be read. If there are no messages, return an empty list
-        :param person: who received the messages (both direct and broadcast)
-        :return: the list of messages ordered by arrival time and priority
-        """
-        # fetching node from the registry
-        node_id = self._registry.get_node_id(person.get_person_id())
-        # getting messages of a person
-        if node_id is not None:
-            return self.nodes[node_id].get_all_messages(person)
-        else:
-            raise RegistryException("Node not found")
\ No newline at end of file
+from .registry import Registry, RegistryException
+from .messaging import Priority, MessageBundle, decode_message
+from .ratelimit import RateLimiter, RateLimitException
+from collections import defaultdict, deque
+import heapq
+import itertools
+import threading
+import time
+import zlib
+from contextlib import nullcontext
+from . import snapshot
+from . import journal as wal
+from . import multicast
+from . import routing
+
+class InvalidNetworkException(Exception):
+    """
+    A generic exception for problems in the network
+    """
+    pass
+
+# what CommunicationNetwork._guard gives when no coalescing timer can deliver concurrently
+_UNGUARDED = nullcontext()
+
+# sequence numbers remembered per sender by every node, see Node.is_duplicate
+DUPLICATE_WINDOW = 1024
+_WINDOW_MASK = (1 << DUPLICATE_WINDOW) - 1
+
+# default bound of the messages deferred per person by admission control, see Node.set_admission
+MAX_DEFERRED = 1024
+
+# arrival numbers of the queued messages, unique across nodes so that a moved mailbox keeps them
+_ARRIVALS = itertools.count()
+
+class Mailbox:
+    """
+    The messages queued for a person on a node, in arrival order. Every message gets an arrival number: one deque of
+    them per priority gives the oldest message of the lowest priority in O(1), and a message is removed (expired,
+    dropped) by its arrival number in O(1) too. Read like the list it replaces: iteration, len, indexing, ==
+    """
+    __slots__ = ("_entries", "_queues")
+
+    def __init__(self, messages=()):
+        self._entries = {} # arrival number -> message, in arrival order
+        self._queues = tuple(deque() for _ in Priority) # arrival numbers per priority, removed ones are skipped
+        self.extend(messages)
+
+    def append(self, message):
+        """
+        :return: the arrival number of the message
+        """
+        arrival = next(_ARRIVALS)
+        self._entries[arrival] = message
+        self._queues[message.priority].append(arrival)
+        return arrival
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def items(self):
+        """
+        :return: the (arrival number, message) pairs in arrival order
+        """
+        return self._entries.items()
+
+    def holds(self, arrival):
+        return arrival in self._entries
+
+    def discard(self, arrival):
+        """
+        Remove a message by its arrival number
+        :return: the message, None if it is not queued here anymore
+        """
+        message = self._entries.pop(arrival, None)
+        # compacting the priority queues once they are mostly made of removed numbers
+        if message is not None and sum(map(len, self._queues)) > 2 * len(self._entries) + 16:
+            entries = self._entries
+            self._queues = tuple(deque(number for number in queue if number in entries) for queue in self._queues)
+        return message
+
+    def pop_lowest(self):
+        """
+        Remove the oldest message of the lowest priority
+        :return: (arrival number, message), None if the mailbox is empty
+        """
+        for queue in self._queues:
+            while queue:
+                arrival = queue.popleft()
+                message = self._entries.pop(arrival, None)
+                if message is not None:
+                    return arrival, message
+        return None
+
+    def by_priority(self):
+        """
+        :return: list of the messages, high and medium priority first and low, in arrival order within a priority
+        """
+        entries = self._entries
+        return [entries[arrival] for queue in reversed(self._queues) for arrival in queue if arrival in entries]
+
+    def __iter__(self):
+        return iter(self._entries.values())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, index):
+        return list(self._entries.values())[index]
+
+    def __eq__(self, other):
+        if isinstance(other, (Mailbox, list)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "Mailbox(%r)" % list(self)
+
+class Node:
+    def __init__(self, node_id):
+        """
+        Default constructor. If you need to set attributed, use explicit setters/getters. Do not add parameters here
+        :param node_id:
+        """
+        # Data members
+        self.node_id = node_id  
+        self.network = None # set when the node is added to a network
+        # for the all messages at a purticular node
+        # Format: person_if -> Mailbox of messages
+        self.messages = defaultdict(Mailbox)
+        self._expiry = [] # heap of (deadline, arrival number, person_id), see expire
+        self._limits = None # (max_messages, max_messages_per_person), see set_limits
+        self._arrivals = {} # priority -> (arrival number, person_id) in arrival order, kept only with limits
+        self._size = 0 # queued messages, kept only with limits
+        # arrival and expiry entries left behind by messages read or moved away, see _forget
+        self._stale_arrivals = 0
+        self._stale_expiry = 0
+        self._admission = None # (max_depth, defer), see set_admission
+        self._deferred = {} # person_id -> deque of messages waiting for room in the mailbox
+        self._windows = {} # sender -> [highest sequence seen, bitmap of the last DUPLICATE_WINDOW sequences]
+
+    # Being checked in test_smoke_tests.py
+    def receive(self, message):
+        """
+        Receive a message
+        :param message: an object with sender, priority, content, and recipient fields
+        :return:
+        """
+        # a bundle of messages routed together is split apart here, its persons are notified once for all of them
+        bundled = message.messages if isinstance(message, MessageBundle) else (message,)
+        stored = []
+        for single in bundled:
+            stored.extend(self._receive(single))
+        self._notify(stored)
+
+    def _receive(self, message):
+        """
+        Deliver a single message, see receive
+        :return: the persons who got it
+        """
+        # a retried send: already delivered, nothing to store or decode again
+        if message.sequence is not None and self._seen(message.sender, message.sequence):
+            return []
+        # if none it means message is boradcasted and needs to be send to everyone
+        if message.receiver is None:
+            all_person_list = self.network._registry.database[self.node_id] # getting list of persons on that node
+            # check is person same as sender?
+            receivers = [key for key in all_person_list if message.sender != key]
+        else:
+            # if not then only send message to the node
+            receivers = [message.receiver]
+        stored = [person_id for person_id in receivers if self._store(person_id, message)]
+        # seen once admitted (or with nobody to deliver to): a retry of a refused message is delivered
+        if message.sequence is not None and (stored or not receivers):
+            self._record(message.sender, message.sequence)
+        # logging the delivery if the network keeps a journal, once admitted: refused or deferred messages must not
+        # come back on recovery
+        if stored and self.network is not None and self.network.journal is not None:
+            self._log_receive(message, None if len(stored) == len(receivers) else stored)
+        return stored
+
+    def receive_multicast(self, message, person_ids):
+        """
+        Receive a group message for some of the persons attached to this node. The message object is shared by
+        their mailboxes
+        :param message: an object with sender, priority, content, and recipient fields
+        :param person_ids: the recipients attached to this node
+        :return:
+        """
+        if message.sequence is not None and self._seen(message.sender, message.sequence):
+            return
+        stored = [person_id for person_id in person_ids if self._store(person_id, message)]
+        if stored and message.sequence is not None:
+            self._record(message.sender, message.sequence)
+        # journaled once for the node with the persons who admitted it
+        if stored and self.network is not None and self.network.journal is not None:
+            self._log_receive(message, stored)
+        self._notify(stored)
+
+    def replay_receive(self, message, person_ids):
+        """
+        Journal replay of a delivery to some of the persons of this node. The record says who got the message, so the
+        duplicate window is not asked: a message deferred then admitted has its sequence seen already
+        :return:
+        """
+        stored = [person_id for person_id in person_ids if self._store(person_id, message)]
+        if message.sequence is not None:
+            self._record(message.sender, message.sequence)
+        self._notify(stored)
+
+    def _notify(self, person_ids):
+        """
+        Wake the subscribers of the persons who got messages. Called once the delivery is journaled, once per person
+        for a whole bundle or release
+        :param person_ids: the persons who got messages, with repeats
+        :return:
+        """
+        watched = self.network._watched if self.network is not None else None
+        if not watched:
+            return
+        for person_id in dict.fromkeys(person_ids):
+            person = watched.get(person_id)
+            if person is not None:
+                person.notify()
+
+    def is_duplicate(self, sender, sequence):
+        """
+        Sliding window of the sequence numbers received from a sender: the highest one and a bitmap of the
+        DUPLICATE_WINDOW before it, so the memory per sender is bounded. Records the sequence as seen
+        :return: True if the sequence was already seen, or is too old to tell
+        """
+        if self._seen(sender, sequence):
+            return True
+        self._record(sender, sequence)
+        return False
+
+    def _seen(self, sender, sequence):
+        window = self._windows.get(sender)
+        if window is None or sequence > window[0]:
+            return False
+        offset = window[0] - sequence
+        if offset >= DUPLICATE_WINDOW or window[1] >> offset & 1:
+            if self.network is not None:
+                self.network._count("duplicates_suppressed", (("node", self.node_id),))
+            return True
+        return False
+
+    def _record(self, sender, sequence):
+        window = self._windows.get(sender)
+        if window is None:
+            self._windows[sender] = [sequence, 1]
+            return
+        highest, seen = window
+        if sequence > highest:
+            shift = sequence - highest
+            window[0] = sequence
+            window[1] = ((seen << shift) | 1) & _WINDOW_MASK if shift < DUPLICATE_WINDOW else 1
+        elif highest - sequence < DUPLICATE_WINDOW:
+            window[1] = seen | (1 << (highest - sequence))
+
+    def _log_receive(self, message, recipients=None):
+        """
+        Journal a delivery to this node: one record, replayed as a single delivery so that the sequence is seen once
+        :param recipients: the persons who got the message, None when they are the ones receive finds again (the
+            receiver, or everyone on the node for a broadcast)
+        """
+        values = [message.sender, message.content, int(message.priority), message.receiver]
+        # the sequence comes after the deadline, so that the duplicate windows are rebuilt on recovery
+        if message.deadline is not None or message.sequence is not None or recipients:
+            values.append(message.deadline)
+        if message.sequence is not None or recipients:
+            values.append(message.sequence)
+        if recipients:
+            values.extend(recipients)
+        self.network.journal.append(wal.RECEIVE, self.node_id, *values)
+
+    def _store(self, person_id, message):
+        """
+        Put the message in the mailbox of the person, indexing its deadline and enforcing the limits
+        :return: True if the message is queued, False if it was refused, deferred, already expired or dropped at once
+        """
+        mailbox = self.messages[person_id]
+        if self._admission is not None and len(mailbox) >= self._admission[0]:
+            max_depth, defer, max_deferred = self._admission
+            if defer:
+                deferred = self._deferred.setdefault(person_id, deque())
+                # past the bound the message is rejected after all
+                defer = len(deferred) < max_deferred
+                if defer:
+                    deferred.append(message)
+                    # delivered later: a retry must not be deferred a second time
+                    if message.sequence is not None:
+                        self._record(message.sender, message.sequence)
+            if self.network is not None:
+                self.network._count("admission_deferred" if defer else "admission_rejected",
+                                   (("node", self.node_id),))
+            return False
+        if message.deadline is not None or self._expiry:
+            now = time.time()
+            # sweeping here keeps the heap and the mailboxes small without a timer
+            if self._expiry and self._expiry[0][0] <= now:
+                self.expire(now)
+            if message.deadline is not None and message.deadline <= now:
+                return False
+        arrival = mailbox.append(message)
+        if message.deadline is not None:
+            heapq.heappush(self._expiry, (message.deadline, arrival, person_id))
+        if self._limits is not None:
+            self._size += 1
+            self._arrivals[message.priority].append((arrival, person_id))
+            if self._apply_limits(mailbox, arrival):
+                return False
+        return True
+
+    def _apply_limits(self, mailbox, arrival=-1):
+        """
+        Drop the lowest priority, oldest messages while a limit is exceeded, after messages were added to the mailbox
+        :param arrival: arrival number of the message just queued
+        :return: True if that message was dropped itself
+        """
+        max_messages, max_messages_per_person = self._limits
+        dropped = False
+        while max_messages_per_person is not None and len(mailbox) > max_messages_per_person:
+            victim, message = mailbox.pop_lowest()
+            self._size -= 1
+            self._forget(1, message.deadline is not None)
+            dropped = dropped or victim == arrival
+        while max_messages is not None and self._size > max_messages:
+            dropped = self._drop_lowest() == arrival or dropped
+        return dropped
+
+    def _drop_lowest(self):
+        """
+        Drop the oldest message of the lowest priority queued on the node
+        :return: its arrival number, None if nothing is queued
+        """
+        for priority in sorted(self._arrivals):
+            arrivals = self._arrivals[priority]
+            while arrivals:
+                arrival, person_id = arrivals.popleft()
+                mailbox = self.messages.get(person_id)
+                message = mailbox.discard(arrival) if mailbox is not None else None
+                if message is not None:
+                    self._size -= 1
+                    self._forget(0, message.deadline is not None)
+                    return arrival
+                # an entry of a message already read, expired or dropped
+                self._stale_arrivals = max(self._stale_arrivals - 1, 0)
+        return None
+
+    def _holds(self, arrival, person_id):
+        mailbox = self.messages.get(person_id)
+        return mailbox is not None and mailbox.holds(arrival)
+
+    def _forget(self, arrivals, deadlines):
+        """
+        Messages left their mailbox (read, moved, dropped, expired) but their arrival or expiry entries stay behind.
+        Those are skipped when met, the queues are compacted once they are mostly made of them
+        :param arrivals: number of arrival entries left behind
+        :param deadlines: number of expiry entries left behind
+        :return:
+        """
+        if self._arrivals and arrivals:
+            self._stale_arrivals += arrivals
+            if self._stale_arrivals > 64 and 2 * self._stale_arrivals > sum(map(len, self._arrivals.values())):
+                for priority, entries in self._arrivals.items():
+                    self._arrivals[priority] = deque(entry for entry in entries if self._holds(*entry))
+                self._stale_arrivals = 0
+        if self._expiry and deadlines:
+            self._stale_expiry += deadlines
+            if self._stale_expiry > 64 and 2 * self._stale_expiry > len(self._expiry):
+                self._expiry = [entry for entry in self._expiry if self._holds(entry[1], entry[2])]
+                heapq.heapify(self._expiry)
+                self._stale_expiry = 0
+
+    def set_limits(self, max_messages=None, max_messages_per_person=None):
+        """
+        Cap the number of queued messages. When a cap is exceeded the lowest priority message is dropped, the oldest
+        one among those with the same priority
+        :param max_messages: max messages queued on the node, None for no limit
+        :param max_messages_per_person: max messages queued for a single person, None for no limit
+        :return:
+        """
+        self._stale_arrivals = 0
+        if max_messages is None and max_messages_per_person is None:
+            self._limits = None
+            self._arrivals = {}
+            return
+        self._limits = (max_messages, max_messages_per_person)
+        # the arrival numbers give back the order in which the messages already queued came in
+        queued = sorted((arrival, person_id, message.priority)
+                        for person_id, mailbox in self.messages.items() for arrival, message in mailbox.items())
+        self._arrivals = {priority: deque() for priority in Priority}
+        for arrival, person_id, priority in queued:
+            self._arrivals[priority].append((arrival, person_id))
+        self._size = len(queued)
+
+    def expire(self, now=None):
+        """
+        Evict the messages whose deadline has passed. Only the expiry heap is visited, not every mailbox
+        :param now: the current time (time.time()), defaults to now
+        :return: the number of evicted messages
+        """
+        if now is None:
+            now = time.time()
+        evicted = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            _, arrival, person_id = heapq.heappop(self._expiry)
+            mailbox = self.messages.get(person_id)
+            if mailbox is not None and mailbox.discard(arrival) is not None:
+                evicted += 1
+            else:
+                self._stale_expiry = max(self._stale_expiry - 1, 0)
+        if self._limits is not None:
+            self._size -= evicted
+            self._forget(evicted, 0)
+        return evicted
+
+    # Being checked in test_smoke_tests.py 
+    def get_all_messages(self, person):
+        """
+        Retrieve all the messages waiting to be read. If there are no messages, return an empty list
+        :param person: who received the messages (both direct and broadcast)
+        :return: the list of messages ordered by arrival time and priority. Expired messages are left out
+        """
+        reading_messages = self.messages[person.get_person_id()].by_priority()
+        if self._expiry or any(message.deadline is not None for message in reading_messages):
+            now = time.time()
+            reading_messages = [message for message in reading_messages
+                                if message.deadline is None or message.deadline > now]
+        # journaled before the deferred messages take the room of the read ones
+        if self.network is not None and self.network.journal is not None:
+            self.network.journal.append(wal.READ, self.node_id, person.get_person_id())
+        # deleting messages from list as messages that are read hsort not be shown again
+        self.delete_specific_messages(person)
+        return reading_messages
+
+    def drain_all(self):
+        """
+        Read the mailboxes of every person attached to this node in one pass, for gateways delivering them all at
+        once. The key of every sender is looked up once for the whole node, and a message queued for several persons
+        (broadcast, group) is decoded once
+        - Fails with an InvalidNetworkException if the node is not part of a network
+        :return: dict person_id -> ORDERED list of decoded messages, as Person.get_all_messages returns them. Persons
+            with an empty mailbox get an empty list
+        """
+        network = self.network
+        if network is None:
+            raise InvalidNetworkException("Node is not part of a network")
+        # messages held by the coalescing window are delivered first
+        network.flush()
+        registry = network._registry
+        now = time.time()
+        mailboxes = {}
+        for person_id in list(registry.database.get(self.node_id, ())):
+            queued = self.messages.get(person_id)
+            queued = queued.by_priority() if queued else []
+            if self._expiry or any(message.deadline is not None for message in queued):
+                queued = [message for message in queued if message.deadline is None or message.deadline > now]
+            mailboxes[person_id] = queued
+
+        keys = {} # sender -> Key
+        journal = network.journal
+        for person_id, mailbox in mailboxes.items():
+            decoded_messages = []
+            for message in mailbox:
+                key = keys.get(message.sender)
+                if key is None:
+                    key = keys[message.sender] = registry.get_key(message.sender)
+                decoded_messages.append(decode_message(message, key))
+            mailboxes[person_id] = decoded_messages
+            if self.messages.get(person_id) or person_id in self._deferred:
+                if journal is not None:
+                    journal.append(wal.READ, self.node_id, person_id)
+                self._clear_mailbox(person_id)
+        return mailboxes
+
+    def set_admission(self, max_depth=None, defer=False, max_deferred=MAX_DEFERRED):
+        """
+        Admission control: a delivery to a mailbox holding max_depth messages is rejected, or deferred until the
+        mailbox is read when defer is True
+        :param max_depth: None to admit everything (deferred messages are then delivered)
+        :param defer: keep the refused messages instead of dropping them
+        :param max_deferred: max messages deferred per person, the next ones are rejected
+        :return:
+        """
+        self._admission = None if max_depth is None else (max_depth, defer, max_deferred)
+        for person_id in list(self._deferred):
+            self._release_deferred(person_id)
+
+    def _release_deferred(self, person_id):
+        deferred = self._deferred.pop(person_id, None)
+        # stored again one by one: what does not fit yet goes back to the deferred queue
+        journal = self.network.journal if self.network is not None else None
+        admitted = False
+        while deferred:
+            message = deferred.popleft()
+            # journaled now that it is admitted
+            if self._store(person_id, message):
+                admitted = True
+                if journal is not None:
+                    self._log_receive(message, [person_id])
+        if admitted:
+            self._notify([person_id])
+
+    def take_mailbox(self, person_id):
+        """
+        Detach the queued messages of a person from this node, see put_mailbox
+        :return: the Mailbox itself (not a copy), empty if nothing is queued
+        """
+        mailbox = self.messages.pop(person_id, None) or Mailbox()
+        # the arrival and expiry entries of these messages are skipped from now on, their mailbox is gone
+        self._left(mailbox)
+        return mailbox
+
+    def take_deferred(self, person_id):
+        """
+        Detach the messages of a person waiting for admission on this node, see put_deferred
+        :return: deque of messages, empty if none
+        """
+        return self._deferred.pop(person_id, None) or deque()
+
+    def put_deferred(self, person_id, messages):
+        """
+        Messages deferred on another node: they queue behind the ones deferred here and are admitted through _store
+        as soon as there is room, journaled once admitted
+        :param person_id:
+        :param messages: the messages in the order they were deferred
+        :return:
+        """
+        if messages:
+            self._deferred.setdefault(person_id, deque()).extend(messages)
+            self._release_deferred(person_id)
+
+    def put_mailbox(self, person_id, mailbox):
+        """
+        Attach a mailbox taken from another node. A Mailbox is kept as it is when nothing is queued here yet, only the
+        deadlines and the limits of this node are applied to its messages
+        :param person_id:
+        :param mailbox: Mailbox, or list of messages in arrival order
+        :return:
+        """
+        queued = self.messages.get(person_id)
+        if isinstance(mailbox, Mailbox) and not queued:
+            self.messages[person_id] = mailbox
+            added = list(mailbox.items())
+        else:
+            # after the messages already queued here
+            queued = self.messages[person_id]
+            added = [(queued.append(message), message) for message in mailbox]
+            mailbox = queued
+        for arrival, message in added:
+            if message.deadline is not None:
+                heapq.heappush(self._expiry, (message.deadline, arrival, person_id))
+        if self._limits is not None:
+            self._size += len(added)
+            for arrival, message in added:
+                self._arrivals[message.priority].append((arrival, person_id))
+            self._apply_limits(mailbox)
+
+    # Being checked in test_smoke_tests.py via getting_all_messages function
+    def delete_specific_messages(self, person):
+        # delete messages of a specific person
+        self._clear_mailbox(person.get_person_id())
+
+    def _clear_mailbox(self, person_id):
+        mailbox = self.messages.get(person_id)
+        if mailbox:
+            self._left(mailbox)
+            self.messages[person_id] = Mailbox()
+        # deferred messages take the room left by the read ones
+        if person_id in self._deferred:
+            self._release_deferred(person_id)
+
+    def _left(self, mailbox):
+        # all the messages of a mailbox read or moved away
+        if self._limits is not None:
+            self._size -= len(mailbox)
+        self._forget(len(mailbox), sum(message.deadline is not None for message in mailbox) if self._expiry else 0)
+
+class CommunicationNetwork:
+    def __init__(self):
+        """
+        Default initializer. The network contains nodes, links and the registry
+        """
+        self._registry = Registry()
+        self.network = {} # For storing graph in adjacency list
+        self.nodes = {} # For storing the nodes against their index
+        self.node_index_list = [] # for storing index of the nodes
+        self.persons = {} # For storing Persons
+        self.journal = None # optional write-ahead log, see attach_journal
+        self._metrics = None # set by enable_metrics
+        self._trace_every = 0 # see set_trace_sampling
+        self._trace_counter = 0
+        self._watched = {} # person_id -> Person with subscriptions, see Person.subscribe
+        self._coalescing = None # (window, max_messages) when enabled, see enable_coalescing
+        self._held = {} # (source node, target node) -> messages waiting for the coalescing window
+        self._held_since = 0
+        self._held_lock = threading.RLock() # the window timer delivers from its own thread
+        self._flush_timer = None
+        self._topology_version = 0 # bumped on every node or link change, invalidates the multicast trees
+        # group name -> (topology version, group version, tree, members by node, plans by sending node)
+        self._multicast_trees = {}
+        self._node_limits = None # (max_messages, max_messages_per_person) given to every node, see set_limits
+        self._routing_index = None # (topology version, ContractionHierarchy), see build_routing_index
+        self._multipath = None # (mode, k) when enabled, see set_multipath
+        self._multipath_routes = (0, {}) # (topology version, source node or (source, target) -> paths)
+        self._flow_sequence = itertools.count() # seq of the (sender, receiver, seq) flow keys
+        self._reroute = None # (topology version, ForwardingTables, failed nodes, failed links), see enable_fast_reroute
+        self._reroute_background = True
+        self._reroute_lock = threading.Lock()
+        self._failures = [] # (topology version, failed node or None, failed link or None) not in the tables yet
+        self._rebuild_pending = None # (topology version, copy of the graph) waiting for the rebuild thread
+        self._rebuild_thread = None
+        self._rate_limiter = None # see set_rate_limit
+        self._node_admission = None # (max_depth, defer) given to every node, see set_admission
+        # always on, also recorded by the metrics when they are enabled
+        self.edge_counters = {"rate_limited": 0, "admission_rejected": 0, "admission_deferred": 0,
+                              "duplicates_suppressed": 0, "callback_errors": 0}
+
+    # Being checked in test_smoke_tests.py
+    # NOTE: REVIEWED `node_id` as a Node instance
+    def add(self, node):
+        """
+        Add a new node to the network. Fail with an InvalidNetworkException if a node with the same node_id exists.
+        :param node:
+        :return:
+        """
+        # checking if nodes are in list
+        if node.node_id in self.node_index_list:
+            raise InvalidNetworkException("Node already exist in the network")
+        # adding node to the network
+        self.network[node.node_id] = [] 
+        self.nodes[node.node_id] = node
+        self.node_index_list.append(node.node_id)
+        node.network = self # giving node the access to the network
+        self._topology_version += 1
+        self._topology_changed()
+        if self._node_limits is not None:
+            node.set_limits(*self._node_limits)
+        if self._node_admission is not None:
+            node.set_admission(*self._node_admission)
+        if self._metrics is not None:
+            from . import metrics as instrumentation
+            instrumentation.instrument(node, "receive", self._metrics, "node.receive")
+        if self.journal is not None:
+            self.journal.append(wal.ADD, node.node_id)
+
+    # Being checked in test_smoke_tests.py via delete remove function
+    def check_nodes_reachable(self):
+        """For checking if all nodes are reachable"""
+        visited = []  # for checking if a node is visited or not
+        if len(self.node_index_list) != 0:
+            # calling recursive function that traverse avery node(DFS)
+            CommunicationNetwork.check_node_at_index(self.network, visited, self.node_index_list[0])
+            # if length is equal to len of nodes then it means all nodes are reachable
+            if len(visited) != len(self.network):
+                return False
+        return True  
+    
+    # Helper function for checking - being chekced via check_nodes_reachable
+    def check_node_at_index(graph, visited, index):
+        if index in visited:
+            return
+        visited.append(index)
+        # traversing neighbors nodes
+        for node in graph[index]:
+            CommunicationNetwork.check_node_at_index(graph, visited, node[0])
+
+    # being checked in test_network.py
+    def remove(self, node):
+        """
+        Remove the node with the given node_id from the network. Do nothing if the node does not exist.
+        Disconnect all the persons that are attached to this node and discard any "unread" message.
+        Fail with an InvalidNetworkException if the network becomes invalid after removing the node.
+        :param node:
+        :return:
+        """
+        if node.node_id not in self.node_index_list:
+            raise InvalidNetworkException("Node not in the network")
+        # the coalesced messages from or to this node are delivered while it can still be routed to
+        with self._held_lock:
+            for source_node, target_node in list(self._held):
+                if node.node_id in (source_node, target_node):
+                    self._deliver_bundle(source_node, target_node, self._held.pop((source_node, target_node)))
+        # traversing all nodes
+        for key in self.network.keys():
+            for tup in self.network[key]:
+                # if node is in network
+                if node.node_id == tup[0]:
+                    self.network[key].remove(tup)
+        # deleting from network
+        del(self.network[node.node_id])
+        del(self.nodes[node.node_id])
+        self.node_index_list.remove(node.node_id)
+        self._topology_version += 1
+        self._topology_changed(failed_node=node.node_id)
+        if self.journal is not None:
+            self.journal.append(wal.REMOVE, node.node_id)
+        # checking if all of the nodes are reachable
+        if self.check_nodes_reachable() == False:
+            raise InvalidNetworkException("All nodes are not reachable!")
+
+
+        
+    # Being checked in test_smoke_tests.py
+    def link(self, node_1, node_2, cost):
+        """
+        Connect the two nodes using an undirected/bi-directional link with a given cost.
+        - Fail with an InvalidNetworkException if the nodes are the same (no self-loop)
+        - Fail with an InvalidNetworkException if any of the nodes does not exist
+        - Fail with an InvalidNetworkException if the nodes are already linked
+        - Fail with an InvalidNetworkException if the cost is not positive
+        :param node_1:
+        :param node_2:
+        :param cost: non-zero, positive value
+        :return:
+        """
+        # checking different cases in which there should be exception
+        if node_1.node_id == node_2.node_id:
+            raise InvalidNetworkException("Same nodes!")
+        if node_1.node_id not in self.node_index_list or node_2.node_id not in self.node_index_list:
+            raise InvalidNetworkException("one of the node not exist")
+        if (node_1.node_id, cost) in self.network[node_2.node_id]:
+            raise InvalidNetworkException("Link already exists")
+        if cost < 0 :
+            raise InvalidNetworkException("Cost is negative")
+        # finally appending it to the network
+        self.network[node_1.node_id].append((node_2.node_id, cost))
+        self.network[node_2.node_id].append((node_1.node_id, cost))
+        self._topology_version += 1
+        self._topology_changed()
+        if self.journal is not None:
+            self.journal.append(wal.LINK, node_1.node_id, node_2.node_id, cost)
+    
+    # being checked in test_network.py
+    def unlink(self, node_1, node_2):
+        """
+        Disconnect the two nodes. Do nothing if the nodes do not exist or are not connected
+        :param node_1:
+        :param node_2:
+        :return:
+        """
+        # checking if these nodes exist 
+        if node_1.node_id in self.node_index_list and node_2.node_id in self.node_index_list:
+            # traversing network
+            for tup in self.network[node_1.node_id]:
+                if node_2.node_id == tup[0]:
+                    # removing the link
+                    self.network[node_1.node_id].remove(tup)
+            for tup in self.network[node_2.node_id]:
+                # removing the link
+                if node_1.node_id == tup[0]:
+                    self.network[node_2.node_id].remove(tup)
+            self._topology_version += 1
+            self._topology_changed(failed_link=(node_1.node_id, node_2.node_id))
+            if self.journal is not None:
+                self.journal.append(wal.UNLINK, node_1.node_id, node_2.node_id)
+
+    # being checked in test_network.py
+    def is_valid(self): 
+        """
+        Validate the network
+        :return: True if the network is connected, i.e., each node is reachable from any other node (except itself)
+        """
+        return self.check_nodes_reachable()
+
+    # Being checked in test_smoke_tests.py
+    def broadcast(self, message):
+        """
+        Send the message from the sender to all connected recipients (but not the sender). Note: message.receiver must be None.
+        - Fail if message.receiver is not None
+        - Fail if message.sender is not registered in the network
+        :param message: an object with sender, priority, content, and recipient fields.
+        :return:
+        """
+        # checking the sender receiver is none
+        if message.receiver is not None:
+            raise Exception("Reciever is not none")
+        # person is connected ?
+        if self._registry.is_connected(message.sender) == False:
+            raise Exception("Sender is not connected to network")
+        self._check_rate(message)
+        with self._guard():
+            # held unicast messages go first so that the order of the sends is kept
+            self.flush()
+            self._sample_trace(message)
+            sender_node = self._registry.get_node_id(message.sender)
+            # one shortest path tree gives the routes to every node
+            _, previous = routing.shortest_paths(self.network, sender_node)
+            # sending message to all nodes
+            for node in self.node_index_list:
+                # getting shortest path
+                shortest_path = routing.path_to(previous, node)[1:] or [sender_node]
+                self.nodes[node].network = self # giving access to network for communication
+                # actually sending the message
+                self.nodes[node].receive(message)
+                # forwarding the message one by one
+                self._forward_along(message, sender_node, shortest_path)
+            
+    # Being checked in test_smoke_tests.py via get_short_path function
+    def find_shortest_for_all(graph, vertex):
+        """
+        Cheapest paths from vertex to every node
+        :return: dict node_id -> [cost, previous node on the path] (the previous node of vertex is vertex itself)
+        """
+        distances, previous = routing.shortest_paths(graph, vertex)
+        short_cost_table = {}    # for storing low_cost_path
+        for node in graph:
+            # storing arbitrary infinity (9999999999) value for the unreachable nodes
+            parent = previous.get(node)
+            short_cost_table[node] = [distances.get(node, 999999999999), vertex if parent is None else parent]
+        return short_cost_table
+
+    # Being checked in test_smoke_tests.py via send function
+    def get_shortest_path(self, message, receiver):
+        """
+        :return: the list of node ids the message goes through after the sender's node, the receiver node included
+        """
+        # getting sender node from registry
+        sender_node = self._registry.get_node_id(message.sender)
+        return self.route(sender_node, receiver, self._flow_key(message))
+
+    def route(self, source_node, target_node, flow=None):
+        """
+        :param flow: when multipath routing is enabled, the hash used to choose between the paths (see _flow_key)
+        :return: the list of node ids on the cheapest path after source_node, target_node included
+            ([source_node] when both are the same node)
+        """
+        if source_node == target_node:
+            return [source_node]
+        if flow is not None and self._multipath is not None:
+            return self._multipath_route(source_node, target_node, flow)
+        reroute = self._reroute
+        if reroute is not None:
+            # up to date tables give the cheapest path, stale ones route around the failures with the alternates
+            try:
+                return reroute[1].path(source_node, target_node, reroute[2], reroute[3])[1:]
+            except routing.RoutingException:
+                pass
+        index = self._routing_index
+        if index is not None and index[0] == self._topology_version:
+            _, path = index[1].query(source_node, target_node)
+        else:
+            # point to point search from both ends, it stops when they meet instead of covering the whole network
+            _, path = routing.bidirectional_shortest_path(self.network, source_node, target_node)
+        return path[1:]
+
+    def build_routing_index(self, witness_limit=64):
+        """
+        Preprocess the topology into a contraction hierarchy so that routes are answered by a small upward search.
+        Worth it when the topology changes much less often than messages are sent: any add, remove, link or unlink
+        makes the index stale and routing falls back to the plain search until it is built again
+        :param witness_limit: see routing.ContractionHierarchy
+        :return: the number of shortcuts added
+        """
+        hierarchy = routing.ContractionHierarchy(self.network, witness_limit)
+        self._routing_index = (self._topology_version, hierarchy)
+        return hierarchy.shortcuts
+
+    def set_multipath(self, mode=routing.ECMP, k=3):
+        """
+        Spread unicast traffic over several paths instead of always taking the same cheapest one. Every message is
+        hashed by (sender, receiver, seq) onto one of the paths
+        :param mode: routing.ECMP for the paths tying on the cheapest cost, routing.K_SHORTEST for the k cheapest
+            paths (Yen's algorithm) even when they cost more, None to go back to a single path
+        :param k: number of paths in K_SHORTEST mode
+        :return:
+        """
+        if mode not in (None, routing.ECMP, routing.K_SHORTEST):
+            raise InvalidNetworkException("Unknown multipath mode " + str(mode))
+        self._multipath = None if mode is None else (mode, k)
+        self._multipath_routes = (self._topology_version, {})
+
+    def _flow_key(self, message):
+        if self._multipath is None:
+            return None
+        # crc32 rather than hash(): the same flow gets the same path in every process
+        return zlib.crc32(repr((message.sender, message.receiver, next(self._flow_sequence))).encode())
+
+    def _multipath_route(self, source_node, target_node, flow):
+        mode, k = self._multipath
+        version, routes = self._multipath_routes
+        if version != self._topology_version:
+            routes = {}
+            self._multipath_routes = (self._topology_version, routes)
+        if mode == routing.ECMP:
+            # one DAG per source node answers every target
+            dag = routes.get(source_node)
+            if dag is None:
+                dag = routes[source_node] = routing.shortest_path_dag(self.network, source_node)
+            if target_node not in dag[0]:
+                raise routing.RoutingException("Node " + str(target_node) + " is not reachable")
+            return routing.pick_path(dag[1], target_node, flow)[1:]
+        paths = routes.get((source_node, target_node))
+        if paths is None:
+            paths = routes[(source_node, target_node)] = routing.k_shortest_paths(self.network, source_node,
+                                                                                 target_node, k)
+        return paths[flow % len(paths)][1][1:]
+
+    def enable_fast_reroute(self, background=True):
+        """
+        Keep next hop tables with a loop-free alternate, filled for the destinations as they are routed to (see
+        routing.ForwardingTables). After a remove or an unlink, routes (including the deliveries held by coalescing)
+        switch to the alternates right away while the tables are updated, in a background thread unless background is
+        False: only the destinations whose paths the change affects are computed again
+        :return:
+        """
+        tables = routing.ForwardingTables({node_id: list(links) for node_id, links in self.network.items()})
+        with self._reroute_lock:
+            self._reroute_background = background
+            self._failures = []
+            self._reroute = (self._topology_version, tables, frozenset(), frozenset())
+
+    def disable_fast_reroute(self):
+        self.wait_for_routing_tables()
+        self._reroute = None
+
+    def wait_for_routing_tables(self, timeout=None):
+        """
+        Wait for the background rebuild of the fast reroute tables
+        :return: True if the tables match the current topology
+        """
+        thread = self._rebuild_thread
+        if thread is not None:
+            thread.join(timeout)
+        reroute = self._reroute
+        return reroute is not None and reroute[0] == self._topology_version
+
+    def _topology_changed(self, failed_node=None, failed_link=None):
+        if self._reroute is None:
+            return
+        with self._reroute_lock:
+            if failed_node is not None or failed_link is not None:
+                self._failures.append((self._topology_version, failed_node, failed_link))
+                self._reroute = self._reroute[:2] + self._failed_since(self._reroute[0])
+            # the thread works on a copy, the graph keeps changing meanwhile
+            self._rebuild_pending = (self._topology_version,
+                                     {node_id: list(links) for node_id, links in self.network.items()})
+            if not self._reroute_background:
+                start = False
+            elif self._rebuild_thread is None:
+                self._rebuild_thread = threading.Thread(target=self._rebuild_tables, daemon=True)
+                start = True
+            else:
+                # the running thread picks the pending graph up when it is done with the current one
+                start = False
+        if not self._reroute_background:
+            self._rebuild_tables()
+        elif start:
+            self._rebuild_thread.start()
+
+    def _failed_since(self, version):
+        failed_nodes = frozenset(node for failure_version, node, _ in self._failures
+                                 if failure_version > version and node is not None)
+        failed_links = set()
+        for failure_version, _, link in self._failures:
+            if failure_version > version and link is not None:
+                failed_links.add(link)
+                failed_links.add((link[1], link[0]))
+        return failed_nodes, frozenset(failed_links)
+
+    def _rebuild_tables(self):
+        while True:
+            with self._reroute_lock:
+                pending, self._rebuild_pending = self._rebuild_pending, None
+                if pending is None:
+                    self._rebuild_thread = None
+                    return
+            version, graph = pending
+            reroute = self._reroute
+            tables = routing.ForwardingTables(graph, None if reroute is None else reroute[1])
+            with self._reroute_lock:
+                if self._reroute is None or version <= self._reroute[0]:
+                    continue
+                self._failures = [failure for failure in self._failures if failure[0] > version]
+                self._reroute = (version, tables) + self._failed_since(version)
+
+    def routing_index_is_fresh(self):
+        """
+        :return: True if a routing index was built since the last topology change
+        """
+        return self._routing_index is not None and self._routing_index[0] == self._topology_version
+
+    # Being checked in test_smoke_tests.py
+    def send(self, message):
+        """
+        Send the message from the sender to the recipient specified inside the message (i.e., message.receiver)
+        - Fail if message.receiver is not registered
+        - Fail if message.sender is not registered in the network
+        :param message: an object with sender, priority, content, and recipient fields
+        :return:
+        """
+        # sender and recepient are connected?
+        if self._registry.is_connected(message.sender) == False:
+            raise Exception("Sender is not connected to network")
+        if message.receiver is not None:
+            if self._registry.is_connected(message.receiver) == False:
+                raise Exception("Receiver is not connected to network")
+            self._check_rate(message)
+            self._sample_trace(message)
+            receiver_node = self._registry.get_node_id(message.receiver)
+            if self._coalescing is not None:
+                with self._held_lock:
+                    if message.trace is None:
+                        # delivered later, together with the other messages going between the same two nodes
+                        self._coalesce(message, self._registry.get_node_id(message.sender), receiver_node)
+                        return
+                    # a traced message is not held, the held ones go first so that the order of the sends is kept
+                    self.flush()
+                    self._deliver(message, receiver_node)
+                return
+            self._deliver(message, receiver_node)
+
+    def _deliver(self, message, receiver_node):
+        shortest_path = self.get_shortest_path(message, receiver_node)
+        # forwarding the message
+        self._forward_along(message, self._registry.get_node_id(message.sender), shortest_path)
+        # actually sending the message
+        self.nodes[receiver_node].receive(message)
+            
+    def send_batch(self, messages):
+        """
+        Send several messages. The messages going between the same two nodes are routed, forwarded and received as
+        one MessageBundle, so the route is computed once per pair of nodes instead of once per message
+        - Fail (before sending anything) if a sender or a receiver is not registered
+        - Fail with a RateLimitException (before sending anything, and taking no tokens) if the batch is over a limit
+        :param messages: list of messages with a receiver
+        :return:
+        """
+        groups = {}
+        node_of = {}
+        counts = {} # (sender, priority) -> messages, the rate limits are checked for the whole batch
+        for message in messages:
+            for person_id in (message.sender, message.receiver):
+                if person_id not in node_of:
+                    node_of[person_id] = self._registry.get_node_id(person_id)
+                    if node_of[person_id] is None:
+                        raise Exception("Person " + str(person_id) + " is not connected to network")
+            counts[(message.sender, message.priority)] = counts.get((message.sender, message.priority), 0) + 1
+            groups.setdefault((node_of[message.sender], node_of[message.receiver]), []).append(message)
+        refused = self._rate_limiter.allow_many(counts) if self._rate_limiter is not None else None
+        if refused is not None:
+            self._count("rate_limited", (("sender", refused[0]),))
+            raise RateLimitException("Rate limit exceeded by " + str(refused[0]))
+        with self._guard():
+            # held messages go first so that the order of the sends is kept
+            self.flush()
+            for (source_node, target_node), group in groups.items():
+                self._deliver_bundle(source_node, target_node, group)
+
+    def _deliver_bundle(self, source_node, target_node, messages):
+        bundle = messages[0] if len(messages) == 1 else MessageBundle(messages)
+        self._forward_along(bundle, source_node, self.route(source_node, target_node, self._flow_key(bundle)))
+        self.nodes[target_node].receive(bundle)
+
+    def set_rate_limit(self, rate, burst=None, priority=None, clock=None):
+        """
+        Token bucket per sender (and priority): a send, batch message, broadcast or multicast beyond the limit fails
+        with a RateLimitException before any routing work is done
+        :param rate: messages per second, None for no limit
+        :param burst: messages allowed at once after a quiet period, defaults to rate (at least 1)
+        :param priority: the priority limited, None for the priorities without a limit of their own
+        :param clock: function giving the time in seconds, time.monotonic unless given once
+        :return:
+        """
+        if self._rate_limiter is None:
+            self._rate_limiter = RateLimiter()
+        if clock is not None:
+            self._rate_limiter.clock = clock
+        self._rate_limiter.configure(rate, max(1, rate) if burst is None and rate is not None else burst, priority)
+
+    def _check_rate(self, message):
+        if self._rate_limiter is not None and not self._rate_limiter.allow(message.sender, message.priority):
+            self._count("rate_limited", (("sender", message.sender),))
+            raise RateLimitException("Rate limit exceeded by " + str(message.sender))
+
+    def set_admission(self, max_depth=None, defer=False, max_deferred=MAX_DEFERRED):
+        """
+        Admission control on every node (and the nodes added later), see Node.set_admission
+        :return:
+        """
+        self._node_admission = None if max_depth is None else (max_depth, defer, max_deferred)
+        for node in self.nodes.values():
+            node.set_admission(max_depth, defer, max_deferred)
+
+    def _guard(self):
+        # with coalescing, deliveries exclude the window timer flushing from its own thread
+        return self._held_lock if self._coalescing is not None else _UNGUARDED
+
+    def _count(self, name, labels):
+        self.edge_counters[name] += 1
+        if self._metrics is not None:
+            self._metrics.increment((name, labels))
+
+    def enable_coalescing(self, window=0.001, max_messages=64):
+        """
+        Hold the unicast messages for up to `window` seconds and deliver the ones going between the same two nodes
+        as a single bundle. A timer delivers them once the window is over; reads, membership changes and the other
+        sends deliver whatever is held first
+        :param window: max seconds a message is held
+        :param max_messages: a group reaching this size is delivered right away
+        :return:
+        """
+        self.flush()
+        self._coalescing = (window, max_messages)
+
+    def disable_coalescing(self):
+        self.flush()
+        self._coalescing = None
+
+    def _coalesce(self, message, source_node, target_node):
+        window, max_messages = self._coalescing
+        now = time.monotonic()
+        if not self._held:
+            self._held_since = now
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(window, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+        group = self._held.setdefault((source_node, target_node), [])
+        group.append(message)
+        if len(group) >= max_messages:
+            del self._held[(source_node, target_node)]
+            self._deliver_bundle(source_node, target_node, group)
+        if now - self._held_since >= window:
+            self.flush()
+
+    def flush(self):
+        """
+        Deliver every message held by the coalescing window
+        :return:
+        """
+        with self._held_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            held, self._held = self._held, {}
+            for (source_node, target_node), group in held.items():
+                self._deliver_bundle(source_node, target_node, group)
+
+    def create_group(self, group_name, person_ids=()):
+        """
+        Create a multicast group, see multicast_send
+        - Fail with a RegistryException if the group exists or one of the persons is not connected
+        :param group_name:
+        :param person_ids: initial members
+        :return:
+        """
+        self._registry.create_group(group_name)
+        if self.journal is not None:
+            self.journal.append(wal.GROUP_CREATE, group_name)
+        for person_id in person_ids:
+            self.add_to_group(group_name, person_id)
+
+    def delete_group(self, group_name):
+        self._registry.delete_group(group_name)
+        self._multicast_trees.pop(group_name, None)
+        if self.journal is not None:
+            self.journal.append(wal.GROUP_DELETE, group_name)
+
+    def add_to_group(self, group_name, person_id):
+        self._registry.add_to_group(group_name, person_id)
+        if self.journal is not None:
+            self.journal.append(wal.GROUP_ADD, group_name, person_id)
+
+    def remove_from_group(self, group_name, person_id):
+        self._registry.remove_from_group(group_name, person_id)
+        if self.journal is not None:
+            self.journal.append(wal.GROUP_REMOVE, group_name, person_id)
+
+    def _multicast_tree(self, group_name):
+        """
+        The Steiner tree connecting the gateway nodes of the group members, rebuilt only when the topology or the
+        membership changed since it was computed
+        :return: (tree, dict node_id -> member ids attached to it, dict sending node -> plan, see _multicast_plan)
+        """
+        group_version = self._registry.group_versions[group_name]
+        cached = self._multicast_trees.get(group_name)
+        if cached is not None and cached[0] == self._topology_version and cached[1] == group_version:
+            return cached[2], cached[3], cached[4]
+        locations = self._registry.locations
+        members_by_node = {}
+        for person_id in self._registry.groups[group_name]:
+            node_id = locations.get(person_id)
+            # persons of a removed node are still in the registry but cannot be reached
+            if node_id in self.network:
+                members_by_node.setdefault(node_id, []).append(person_id)
+        tree = multicast.steiner_tree(self.network, list(members_by_node))
+        plans = {}
+        self._multicast_trees[group_name] = (self._topology_version, group_version, tree, members_by_node, plans)
+        return tree, members_by_node, plans
+
+    def _multicast_plan(self, group_name, sender_node):
+        """
+        How a message sent from sender_node reaches the group: the path to the closest node of the group tree, then
+        the tree edges in walking order, every edge once. Cached with the tree, per sending node
+        :return: (path from sender_node to the tree (None if the tree is empty), list of (parent node or None,
+            node_id) in walking order, dict node_id -> member ids attached to it)
+        """
+        tree, members_by_node, plans = self._multicast_tree(group_name)
+        plan = plans.get(sender_node)
+        if plan is None:
+            if not tree:
+                plan = (None, [])
+            else:
+                # entering the tree at its closest node
+                distances, previous = routing.shortest_paths(self.network, sender_node)
+                entry = min((node_id for node_id in tree if node_id in distances),
+                            key=lambda node_id: distances[node_id])
+                walk = []
+                parents = {entry: None}
+                stack = [entry]
+                while stack:
+                    node_id = stack.pop()
+                    walk.append((parents[node_id], node_id))
+                    for neighbor in tree[node_id]:
+                        if neighbor not in parents:
+                            parents[neighbor] = node_id
+                            stack.append(neighbor)
+                plan = (routing.path_to(previous, entry)[1:] or [sender_node], walk)
+            plans[sender_node] = plan
+        return plan[0], plan[1], members_by_node
+
+    def multicast_send(self, message, group_name):
+        """
+        Send the message to every member of the group but the sender. The message is forwarded to the closest node
+        of the group tree and then once along every edge of the tree, instead of once per member
+        - Fail if message.sender is not registered in the network
+        - Fail with a RegistryException if the group does not exist
+        :param message: an object with sender, priority, content, and recipient fields. receiver is set to the group
+            name
+        :param group_name:
+        :return:
+        """
+        if self._registry.is_connected(message.sender) == False:
+            raise Exception("Sender is not connected to network")
+        if self._registry.get_group(group_name) is None:
+            raise RegistryException("Group not found")
+        self._check_rate(message)
+        with self._guard():
+            # held unicast messages go first so that the order of the sends is kept
+            self.flush()
+            message.receiver = group_name
+            self._sample_trace(message)
+            sender_node = self._registry.get_node_id(message.sender)
+            path, walk, members_by_node = self._multicast_plan(group_name, sender_node)
+            if path is None:
+                return
+            self._forward_along(message, sender_node, path)
+            # then walking the tree, every edge once
+            for parent, node_id in walk:
+                if parent is not None:
+                    self._forward_along(message, parent, [node_id])
+                recipients = [person_id for person_id in members_by_node.get(node_id, ())
+                              if person_id != message.sender]
+                if recipients:
+                    self.nodes[node_id].receive_multicast(message, recipients)
+
+    # being checked in test_smoke_tests.py via send and broadcast
+    def forward(self, message, node):
+        """
+        Simulate the forward of the message to an (intermediate) node.
+        :param message:
+        :param node: node which the message is forwarded to
+        :return:
+        """
+        # just for showing that the message is being forward using shortest path
+        pass
+
+    def _forward_along(self, message, source_node, path):
+        """
+        Forward the message hop by hop along path, recording the route on traced messages and the per-link forward
+        counters when metrics are enabled
+        :param message:
+        :param source_node: id of the node the path starts from
+        :param path: node ids as returned by get_shortest_path
+        :return:
+        """
+        route = [source_node] if message.trace is not None else None
+        previous = source_node
+        for hop in path:
+            self.forward(message, self.nodes[hop])
+            if hop != previous:
+                if route is not None:
+                    route.append(hop)
+                    message.cost += self.link_cost(previous, hop)
+                if self._metrics is not None:
+                    self._metrics.increment(("link_forwards", (("source", previous), ("target", hop))))
+            previous = hop
+        if route is not None:
+            message.trace.append(tuple(route))
+
+    def link_cost(self, node_id_1, node_id_2):
+        """
+        :return: the cost of the cheapest link between the two nodes, None if they are not linked
+        """
+        costs = [cost for neighbor, cost in self.network[node_id_1] if neighbor == node_id_2]
+        return min(costs) if costs else None
+
+    def set_trace_sampling(self, every):
+        """
+        Trace one message every `every` sent or broadcasted messages (0 turns sampling off). A traced message gets in
+        message.trace the route (tuple of node ids) it followed to each destination node and in message.cost the
+        total cost of those routes
+        :param every: sampling period
+        :return:
+        """
+        if every < 0:
+            raise InvalidNetworkException("Sampling period cannot be negative")
+        self._trace_every = every
+        self._trace_counter = 0
+
+    def _sample_trace(self, message):
+        if message.trace is None and self._trace_every:
+            self._trace_counter += 1
+            if self._trace_counter >= self._trace_every:
+                self._trace_counter = 0
+                message.trace = []
+    
+    # being checked in test_smoke_tests.py
+    def join_network(self, person, node_id):
+        """
+        Register the person in the network, including adding all the information to the Registry
+        :param person: the person object that must be registered in the network at the given node
+        :param node_id: the id of the node which will become the gateway for the person
+        :return:
+        """
+        # adding to network
+        self.persons[person.get_person_id()] = person
+        # storing persons serailized key in registry
+        self._registry.insert(person.get_person_id(), node_id, person.get_serialized_key())
+        person.network = self # giving person the access to the network
+        if self._metrics is not None:
+            from . import metrics as instrumentation
+            instrumentation.instrument(person, "get_all_messages", self._metrics, "person.get_all_messages")
+        if self.journal is not None:
+            self.journal.append(wal.JOIN, person.get_person_id(), node_id, person.get_serialized_key())
+
+    def join_network_many(self, placements):
+        """
+        Register many persons at once, as join_network does for each of them (registry, journal, metrics), for
+        generators and snapshots attaching a large population
+        - Fails with a RegistryException, before any of them joins, if one of them is already registered
+        :param placements: list of (person, node_id, serialized key of the person). The serialized key is given so that
+            persons sharing a key do not serialize it each
+        :return:
+        """
+        self._registry.insert_many([(person.get_person_id(), node_id, serialized_key)
+                                    for person, node_id, serialized_key in placements])
+        if self._metrics is not None:
+            from . import metrics as instrumentation
+        for person, node_id, serialized_key in placements:
+            self.persons[person.get_person_id()] = person
+            person.network = self
+            if self._metrics is not None:
+                instrumentation.instrument(person, "get_all_messages", self._metrics, "person.get_all_messages")
+            if self.journal is not None:
+                self.journal.append(wal.JOIN, person.get_person_id(), node_id, serialized_key)
+
+    def move_person(self, person, new_node_id):
+        """
+        Attach a connected person to another gateway node. Unlike leave_network followed by join_network, the unread
+        messages follow the person: the mailbox list is moved to the new node as it is, the deferred messages wait for
+        admission on the new node. A person whose gateway was removed is attached again with an empty mailbox
+        - Fail with a RegistryException if the person is not connected
+        - Fail with an InvalidNetworkException if the node does not exist
+        :param person:
+        :param new_node_id: the new gateway
+        :return:
+        """
+        if new_node_id not in self.nodes:
+            raise InvalidNetworkException("Node not in the network")
+        person_id = person.get_person_id()
+        # held messages land in the old mailbox first so that they move with it
+        self.flush()
+        old_node_id = self._registry.move(person_id, new_node_id)
+        deferred = ()
+        if old_node_id != new_node_id:
+            # a removed gateway took the unread messages with it: nothing to move
+            old_node = self.nodes.get(old_node_id)
+            if old_node is not None:
+                self.nodes[new_node_id].put_mailbox(person_id, old_node.take_mailbox(person_id))
+                deferred = old_node.take_deferred(person_id)
+            # the member counts per node changed
+            self._multicast_trees.clear()
+        if self.journal is not None:
+            self.journal.append(wal.MOVE, person_id, new_node_id)
+        # the deferred messages were never journaled: the new node admits them after the move is, so that recovery
+        # replays them in the same order
+        self.nodes[new_node_id].put_deferred(person_id, deferred)
+
+    # being checked in test_network.py 
+    def leave_network(self, person):
+        """
+        Remove this person and all the unread messages from the network and delete all the infos from the Registry
+        :param person:
+        :return:
+        """
+        self.flush()
+        # deleting person from the network persons
+        del(self.persons[person.get_person_id()])
+        # fetching node from the registry
+        node_id = self._registry.get_node_id(person.get_person_id())
+        # deleting messages from the node
+        if node_id is not None:
+            self.nodes[node_id].delete_specific_messages(person)
+        else:
+            raise RegistryException("Node not found")
+        # deleting from the registry
+        self._registry.delete(person.get_person_id())
+        self._watched.pop(person.get_person_id(), None)
+        if self._rate_limiter is not None:
+            self._rate_limiter.forget(person.get_person_id())
+        if self.journal is not None:
+            self.journal.append(wal.LEAVE, person.get_person_id())
+
+    # being checked in test_smoke_tests.py and test_network.py
+    def get_all_messages(self, person): 
+        """
+        Retrieve all the messages waiting to be read. If there are no messages, return an empty list
+        :param person: who received the messages (both direct and broadcast)
+        :return: the list of messages ordered by arrival time and priority
+        """
+        self.flush()
+        # fetching node from the registry
+        node_id = self._registry.get_node_id(person.get_person_id())
+        # getting messages of a person
+        if node_id is not None:
+            return self.nodes[node_id].get_all_messages(person)
+        else:
+            raise RegistryException("Node not found")
+
+    def read_messages(self, person):
+        """
+        Retrieve and decode all the messages waiting for the person, see Person.get_all_messages
+        :param person: who received the messages (both direct and broadcast)
+        :return: the ORDERED list of decoded messages
+        """
+        encoded_messages = self.get_all_messages(person)
+        decoded_messages = []
+        # decoding the messages, a message read by many persons (broadcast, group) is decoded only once
+        for message in encoded_messages:
+            # Getting sender's key from registry, shared by all the persons with the same key
+            sender_key = self._registry.get_key(message.sender)
+            # the view is read-only so it is not changed for other readers
+            decoded_messages.append(decode_message(message, sender_key))
+        return decoded_messages
+
+    def watch(self, person):
+        """
+        Notify the person when messages land in its mailbox, see Person.subscribe
+        :param person: a connected person with subscriptions
+        :return:
+        """
+        self._watched[person.get_person_id()] = person
+
+    def unwatch(self, person_id):
+        self._watched.pop(person_id, None)
+
+    def set_limits(self, max_messages=None, max_messages_per_person=None):
+        """
+        Cap the queued messages of every node (and of the nodes added later), see Node.set_limits
+        :param max_messages: max messages queued on a node, None for no limit
+        :param max_messages_per_person: max messages queued for a single person, None for no limit
+        :return:
+        """
+        self._node_limits = (max_messages, max_messages_per_person)
+        for node in self.nodes.values():
+            node.set_limits(max_messages, max_messages_per_person)
+
+    def expire(self, now=None):
+        """
+        Evict the expired messages of every node. Expired messages are never returned by reads anyway, calling this
+        periodically gives their memory back sooner
+        :param now: the current time (time.time()), defaults to now
+        :return: the number of evicted messages
+        """
+        return sum(node.expire(now) for node in self.nodes.values())
+
+    def save(self, path):
+        """
+        Store the whole network (nodes, links, registry and unread messages) in a binary snapshot file
+        :param path: the destination file
+        :return:
+        """
+        # with a journal the snapshot is tagged with a fresh checkpoint so recover knows where to replay from
+        self.flush()
+        checkpoint = self.journal.checkpoint() if self.journal is not None else None
+        snapshot.save(self, path, checkpoint)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Rebuild a network from a snapshot written by save. Persons are rebuilt from their serialized keys
+        and can be found in network.persons
+        - Fails with a SnapshotException if the file is not a valid snapshot
+        :param path: the snapshot file
+        :return: the rebuilt network
+        """
+        return snapshot.load(path, cls, Node)
+
+    def attach_journal(self, journal):
+        """
+        Start logging every mutation and message delivery to a write-ahead journal
+        :param journal: a journal.Journal
+        :return:
+        """
+        self.journal = journal
+
+    def detach_journal(self):
+        """
+        Stop logging, committing whatever is still pending
+        :return: the detached journal
+        """
+        journal, self.journal = self.journal, None
+        if journal is not None:
+            journal.commit()
+        return journal
+
+    @classmethod
+    def recover(cls, snapshot_path, journal_path):
+        """
+        Rebuild the network after a crash from the last snapshot and the journal written since its checkpoint
+        :param snapshot_path: the last snapshot written by save, or None if there is none
+        :param journal_path: the journal file
+        :return: the recovered network
+        """
+        return wal.recover(snapshot_path, journal_path, cls, Node)
+
+    # hot paths timed by enable_metrics: (object, method) -> operation name
+    def _instrumented_methods(self):
+        methods = [(self, "send", "send"), (self, "broadcast", "broadcast"),
+                   (self, "get_shortest_path", "get_shortest_path")]
+        methods += [(node, "receive", "node.receive") for node in self.nodes.values()]
+        methods += [(person, "get_all_messages", "person.get_all_messages") for person in self.persons.values()]
+        return methods
+
+    def enable_metrics(self):
+        """
+        Start timing send, broadcast, get_shortest_path, Node.receive, Person.get_all_messages and Key.encode/decode.
+        The timed versions are swapped in on the instances, so a network without metrics pays nothing
+        :return: the Metrics object recording the timings
+        """
+        from . import metrics as instrumentation
+        if self._metrics is None:
+            self._metrics = instrumentation.Metrics()
+            for target, attribute, name in self._instrumented_methods():
+                instrumentation.instrument(target, attribute, self._metrics, name)
+            instrumentation.instrument_keys(self._metrics)
+        return self._metrics
+
+    def disable_metrics(self):
+        """
+        Stop timing and put the original methods back
+        :return:
+        """
+        from . import metrics as instrumentation
+        if self._metrics is not None:
+            for target, attribute, _ in self._instrumented_methods():
+                instrumentation.uninstrument(target, attribute)
+            instrumentation.uninstrument_keys(self._metrics)
+            self._metrics = None
+
+    def profile(self, path=None, memory=True):
+        """
+        Profile the operations run inside a with block: CPU time (cProfile) and allocations (tracemalloc) per public
+        operation (send, broadcast, multicast, read, join, leave, link)
+
+            with cn.profile("profile-output") as profiler:
+                ...
+            print(profiler.report())
+
+        :param path: directory where report.txt, stacks.collapsed (flamegraph input) and <operation>.pstats are written
+            at the end of the block, None to keep the results in memory only
+        :param memory: also trace the allocations (slower)
+        :return: the Profiler, see profiling.Profiler
+        """
+        from . import profiling
+        return profiling.Profiler(self, path, memory)
+
+    def metrics(self, format="dict"):
+        """
+        Snapshot of the recorded metrics plus the current mailbox depth of every node
+        :param format: "dict" or "prometheus" (text exposition format)
+        :return: the snapshot
+        """
+        from . import metrics as instrumentation
+        depths = {node_id: sum(len(messages) for messages in node.messages.values())
+                  for node_id, node in self.nodes.items()}
+        recorder = self._metrics if self._metrics is not None else instrumentation.Metrics()
+        snapshot = recorder.snapshot(depths)
+        if format == "prometheus":
+            return instrumentation.to_prometheus(snapshot)
+        if format != "dict":
+            raise ValueError("Unknown metrics format " + str(format))
+        return snapshot
+
+    def shard(self, shards=2, batch_size=256, start_method=None):
+        """
+        Partition the nodes across worker processes. Mailboxes and registry slices move to the workers, this network
+        stays behind as the routing table of the returned coordinator
+        :param shards: number of worker processes
+        :param batch_size: deliveries shipped to a worker at once
+        :param start_method: multiprocessing start method (None = platform default)
+        :return: a sharding.ShardedNetwork, to be closed when done
+        """
+        # multiprocessing is only imported by the programs that shard
+        from . import sharding
+        self.flush()
+        return sharding.ShardedNetwork(self, shards, batch_size, start_method)
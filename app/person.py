@@ -1,128 +1,277 @@
-from messaging import Key, Message, Priority
-import copy
-
-class Person:
-    def __init__(self, person_id, encoding_key):
-        """
-        Default initializer. Add explicit setters/getters if you need to initialize attributes.
-        :param person_id: the unique id of this person
-        :param encoding_key: the "trained" key used for encoding and decoding the messages
-        """
-        self._id = person_id
-        self._key = encoding_key
-
-    # simple getter for person_id
-    def get_person_id(self):
-        return self._id
-
-    
-    def get_serialized_key(self):
-        """
-        The encoding/decoding key can be stored inside the Registry ONLY if serialized to a stream of bytes, values, etc...
-        :return:
-        """
-        # just for convering the key in string - calling key's serialize function 
-        return Key.serialize(self._key)
-
-    def send_message_to(self, to_person_id, plain_content):
-        """
-        Send a message with LOW priority to another person.
-        :param to_person_id: the id of the receiver person
-        :param plain_content: the content of the message that must be encoded before
-        :return:
-        dcjknnin i also  cano cano  sfjjjknfi  akniofao  adopen adiffka jnconias to ask for help i dont know ehwta im doing wrifvjkak
-        dbancieo
-         alsoo fast API
-        """
-        # encoding 
-        encoded_text = self._key.encode(plain_content)
-        message = Message(self.get_person_id(), encoded_text, Priority.LOW, to_person_id)
-        self.network.send(message)
-
-
-
-    def send_urgent_message_to(self, to_person_id, plain_content):
-        """
-        Send a message with MEDIUM priority to another person.
-        :param to_person_id: the id of the receiver person
-        :param plain_content: the content of the message that must be encoded before
-        :return:
-        """
-        encoded_text = self._key.encode(plain_content)
-        message = Message(self.get_person_id(), encoded_text, Priority.MEDIUM, to_person_id)
-        # using network to send message
-        self.network.send(message)
-
-    def send_very_urgent_message_to(self, to_person_id, plain_content):
-        """
-        Send a message with HIGH priority to another person.
-        :param to_person_id: the id of the receiver person
-        :param plain_content: the content of the message that must be encoded before
-        :return:
-        """
-        encoded_text = self._key.encode(plain_content)
-        message = Message(self.get_person_id(), encoded_text, Priority.HIGH, to_person_id)
-        # using network to send message
-        self.network.send(message)
-
-    def send_message_to_everyone(self, plain_content):
-        """
-        Send a LOW priority broadcast message
-        :param plain_content: the content of the message that must be encoded before
-        :return:
-        """
-        encoded_text = self._key.encode(plain_content)
-        # same but none is used and same for next two functions
-        message = Message(self.get_person_id(), encoded_text, Priority.LOW, None)
-        # using network to send message
-        self.network.broadcast(message)
-
-    def send_urgent_message_to_everyone(self, plain_content):
-        """
-        Send a MEDIUM priority broadcast message
-        :param plain_content: the content of the message that must be encoded before
-        :return:
-        """
-        encoded_text = self._key.encode(plain_content)
-        message = Message(self.get_person_id(), encoded_text, Priority.MEDIUM, None)
-        # using network to send message
-        self.network.broadcast(message)
-
-    def send_very_urgent_message_to_everyone(self, plain_content):
-        """
-        Send a HIGH priority broadcast message
-        :param plain_content: the content of the message that must be encoded before
-        :return:
-        """
-        encoded_text = self._key.encode(plain_content)
-        message = Message(self.get_person_id(), encoded_text, Priority.HIGH, None)
-        # using network to send message
-        self.network.broadcast(message)
-
-    def get_all_messages(self):
-        """
-        Retrieve all the messages waiting to be read. If there are no messages, return an empty list
-        :return: the ORDERED list of message or an empty list. The order is defined by priority and the time at which
-            messages were received
-        """
-        # using network to get node and node_id
-        node_id = self.network._registry.get_node_id(self._id)
-        # getting all messages from node
-        node = self.network.nodes[node_id]
-        encoded_messages = node.get_all_messages(self)
-        decoded_messages = []
-        # decoding the messages
-        for message in encoded_messages:
-            # Getting sender's key from registry
-            sender_key = self.network._registry.get_serialized_key(message.sender)
-            sender_key = Key.deserialize(sender_key)
-            # making a dummy object of key
-            key_object_sender = Key("abc")
-            key_object_sender.key = sender_key
-            # making copy of message so it is not changed for other readers
-            temp_message = copy.deepcopy(message)
-            temp_message.content = key_object_sender.decode(message.content)
-            # decoding and storing 
-            decoded_messages.append(temp_message)
-        return decoded_messages
-        
\ No newline at end of file
+import itertools
+import time
+
+from .messaging import Key, Message, Priority
+from .registry import RegistryException
+
+
+class Subscription:
+    """
+    A callback waiting for messages of a person. A burst of deliveries before the callback runs wakes it only once
+    """
+
+    def __init__(self, person, callback, loop):
+        """
+        :param person: the subscribed person
+        :param callback: called with the person when messages are waiting
+        :param loop: event loop the callback runs in, None to call it right away from the delivering code
+        """
+        self.person = person
+        self.callback = callback
+        self.loop = loop
+        self.errors = 0 # exceptions raised by the callback
+        self.last_error = None
+        self._pending = False
+
+    def wake(self):
+        # coalescing: one wakeup is enough until the callback has run
+        if self._pending:
+            return
+        self._pending = True
+        if self.loop is None:
+            self._fire()
+        else:
+            try:
+                self.loop.call_soon_threadsafe(self._fire)
+            except RuntimeError:
+                # the loop of the subscriber is closed, nobody listens anymore
+                self.cancel()
+
+    def _fire(self):
+        self._pending = False
+        if self in self.person._subscriptions:
+            try:
+                self.callback(self.person)
+            except Exception as error:
+                # a failing subscriber must not stop the delivery to the other receivers
+                self.errors += 1
+                self.last_error = error
+                count = getattr(getattr(self.person, "network", None), "_count", None)
+                if count is not None:
+                    count("callback_errors", (("person", self.person.get_person_id()),))
+
+    def cancel(self):
+        """
+        Stop receiving wakeups
+        :return:
+        """
+        self.person.unsubscribe(self)
+
+
+class Person:
+    def __init__(self, person_id, encoding_key):
+        """
+        Default initializer. Add explicit setters/getters if you need to initialize attributes.
+        :param person_id: the unique id of this person
+        :param encoding_key: the "trained" key used for encoding and decoding the messages
+        """
+        self._id = person_id
+        self._key = encoding_key
+        self._subscriptions = [] # see subscribe
+        # sequence numbers of the messages sent, see Message. Starting from the clock, a person joining again with the
+        # same id is not taken for a retry of its previous messages
+        self._sequence = itertools.count(time.time_ns())
+
+    # simple getter for person_id
+    def get_person_id(self):
+        return self._id
+
+    def next_sequence(self):
+        """
+        :return: a new sequence number for a message of this person. A message sent again keeps its number
+        """
+        return next(self._sequence)
+
+    
+    def get_serialized_key(self):
+        """
+        The encoding/decoding key can be stored inside the Registry ONLY if serialized to a stream of bytes, values, etc...
+        :return:
+        """
+        # just for convering the key in string - calling key's serialize function 
+        return Key.serialize(self._key)
+
+    def send_message_to(self, to_person_id, plain_content, ttl=None):
+        """
+        Send a message with LOW priority to another person.
+        :param to_person_id: the id of the receiver person
+        :param plain_content: the content of the message that must be encoded before
+        :param ttl: seconds after which the message expires if it was not read, None to keep it until read
+        :return:
+        dcjknnin i also  cano cano  sfjjjknfi  akniofao  adopen adiffka jnconias to ask for help i dont know ehwta im doing wrifvjkak
+        dbancieo
+         alsoo fast API
+        """
+        # encoding 
+        encoded_text = self._key.encode(plain_content)
+        message = Message(self.get_person_id(), encoded_text, Priority.LOW, to_person_id, ttl=ttl,
+                          sequence=self.next_sequence())
+        self.network.send(message)
+
+
+
+    def send_urgent_message_to(self, to_person_id, plain_content, ttl=None):
+        """
+        Send a message with MEDIUM priority to another person.
+        :param to_person_id: the id of the receiver person
+        :param plain_content: the content of the message that must be encoded before
+        :param ttl: seconds after which the message expires if it was not read, None to keep it until read
+        :return:
+        """
+        encoded_text = self._key.encode(plain_content)
+        message = Message(self.get_person_id(), encoded_text, Priority.MEDIUM, to_person_id, ttl=ttl,
+                          sequence=self.next_sequence())
+        # using network to send message
+        self.network.send(message)
+
+    def send_very_urgent_message_to(self, to_person_id, plain_content, ttl=None):
+        """
+        Send a message with HIGH priority to another person.
+        :param to_person_id: the id of the receiver person
+        :param plain_content: the content of the message that must be encoded before
+        :param ttl: seconds after which the message expires if it was not read, None to keep it until read
+        :return:
+        """
+        encoded_text = self._key.encode(plain_content)
+        message = Message(self.get_person_id(), encoded_text, Priority.HIGH, to_person_id, ttl=ttl,
+                          sequence=self.next_sequence())
+        # using network to send message
+        self.network.send(message)
+
+    def send_batch(self, to_person_id, contents, priority=Priority.LOW, ttl=None):
+        """
+        Send several messages to the same person at once: the registry is checked and the route is computed once
+        for the whole batch
+        :param to_person_id: the id of the receiver person
+        :param contents: the plain contents, delivered in this order
+        :param priority: one of Priority enumeration, used for every message
+        :param ttl: seconds after which the messages expire if they were not read, None to keep them until read
+        :return:
+        """
+        messages = [Message(self.get_person_id(), self._key.encode(plain_content), priority, to_person_id, ttl=ttl,
+                            sequence=self.next_sequence())
+                    for plain_content in contents]
+        if messages:
+            self.network.send_batch(messages)
+
+    def send_message_to_group(self, group_name, plain_content, priority=Priority.LOW, ttl=None):
+        """
+        Send a message to every member of a multicast group
+        :param group_name: the name of the group
+        :param plain_content: the content of the message that must be encoded before
+        :param priority: one of Priority enumeration
+        :param ttl: seconds after which the message expires if it was not read, None to keep it until read
+        :return:
+        """
+        encoded_text = self._key.encode(plain_content)
+        message = Message(self.get_person_id(), encoded_text, priority, group_name, ttl=ttl,
+                          sequence=self.next_sequence())
+        # using network to send message along the group tree
+        self.network.multicast_send(message, group_name)
+
+    def send_message_to_everyone(self, plain_content, ttl=None):
+        """
+        Send a LOW priority broadcast message
+        :param plain_content: the content of the message that must be encoded before
+        :param ttl: seconds after which the message expires if it was not read, None to keep it until read
+        :return:
+        """
+        encoded_text = self._key.encode(plain_content)
+        # same but none is used and same for next two functions
+        message = Message(self.get_person_id(), encoded_text, Priority.LOW, None, ttl=ttl,
+                          sequence=self.next_sequence())
+        # using network to send message
+        self.network.broadcast(message)
+
+    def send_urgent_message_to_everyone(self, plain_content, ttl=None):
+        """
+        Send a MEDIUM priority broadcast message
+        :param plain_content: the content of the message that must be encoded before
+        :param ttl: seconds after which the message expires if it was not read, None to keep it until read
+        :return:
+        """
+        encoded_text = self._key.encode(plain_content)
+        message = Message(self.get_person_id(), encoded_text, Priority.MEDIUM, None, ttl=ttl,
+                          sequence=self.next_sequence())
+        # using network to send message
+        self.network.broadcast(message)
+
+    def send_very_urgent_message_to_everyone(self, plain_content, ttl=None):
+        """
+        Send a HIGH priority broadcast message
+        :param plain_content: the content of the message that must be encoded before
+        :param ttl: seconds after which the message expires if it was not read, None to keep it until read
+        :return:
+        """
+        encoded_text = self._key.encode(plain_content)
+        message = Message(self.get_person_id(), encoded_text, Priority.HIGH, None, ttl=ttl,
+                          sequence=self.next_sequence())
+        # using network to send message
+        self.network.broadcast(message)
+
+    def get_all_messages(self):
+        """
+        Retrieve all the messages waiting to be read. If there are no messages, return an empty list
+        :return: the ORDERED list of message or an empty list. The order is defined by priority and the time at which
+            messages were received
+        """
+        # the network decodes them, a sharded network in the worker owning the node
+        return self.network.read_messages(self)
+
+    def subscribe(self, callback):
+        """
+        Get notified instead of polling get_all_messages: callback(person) is called when messages land for this person.
+        Subscribed from a running event loop the callback is scheduled in that loop, so a burst of messages triggers a
+        single call; otherwise it is called by the delivering code
+        - Fails with a RegistryException if the person did not join a network
+        - Fails with a ShardingException on a sharded network, whose workers cannot call back
+        :param callback: callable taking the person
+        :return: the Subscription, cancel() it to stop
+        """
+        if getattr(self, "network", None) is None:
+            raise RegistryException("Person is not connected to the network")
+        # first, so that nothing is left subscribed when the network refuses
+        self.network.watch(self)
+        import asyncio
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        subscription = Subscription(self, callback, loop)
+        self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        :param subscription: returned by subscribe
+        :return:
+        """
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+        if not self._subscriptions and getattr(self, "network", None) is not None:
+            self.network.unwatch(self._id)
+
+    def notify(self):
+        """
+        Called by the node when a message for this person arrived
+        :return:
+        """
+        for subscription in list(self._subscriptions):
+            subscription.wake()
+
+    async def messages(self):
+        """
+        Async iterator over the incoming messages (decoded, in the same order as get_all_messages), waiting without
+        polling when the mailbox is empty
+        """
+        import asyncio
+        event = asyncio.Event()
+        subscription = self.subscribe(lambda person: event.set())
+        try:
+            while True:
+                event.clear()
+                for message in self.get_all_messages():
+                    yield message
+                await event.wait()
+        finally:
+            subscription.cancel()
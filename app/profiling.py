@@ -0,0 +1,233 @@
+import cProfile
+import io
+import os
+import pstats
+import time
+import tracemalloc
+
+# public operation -> methods of the network attributed to it. "read" is Person.get_all_messages and Node.drain_all,
+# see Profiler
+OPERATIONS = {
+    "send": ("send", "send_batch"),
+    "broadcast": ("broadcast",),
+    "multicast": ("multicast_send",),
+    "join": ("join_network", "join_network_many"),
+    "leave": ("leave_network",),
+    "link": ("link", "unlink"),
+}
+
+_MAX_DEPTH = 64
+
+
+class ProfilingException(Exception):
+    """
+    A generic exception for problems while profiling a network
+    """
+
+    pass
+
+
+class Profiler:
+    """
+    CPU profile (cProfile) and allocations (tracemalloc) of a network, attributed to the public operation that was
+    running: send, broadcast, multicast, read, join, leave and link. An operation called by another one (e.g. a read
+    inside a callback) is counted in the outer one. Used through CommunicationNetwork.profile
+    """
+
+    def __init__(self, network, path=None, memory=True):
+        """
+        :param network: the CommunicationNetwork to profile
+        :param path: directory the reports are written to when profiling stops, None to keep them in memory only
+        :param memory: also trace the allocations (slower)
+        """
+        self.network = network
+        self.path = path
+        self.memory = memory
+        self.profiles = {}  # operation -> cProfile.Profile
+        self.operations = {}  # operation -> {"calls", "seconds", "allocated", "peak"}
+        self.snapshot = None  # tracemalloc snapshot taken when profiling stops
+        self._saved = []  # (target, attribute, instance attribute it replaced or None)
+        self._readers = {}  # id(person) -> person whose reads are profiled
+        self._depth = 0  # > 0 while an operation is running
+        self._active = False
+        self._started_tracing = False
+
+    def start(self):
+        if self._active:
+            raise ProfilingException("Already profiling")
+        self._active = True
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        for operation, attributes in OPERATIONS.items():
+            for attribute in attributes:
+                self._wrap(self.network, attribute, operation)
+        for person in self.network.persons.values():
+            self._wrap_reader(person)
+        for node in self.network.nodes.values():
+            self._wrap(node, "drain_all", "read")
+        return self
+
+    def stop(self):
+        """
+        Put the original methods back and write the reports if a path was given
+        """
+        if not self._active:
+            return
+        self._active = False
+        # restored in reverse order, so that wrappers installed on top of ours (e.g. metrics) are not lost
+        for target, attribute, previous in reversed(self._saved):
+            if previous is None:
+                vars(target).pop(attribute, None)
+            else:
+                setattr(target, attribute, previous)
+        self._saved = []
+        self._readers = {}
+        if self.memory and tracemalloc.is_tracing():
+            self.snapshot = tracemalloc.take_snapshot()
+            if self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+        if self.path is not None:
+            self.write(self.path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _wrap(self, target, attribute, operation):
+        if operation not in self.profiles:
+            self.profiles[operation] = cProfile.Profile()
+            self.operations[operation] = {"calls": 0, "seconds": 0.0, "allocated": 0, "peak": 0}
+        function = getattr(target, attribute)
+        self._saved.append((target, attribute, vars(target).get(attribute)))
+        profile = self.profiles[operation]
+        totals = self.operations[operation]
+        profiler = self
+
+        def profiled_call(*args, **kwargs):
+            if profiler._depth:
+                return function(*args, **kwargs)
+            profiler._depth = 1
+            memory = profiler.memory and tracemalloc.is_tracing()
+            if memory:
+                before = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+            start = time.perf_counter()
+            profile.enable()
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                profile.disable()
+                totals["seconds"] += time.perf_counter() - start
+                totals["calls"] += 1
+                if memory:
+                    current, peak = tracemalloc.get_traced_memory()
+                    totals["allocated"] += current - before
+                    totals["peak"] = max(totals["peak"], peak - before)
+                profiler._depth = 0
+            # persons joining while profiling have their reads profiled as well
+            if attribute == "join_network" and args:
+                profiler._wrap_reader(args[0])
+            elif attribute == "join_network_many" and args:
+                for placement in args[0]:
+                    profiler._wrap_reader(placement[0])
+            return result
+        profiled_call.__wrapped__ = function
+        setattr(target, attribute, profiled_call)
+
+    def _wrap_reader(self, person):
+        if id(person) not in self._readers:
+            self._readers[id(person)] = person
+            self._wrap(person, "get_all_messages", "read")
+
+    def stats(self, operation):
+        """
+        :return: the pstats.Stats of the operation, None if it was never called
+        """
+        if not self.operations.get(operation, {}).get("calls"):
+            return None
+        return pstats.Stats(self.profiles[operation], stream=io.StringIO())
+
+    def collapsed_stacks(self):
+        """
+        Call stacks in the collapsed format of flamegraph.pl / speedscope: "operation;caller;callee microseconds".
+        cProfile only keeps caller -> callee edges, so the time of a function called from several places is split
+        between them in proportion of the time of each edge
+        :return: the list of lines
+        """
+        lines = []
+        for operation in sorted(self.operations):
+            stats = self.stats(operation)
+            if stats is None:
+                continue
+            entries = stats.stats
+            children = {}
+            for function, (_, _, _, _, callers) in entries.items():
+                for caller, edge in callers.items():
+                    children.setdefault(caller, []).append((function, edge[3]))
+            roots = [function for function, entry in entries.items()
+                     if not entry[4] and "_lsprof.Profiler" not in function[2]]
+            for root in roots:
+                self._collapse(entries, children, root, [operation], entries[root][3], lines)
+        return lines
+
+    def _collapse(self, entries, children, function, stack, cumulative, lines):
+        _, _, own, total, _ = entries[function]
+        share = cumulative / total if total else 0
+        stack = stack + [_label(function)]
+        microseconds = int(own * share * 1e6)
+        if microseconds > 0:
+            lines.append(";".join(stack) + " " + str(microseconds))
+        if len(stack) >= _MAX_DEPTH:
+            return
+        for child, edge_cumulative in children.get(function, ()):
+            label = _label(child)
+            if label not in stack:
+                self._collapse(entries, children, child, stack, edge_cumulative * share, lines)
+
+    def report(self, limit=15):
+        """
+        :param limit: functions listed per operation
+        :return: text report: totals per operation, their slowest functions and the top allocation sites
+        """
+        out = io.StringIO()
+        out.write("%-10s %8s %12s %14s %14s\n" % ("operation", "calls", "seconds", "net bytes", "peak bytes"))
+        for operation in sorted(self.operations):
+            totals = self.operations[operation]
+            out.write("%-10s %8d %12.6f %14d %14d\n" % (operation, totals["calls"], totals["seconds"],
+                                                        totals["allocated"], totals["peak"]))
+        for operation in sorted(self.operations):
+            stats = self.stats(operation)
+            if stats is None:
+                continue
+            out.write("\n== " + operation + " ==\n")
+            stats.stream = out
+            stats.sort_stats("cumulative").print_stats(limit)
+        if self.snapshot is not None:
+            out.write("\n== allocations (top %d lines) ==\n" % limit)
+            for statistic in self.snapshot.statistics("lineno")[:limit]:
+                out.write(str(statistic) + "\n")
+        return out.getvalue()
+
+    def write(self, path):
+        """
+        Write report.txt, stacks.collapsed and one <operation>.pstats per operation in the directory
+        """
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "report.txt"), "w") as file:
+            file.write(self.report())
+        with open(os.path.join(path, "stacks.collapsed"), "w") as file:
+            file.write("\n".join(self.collapsed_stacks()) + "\n")
+        for operation in self.operations:
+            if self.operations[operation]["calls"]:
+                self.profiles[operation].dump_stats(os.path.join(path, operation + ".pstats"))
+
+
+def _label(function):
+    filename, line, name = function
+    if filename == "~":
+        return name
+    return os.path.basename(filename) + ":" + str(line) + "(" + name + ")"
@@ -0,0 +1,108 @@
+import time
+
+
+class RateLimitException(Exception):
+    """
+    A generic exception for messages refused by the rate limits
+    """
+
+    pass
+
+
+class TokenBucket:
+    """
+    Holds up to `burst` tokens and gains `rate` tokens per second, every admitted message takes one
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now):
+        """
+        :return: the tokens available now
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def take(self, now, cost=1):
+        """
+        :return: True if there were enough tokens, which are then consumed
+        """
+        if self.refill(now) < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+
+class RateLimiter:
+    """
+    Token buckets per (sender, priority). A limit given without a priority applies to the priorities that have no
+    limit of their own
+    """
+
+    def __init__(self, clock=time.monotonic):
+        """
+        :param clock: function returning the current time in seconds
+        """
+        self.clock = clock
+        self._limits = {}  # priority or None -> (rate, burst)
+        self._buckets = {}  # (sender, priority) -> TokenBucket
+
+    def configure(self, rate, burst, priority=None):
+        """
+        :param rate: messages per second, None for no limit (a priority given no limit is exempt from the default)
+        :param burst: messages that can be sent at once after a quiet period
+        :param priority: the priority limited, None for the default limit
+        :return:
+        """
+        self._limits[priority] = None if rate is None else (rate, burst)
+        # buckets are created again with the new limits
+        self._buckets = {}
+
+    def allow(self, sender, priority):
+        """
+        :return: True if the sender can send a message with this priority now
+        """
+        limit = self._limits[priority] if priority in self._limits else self._limits.get(None)
+        if limit is None:
+            return True
+        now = self.clock()
+        bucket = self._buckets.get((sender, priority))
+        if bucket is None:
+            bucket = self._buckets[(sender, priority)] = TokenBucket(limit[0], limit[1], now)
+        return bucket.take(now)
+
+    def allow_many(self, counts):
+        """
+        All or nothing, for a batch: the tokens are taken only if every bucket has enough of them
+        :param counts: dict (sender, priority) -> number of messages
+        :return: None if the batch can be sent now, else the (sender, priority) without enough tokens
+        """
+        now = self.clock()
+        buckets = []
+        for (sender, priority), count in counts.items():
+            limit = self._limits[priority] if priority in self._limits else self._limits.get(None)
+            if limit is None:
+                continue
+            bucket = self._buckets.get((sender, priority))
+            if bucket is None:
+                bucket = self._buckets[(sender, priority)] = TokenBucket(limit[0], limit[1], now)
+            if bucket.refill(now) < count:
+                return sender, priority
+            buckets.append((bucket, count))
+        for bucket, count in buckets:
+            bucket.tokens -= count
+        return None
+
+    def forget(self, sender):
+        """
+        Drop the buckets of a sender, e.g. when it leaves the network
+        """
+        for bucket_key in [bucket_key for bucket_key in self._buckets if bucket_key[0] == sender]:
+            del self._buckets[bucket_key]
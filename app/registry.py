@@ -1,97 +1,262 @@
-from collections import defaultdict
-
-# for every exceptions regarding registry
-class RegistryException(Exception):
-    """
-    A generic exception for problems in the registry
-    """
-
-    pass
-
-
-class Registry:
-    """
-    This class implements a simple (in-memory) database that stores information about the Persons that have
-    joined the network
-    """
-
-    def __init__(self):
-        """
-        Default constructor. Use explicit setters/getters to add more attributes
-        """
-        self.database = defaultdict(lambda:[])  # node_id -> key and the list of persons -> value
-        self.persons = {}   # person_id -> serialized key
-    
-    # getter for serialized key being checked in test_smoke_tests.py via person.py
-    def get_serialized_key(self, person_id):
-        """
-        Retrieve encoding/decoding key
-        :param person_id:
-        :return: the serialized key associated to the give person_id if exists otherwise return None
-        """
-        # Checking if person exists
-        if person_id in self.persons.keys():
-            return self.persons[person_id]
-        return None   # if not then none
-
-    # being checked by test_smoke_tests.py via network.py file
-    def get_node_id(self, person_id):
-        """
-        Retrieve gateway node
-        :param person_id:
-        :return: the node_id associated to the give person_id if exists otherwise return None
-        """
-        # checking person in database and if exist then return it
-        for key in self.database.keys():
-            if person_id in self.database[key]:
-                return key
-        return None
-
-    # being checked in test_registry.py
-    def is_connected(self, person_id):
-        """
-        Check whether the person with the given id is connected to the network
-        :param person_id:
-        :return: True if the person is connected, False otherwise
-        """
-        for key in self.database.keys():
-            if person_id in self.database[key]:
-                return True
-        return False
-
-    # being checked in test_network.py via leave network function of network
-    def delete(self, person_id):
-        """
-        Delete all the information associated to the person if the person exists. Do nothing otherwise
-        :param person_id:
-        :return:
-        """
-        # removing person from network
-        for key in self.database.keys():
-            if person_id in self.database[key]:
-                self.database[key].remove(person_id)
-        # also deleting its serailized key
-        del(self.persons[person_id])
-
-    # being checked in test_registry.py
-    def insert(self, person_id, node_id, serialized_key):
-        """
-        Insert the information of a person joining the network
-        - Fails with a RegistryException if a person with same id is already registered
-        Note: The registry cannot store structured data, i.e., objects, so we need to provide only plain strings
-        so they can be copied by value
-        :param person_id: the id of the person
-        :param node_id: the id of the node
-        :param serialized_key: the serialized encoding/decoding key (this is a string!)
-        :return:
-        """
-        # checking if person is against any node?
-        for key in self.database.keys():
-            if person_id in self.database[key]:
-                raise RegistryException("Person Already exists!")
-        # adding person to the registry against a purticular node
-        if node_id in self.database.keys():
-            self.database[node_id].append(person_id)
-        else:
-            self.database[node_id] = [person_id]
-        self.persons[person_id] = serialized_key # also its serailized key
\ No newline at end of file
+from collections import defaultdict
+import itertools
+
+from .messaging import Key
+
+# for every exceptions regarding registry
+class RegistryException(Exception):
+    """
+    A generic exception for problems in the registry
+    """
+
+    pass
+
+
+class Registry:
+    """
+    This class implements a simple (in-memory) database that stores information about the Persons that have
+    joined the network
+    """
+
+    def __init__(self):
+        """
+        Default constructor. Use explicit setters/getters to add more attributes
+        """
+        # node_id -> key and the persons attached to it -> value (a dict used as an ordered set, O(1) removal)
+        self.database = defaultdict(dict)
+        self.locations = {} # person_id -> node_id, index of database
+        self.persons = {}   # person_id -> key id
+        # persons trained on the same text have the same key: it is stored once and shared
+        self.keys = {}  # key id -> [serialized key, number of persons using it]
+        self._key_ids = {}  # serialized key -> key id
+        self._key_objects = {}  # key id -> Key, built on first use
+        self._next_key_id = itertools.count(1)
+        self.groups = {}    # group name -> list of member person ids
+        self.group_versions = {}    # group name -> number bumped on every membership change
+    
+    # getter for serialized key being checked in test_smoke_tests.py via person.py
+    def get_serialized_key(self, person_id):
+        """
+        Retrieve encoding/decoding key
+        :param person_id:
+        :return: the serialized key associated to the give person_id if exists otherwise return None
+        """
+        # Checking if person exists
+        if person_id in self.persons:
+            return self.keys[self.persons[person_id]][0]
+        return None   # if not then none
+
+    def get_key_id(self, person_id):
+        """
+        :param person_id:
+        :return: the id of the key record of the person if exists otherwise None. Persons with the same key share it
+        """
+        return self.persons.get(person_id)
+
+    def get_key(self, person_id):
+        """
+        Ready to use key of a person, built once per key record and shared by the persons using it
+        :param person_id:
+        :return: the Key if the person exists otherwise None
+        """
+        key_id = self.persons.get(person_id)
+        if key_id is None:
+            return None
+        key = self._key_objects.get(key_id)
+        if key is None:
+            key = self._key_objects[key_id] = Key.from_serialized(self.keys[key_id][0])
+        return key
+
+    def intern_key(self, serialized_key):
+        """
+        Find or create the record of a serialized key and count one more user of it
+        :param serialized_key:
+        :return: the key id
+        """
+        key_id = self._key_ids.get(serialized_key)
+        if key_id is None:
+            key_id = next(self._next_key_id)
+            self._key_ids[serialized_key] = key_id
+            self.keys[key_id] = [serialized_key, 0]
+        self.keys[key_id][1] += 1
+        return key_id
+
+    def release_key(self, key_id):
+        """
+        Count one less user of the key record, the record is dropped when nobody uses it anymore
+        :param key_id:
+        :return:
+        """
+        record = self.keys[key_id]
+        record[1] -= 1
+        if record[1] == 0:
+            del self.keys[key_id]
+            del self._key_ids[record[0]]
+            self._key_objects.pop(key_id, None)
+
+    def set_serialized_key(self, person_id, serialized_key):
+        """
+        Store the key of a person without connecting it to a node
+        :param person_id:
+        :param serialized_key:
+        :return:
+        """
+        key_id = self.intern_key(serialized_key)
+        if person_id in self.persons:
+            self.release_key(self.persons[person_id])
+        self.persons[person_id] = key_id
+
+    # being checked by test_smoke_tests.py via network.py file
+    def get_node_id(self, person_id):
+        """
+        Retrieve gateway node
+        :param person_id:
+        :return: the node_id associated to the give person_id if exists otherwise return None
+        """
+        return self.locations.get(person_id)
+
+    # being checked in test_registry.py
+    def is_connected(self, person_id):
+        """
+        Check whether the person with the given id is connected to the network
+        :param person_id:
+        :return: True if the person is connected, False otherwise
+        """
+        return person_id in self.locations
+
+    # being checked in test_network.py via leave network function of network
+    def delete(self, person_id):
+        """
+        Delete all the information associated to the person if the person exists. Do nothing otherwise
+        :param person_id:
+        :return:
+        """
+        # removing person from network
+        node_id = self.locations.pop(person_id, None)
+        if node_id is not None:
+            del self.database[node_id][person_id]
+        # also deleting its serailized key
+        self.release_key(self.persons.pop(person_id))
+        # and its group memberships
+        for group_name, members in self.groups.items():
+            if person_id in members:
+                members.remove(person_id)
+                self.group_versions[group_name] += 1
+
+    # being checked in test_registry.py
+    def insert(self, person_id, node_id, serialized_key):
+        """
+        Insert the information of a person joining the network
+        - Fails with a RegistryException if a person with same id is already registered
+        Note: The registry cannot store structured data, i.e., objects, so we need to provide only plain strings
+        so they can be copied by value
+        :param person_id: the id of the person
+        :param node_id: the id of the node
+        :param serialized_key: the serialized encoding/decoding key (this is a string!)
+        :return:
+        """
+        # checking if person is against any node?
+        if person_id in self.locations:
+            raise RegistryException("Person Already exists!")
+        # adding person to the registry against a purticular node
+        self.attach(person_id, node_id)
+        self.persons[person_id] = self.intern_key(serialized_key) # also its serailized key
+
+    def insert_many(self, entries):
+        """
+        Insert the information of many persons joining the network at once, see insert
+        - Fails with a RegistryException if one of them is already registered, before any of them is inserted
+        :param entries: list of (person_id, node_id, serialized_key)
+        :return:
+        """
+        person_ids = [person_id for person_id, _, _ in entries]
+        if len(set(person_ids)) != len(person_ids) or any(person_id in self.locations for person_id in person_ids):
+            raise RegistryException("Person Already exists!")
+        for person_id, node_id, serialized_key in entries:
+            self.attach(person_id, node_id)
+            self.persons[person_id] = self.intern_key(serialized_key)
+
+    def attach(self, person_id, node_id):
+        """
+        Record the gateway node of a person, moving the person if it was attached to another node
+        :param person_id:
+        :param node_id:
+        :return:
+        """
+        previous = self.locations.get(person_id)
+        if previous is not None:
+            del self.database[previous][person_id]
+        self.database[node_id][person_id] = None
+        self.locations[person_id] = node_id
+
+    def move(self, person_id, node_id):
+        """
+        Change the gateway node of a connected person, key and group memberships are kept
+        - Fails with a RegistryException if the person is not connected
+        :param person_id:
+        :param node_id: the new gateway
+        :return: the previous gateway
+        """
+        previous = self.locations.get(person_id)
+        if previous is None:
+            raise RegistryException("Person not found")
+        self.attach(person_id, node_id)
+        return previous
+
+    def create_group(self, group_name):
+        """
+        Create an empty multicast group
+        - Fails with a RegistryException if a group with the same name exists
+        :param group_name:
+        :return:
+        """
+        if group_name in self.groups:
+            raise RegistryException("Group Already exists!")
+        self.groups[group_name] = []
+        self.group_versions[group_name] = 0
+
+    def delete_group(self, group_name):
+        """
+        Delete the group if it exists. Do nothing otherwise
+        :param group_name:
+        :return:
+        """
+        self.groups.pop(group_name, None)
+        self.group_versions.pop(group_name, None)
+
+    def add_to_group(self, group_name, person_id):
+        """
+        Add a connected person to a group
+        - Fails with a RegistryException if the group does not exist, the person is not connected or is already a member
+        :param group_name:
+        :param person_id:
+        :return:
+        """
+        if group_name not in self.groups:
+            raise RegistryException("Group not found")
+        if person_id not in self.persons:
+            raise RegistryException("Person not found")
+        if person_id in self.groups[group_name]:
+            raise RegistryException("Person is already in the group")
+        self.groups[group_name].append(person_id)
+        self.group_versions[group_name] += 1
+
+    def remove_from_group(self, group_name, person_id):
+        """
+        Remove a person from a group
+        - Fails with a RegistryException if the person is not a member of the group
+        :param group_name:
+        :param person_id:
+        :return:
+        """
+        if person_id not in self.groups.get(group_name, []):
+            raise RegistryException("Person is not in the group")
+        self.groups[group_name].remove(person_id)
+        self.group_versions[group_name] += 1
+
+    def get_group(self, group_name):
+        """
+        :param group_name:
+        :return: the list of person ids of the group if it exists otherwise None
+        """
+        return self.groups.get(group_name)
@@ -0,0 +1,499 @@
+import heapq
+
+ECMP = "ecmp"
+K_SHORTEST = "k_shortest"
+
+
+class RoutingException(Exception):
+    """
+    A generic exception for problems while computing routes
+    """
+
+    pass
+
+
+def shortest_paths(graph, source):
+    """
+    Dijkstra with a binary heap
+    :param graph: dict node_id -> list of (neighbor, cost), as CommunicationNetwork.network
+    :param source: the node the paths start from
+    :return: (dict node_id -> distance, dict node_id -> previous node on the path), unreachable nodes are missing
+    """
+    distances = {source: 0}
+    previous = {source: None}
+    heap = [(0, 0, source)]
+    counter = 1  # tie breaker, node ids do not need to be comparable
+    done = set()
+    while heap:
+        distance, _, node_id = heapq.heappop(heap)
+        if node_id in done:
+            continue
+        done.add(node_id)
+        for neighbor, cost in graph[node_id]:
+            candidate = distance + cost
+            if neighbor not in distances or candidate < distances[neighbor]:
+                distances[neighbor] = candidate
+                previous[neighbor] = node_id
+                heapq.heappush(heap, (candidate, counter, neighbor))
+                counter += 1
+    return distances, previous
+
+
+def path_to(previous, target):
+    """
+    :param previous: dict node_id -> previous node, as returned by shortest_paths
+    :param target: a reached node
+    :return: the list of node ids from the source to target, both included
+    """
+    path = [target]
+    while previous[path[-1]] is not None:
+        path.append(previous[path[-1]])
+    path.reverse()
+    return path
+
+
+def shortest_path(graph, source, target):
+    """
+    Point to point Dijkstra: stops as soon as target is settled
+    :return: (cost, list of node ids from source to target included)
+    - Fails with a RoutingException if target cannot be reached
+    """
+    distances = {source: 0}
+    previous = {source: None}
+    heap = [(0, 0, source)]
+    counter = 1
+    done = set()
+    while heap:
+        distance, _, node_id = heapq.heappop(heap)
+        if node_id in done:
+            continue
+        if node_id == target:
+            return distance, path_to(previous, target)
+        done.add(node_id)
+        for neighbor, cost in graph[node_id]:
+            candidate = distance + cost
+            if neighbor not in distances or candidate < distances[neighbor]:
+                distances[neighbor] = candidate
+                previous[neighbor] = node_id
+                heapq.heappush(heap, (candidate, counter, neighbor))
+                counter += 1
+    raise RoutingException("Node " + str(target) + " is not reachable")
+
+
+def bidirectional_shortest_path(graph, source, target):
+    """
+    Two Dijkstra searches, one from each end (links are bi-directional), stopping when they meet: the explored area
+    is two small balls instead of one big one
+    :return: (cost, list of node ids from source to target included)
+    - Fails with a RoutingException if target cannot be reached
+    """
+    if source == target:
+        return 0, [source]
+    # index 0: forward search from source, 1: backward search from target
+    distances = ({source: 0}, {target: 0})
+    previous = ({source: None}, {target: None})
+    heaps = ([(0, 0, source)], [(0, 0, target)])
+    done = (set(), set())
+    counter = 1
+    best = None
+    meeting = None
+    side = 0
+    while heaps[0] and heaps[1]:
+        # once the two frontiers together are as long as the best path found, nothing shorter can show up
+        if best is not None and heaps[0][0][0] + heaps[1][0][0] >= best:
+            break
+        # expanding the smaller frontier
+        side = 0 if len(heaps[0]) <= len(heaps[1]) else 1
+        distance, _, node_id = heapq.heappop(heaps[side])
+        if node_id in done[side]:
+            continue
+        done[side].add(node_id)
+        own, other = distances[side], distances[1 - side]
+        for neighbor, cost in graph[node_id]:
+            candidate = distance + cost
+            if neighbor not in own or candidate < own[neighbor]:
+                own[neighbor] = candidate
+                previous[side][neighbor] = node_id
+                heapq.heappush(heaps[side], (candidate, counter, neighbor))
+                counter += 1
+            if neighbor in other and (best is None or own[neighbor] + other[neighbor] < best):
+                best = own[neighbor] + other[neighbor]
+                meeting = neighbor
+    if best is None:
+        raise RoutingException("Node " + str(target) + " is not reachable")
+    path = path_to(previous[0], meeting)
+    node_id = previous[1][meeting]
+    while node_id is not None:
+        path.append(node_id)
+        node_id = previous[1][node_id]
+    return best, path
+
+
+
+def shortest_path_dag(graph, source):
+    """
+    Dijkstra keeping every equal cost predecessor: the result describes all the cheapest paths from source
+    :return: (dict node_id -> distance, dict node_id -> list of previous nodes on a cheapest path)
+    """
+    distances = {source: 0}
+    predecessors = {source: []}
+    heap = [(0, 0, source)]
+    counter = 1
+    done = set()
+    while heap:
+        distance, _, node_id = heapq.heappop(heap)
+        if node_id in done:
+            continue
+        done.add(node_id)
+        for neighbor, cost in graph[node_id]:
+            candidate = distance + cost
+            if neighbor not in distances or candidate < distances[neighbor]:
+                distances[neighbor] = candidate
+                predecessors[neighbor] = [node_id]
+                heapq.heappush(heap, (candidate, counter, neighbor))
+                counter += 1
+            elif candidate == distances[neighbor] and neighbor != source and node_id not in predecessors[neighbor]:
+                predecessors[neighbor].append(node_id)
+    return distances, predecessors
+
+
+def pick_path(predecessors, target, key):
+    """
+    Choose one of the cheapest paths to target. The key is used as a mixed radix number, one digit per node with
+    several predecessors, so consecutive keys walk through different paths
+    :param predecessors: as returned by shortest_path_dag
+    :param key: a non negative integer, e.g. a hash of the flow
+    :return: the list of node ids from the source to target, both included
+    """
+    path = [target]
+    while predecessors[path[-1]]:
+        choices = predecessors[path[-1]]
+        key, index = divmod(key, len(choices))
+        path.append(choices[index])
+    path.reverse()
+    return path
+
+
+class _RestrictedGraph:
+    """
+    Read only view of a graph without some nodes and some links, used by the spur searches of Yen's algorithm
+    """
+
+    def __init__(self, graph, removed_nodes, removed_links):
+        self._graph = graph
+        self._removed_nodes = removed_nodes
+        self._removed_links = removed_links
+
+    def __getitem__(self, node_id):
+        return [(neighbor, cost) for neighbor, cost in self._graph[node_id]
+                if neighbor not in self._removed_nodes and (node_id, neighbor) not in self._removed_links]
+
+
+def k_shortest_paths(graph, source, target, k):
+    """
+    Yen's algorithm: the k cheapest loopless paths, each one derived from the previous ones by deviating at one of
+    their nodes (the spur node)
+    :return: list of at most k (cost, list of node ids from source to target included), cheapest first
+    - Fails with a RoutingException if target cannot be reached
+    """
+    found = [shortest_path(graph, source, target)]
+    candidates = []
+    seen = {tuple(found[0][1])}
+    counter = 0
+    while len(found) < k:
+        _, previous_path = found[-1]
+        for index in range(len(previous_path) - 1):
+            spur_node = previous_path[index]
+            root = previous_path[:index + 1]
+            removed_links = set()
+            for _, path in found:
+                if path[:index + 1] == root:
+                    removed_links.add((path[index], path[index + 1]))
+                    removed_links.add((path[index + 1], path[index]))
+            view = _RestrictedGraph(graph, set(root[:-1]), removed_links)
+            try:
+                spur_cost, spur_path = shortest_path(view, spur_node, target)
+            except RoutingException:
+                continue
+            path = root[:-1] + spur_path
+            if tuple(path) in seen:
+                continue
+            seen.add(tuple(path))
+            root_cost = sum(min(cost for neighbor, cost in graph[a] if neighbor == b) for a, b in zip(root, root[1:]))
+            heapq.heappush(candidates, (root_cost + spur_cost, counter, path))
+            counter += 1
+        if not candidates:
+            break
+        cost, _, path = heapq.heappop(candidates)
+        found.append((cost, path))
+    return found
+
+
+class ForwardingTables:
+    """
+    Per destination next hop tables with a loop-free alternate (RFC 5286), so that a failed node or link can be routed
+    around right away, before the tables are updated. Nothing is computed upfront: the next hops towards a destination
+    on the first route to it, the alternate of a node only when its primary next hop failed
+    """
+
+    def __init__(self, graph, previous=None):
+        """
+        One Dijkstra per routed destination: links are bi-directional, so the previous node of S in the search from D
+        is the next hop from S towards D
+        :param graph: dict node_id -> list of (neighbor, cost), kept as it is: give a copy of a graph that changes
+        :param previous: tables of an earlier version of the graph, their destinations not affected by the changes
+            are kept
+        """
+        self.graph = graph
+        self._trees = {}  # destination -> (dict node_id -> distance, dict node_id -> primary next hop)
+        self._backups = {}  # (destination, node_id) -> alternate next hop, None when there is none
+        if previous is not None:
+            self._trees = previous._unaffected(graph)
+
+    def _tree(self, destination):
+        tree = self._trees.get(destination)
+        if tree is None and destination in self.graph:
+            tree = self._trees[destination] = shortest_paths(self.graph, destination)
+        return tree
+
+    def distance(self, source, target):
+        """
+        :return: the cost of the cheapest path, None if target cannot be reached
+        """
+        tree = self._tree(target)
+        return None if tree is None else tree[0].get(source)
+
+    def _unaffected(self, graph):
+        """
+        :return: the trees still exact in graph: none of their links went away or got more expensive, and no new or
+            cheaper link gives a shorter path
+        """
+        changes = []  # (node_id, neighbor, cost before or None, cost now or None)
+        for node_id in self.graph.keys() | graph.keys():
+            before = dict(self.graph.get(node_id, ()))
+            now = dict(graph.get(node_id, ()))
+            for neighbor in before.keys() | now.keys():
+                if before.get(neighbor) != now.get(neighbor):
+                    changes.append((node_id, neighbor, before.get(neighbor), now.get(neighbor)))
+        kept = {}
+        # a copy: routes may add trees from another thread meanwhile
+        for destination, (distances, next_hops) in list(self._trees.items()):
+            if destination not in graph:
+                continue
+            for node_id, neighbor, before, now in changes:
+                if before is not None and (now is None or now > before) and next_hops.get(node_id) == neighbor:
+                    break
+                if now is not None and (before is None or now < before) and neighbor in distances and (
+                        node_id not in distances or distances[neighbor] + now < distances[node_id]):
+                    break
+            else:
+                kept[destination] = (distances, next_hops)
+        return kept
+
+    def _backup(self, destination, node_id):
+        key = (destination, node_id)
+        if key in self._backups:
+            return self._backups[key]
+        to_destination, next_hops = self._tree(destination)
+        primary = next_hops[node_id]
+        # links are bi-directional: the tree of a node gives the distances from it
+        from_node = self._tree(node_id)[0]
+        from_primary = self._tree(primary)[0]
+        best = None
+        for neighbor, cost in self.graph[node_id]:
+            if neighbor == primary or neighbor not in to_destination:
+                continue
+            # loop free: the neighbor's own shortest path does not come back through node_id
+            if to_destination[neighbor] >= from_node[neighbor] + to_destination[node_id]:
+                continue
+            # node protecting alternates avoid the primary next hop altogether and are preferred
+            protects = (neighbor == destination or primary == destination or
+                        to_destination[neighbor] < from_primary[neighbor] + to_destination[primary])
+            candidate = (not protects, cost + to_destination[neighbor])
+            if best is None or candidate < best[0]:
+                best = (candidate, neighbor)
+        self._backups[key] = None if best is None else best[1]
+        return self._backups[key]
+
+    def path(self, source, target, failed_nodes=(), failed_links=()):
+        """
+        Walk the tables hop by hop, taking the alternate wherever the primary next hop failed
+        :param failed_nodes: node ids removed since the tables were computed
+        :param failed_links: (node id, node id) pairs unlinked since, in both directions
+        :return: the list of node ids from source to target, both included
+        - Fails with a RoutingException if a node is unknown to the tables or both next hops failed
+        """
+        tree = self._tree(target)
+        if tree is None or source not in tree[1]:
+            raise RoutingException("No forwarding entry from " + str(source) + " to " + str(target))
+        next_hops = tree[1]
+        path = [source]
+        visited = {source}
+        node_id = source
+        while node_id != target:
+            hop = next_hops[node_id]
+            if hop in failed_nodes or (node_id, hop) in failed_links:
+                hop = self._backup(target, node_id)
+                if hop is None or hop in failed_nodes or (node_id, hop) in failed_links:
+                    raise RoutingException("No alternate from " + str(node_id) + " to " + str(target))
+            # several failures at once can make alternates point at each other
+            if hop in visited:
+                raise RoutingException("Forwarding loop towards " + str(target))
+            visited.add(hop)
+            path.append(hop)
+            node_id = hop
+        return path
+
+class ContractionHierarchy:
+    """
+    Routing index for a topology that rarely changes. Nodes are contracted one by one (least important first):
+    removing a node adds a shortcut between two of its neighbors when the path through it is the only cheapest one.
+    A query is then a bidirectional search that only climbs to more important nodes, so it settles a few dozen nodes
+    instead of a whole region, and the shortcuts it used are unpacked into the real hops.
+    """
+
+    def __init__(self, graph, witness_limit=64):
+        """
+        :param graph: dict node_id -> list of (neighbor, cost)
+        :param witness_limit: max nodes settled by a witness search, a lower limit builds faster but adds shortcuts
+        """
+        self.witness_limit = witness_limit
+        # cheapest link between two nodes, parallel links do not matter for routing
+        adjacency = {node_id: {} for node_id in graph}
+        for node_id, links in graph.items():
+            for neighbor, cost in links:
+                if neighbor != node_id and cost < adjacency[node_id].get(neighbor, cost + 1):
+                    adjacency[node_id][neighbor] = cost
+        self.rank = {}  # node_id -> contraction order
+        self._middle = {}  # (u, v) -> node contracted by the shortcut u - v
+        self._up = {node_id: [] for node_id in graph}  # links towards more important nodes
+        self.shortcuts = 0
+        contracted_neighbors = dict.fromkeys(graph, 0)
+        heap = []
+        for order, node_id in enumerate(graph):
+            heapq.heappush(heap, (self._priority(adjacency, node_id, contracted_neighbors), order, node_id))
+        while heap:
+            _, order, node_id = heapq.heappop(heap)
+            # priorities change while neighbors are contracted: they are refreshed lazily
+            priority = self._priority(adjacency, node_id, contracted_neighbors)
+            if heap and priority > heap[0][0]:
+                heapq.heappush(heap, (priority, order, node_id))
+                continue
+            self._contract(adjacency, node_id, contracted_neighbors)
+
+    def _witness_costs(self, adjacency, source, excluded, max_cost):
+        # limited Dijkstra: is there a path from source not going through excluded?
+        distances = {source: 0}
+        heap = [(0, 0, source)]
+        counter = 1
+        settled = 0
+        while heap and settled < self.witness_limit:
+            distance, _, node_id = heapq.heappop(heap)
+            if distance > distances[node_id]:
+                continue
+            if distance > max_cost:
+                break
+            settled += 1
+            for neighbor, cost in adjacency[node_id].items():
+                candidate = distance + cost
+                if neighbor != excluded and candidate < distances.get(neighbor, candidate + 1):
+                    distances[neighbor] = candidate
+                    heapq.heappush(heap, (candidate, counter, neighbor))
+                    counter += 1
+        return distances
+
+    def _needed_shortcuts(self, adjacency, node_id):
+        neighbors = list(adjacency[node_id].items())
+        shortcuts = []
+        for index, (u, cost_u) in enumerate(neighbors[:-1]):
+            max_cost = cost_u + max(cost_v for _, cost_v in neighbors[index + 1:])
+            distances = self._witness_costs(adjacency, u, node_id, max_cost)
+            for v, cost_v in neighbors[index + 1:]:
+                if distances.get(v, cost_u + cost_v + 1) > cost_u + cost_v:
+                    shortcuts.append((u, v, cost_u + cost_v))
+        return shortcuts
+
+    def _priority(self, adjacency, node_id, contracted_neighbors):
+        # edge difference: a node whose removal adds fewer links than it takes away goes first
+        return (len(self._needed_shortcuts(adjacency, node_id)) - len(adjacency[node_id]) +
+                contracted_neighbors[node_id])
+
+    def _contract(self, adjacency, node_id, contracted_neighbors):
+        shortcuts = self._needed_shortcuts(adjacency, node_id)
+        self.rank[node_id] = len(self.rank)
+        # every neighbor still in the graph is contracted later, i.e. more important
+        self._up[node_id] = list(adjacency[node_id].items())
+        for neighbor in adjacency[node_id]:
+            del adjacency[neighbor][node_id]
+            contracted_neighbors[neighbor] += 1
+        adjacency[node_id] = {}
+        for u, v, cost in shortcuts:
+            if cost < adjacency[u].get(v, cost + 1):
+                adjacency[u][v] = adjacency[v][u] = cost
+                self._middle[(u, v)] = self._middle[(v, u)] = node_id
+                self.shortcuts += 1
+
+    def query(self, source, target):
+        """
+        :return: (cost, list of node ids from source to target included)
+        - Fails with a RoutingException if target cannot be reached
+        """
+        if source == target:
+            return 0, [source]
+        distances = ({source: 0}, {target: 0})
+        previous = ({source: None}, {target: None})
+        heaps = ([(0, 0, source)], [(0, 0, target)])
+        counter = 1
+        best = None
+        meeting = None
+        while heaps[0] or heaps[1]:
+            for side in (0, 1):
+                heap = heaps[side]
+                if not heap:
+                    continue
+                distance, _, node_id = heapq.heappop(heap)
+                # this side cannot improve the best path anymore
+                if best is not None and distance >= best:
+                    heap.clear()
+                    continue
+                if distance > distances[side][node_id]:
+                    continue
+                other = distances[1 - side]
+                if node_id in other and (best is None or distance + other[node_id] < best):
+                    best = distance + other[node_id]
+                    meeting = node_id
+                # stall on demand: a more important neighbor already reaches this node for less, so the upward
+                # search from here cannot be on the shortest path
+                own = distances[side]
+                if any(own.get(neighbor, distance) + cost < distance for neighbor, cost in self._up[node_id]):
+                    continue
+                for neighbor, cost in self._up[node_id]:
+                    candidate = distance + cost
+                    if candidate < distances[side].get(neighbor, candidate + 1):
+                        distances[side][neighbor] = candidate
+                        previous[side][neighbor] = node_id
+                        heapq.heappush(heap, (candidate, counter, neighbor))
+                        counter += 1
+        if best is None:
+            raise RoutingException("Node " + str(target) + " is not reachable")
+        # hops of the hierarchy, shortcuts included
+        hops = path_to(previous[0], meeting)
+        node_id = previous[1][meeting]
+        while node_id is not None:
+            hops.append(node_id)
+            node_id = previous[1][node_id]
+        return best, self._unpack(hops)
+
+    def _unpack(self, hops):
+        path = [hops[0]]
+        for a, b in zip(hops, hops[1:]):
+            stack = [(a, b)]
+            while stack:
+                u, v = stack.pop()
+                middle = self._middle.get((u, v))
+                if middle is None:
+                    path.append(v)
+                else:
+                    stack.append((middle, v))
+                    stack.append((u, middle))
+        return path
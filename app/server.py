@@ -0,0 +1,321 @@
+import asyncio
+import itertools
+import struct
+
+from .messaging import Key, Message, Priority
+from .person import Person
+from .snapshot import pack_values, unpack_values
+
+# Requests:  payload length (u32) | request id (u32) | operation (u8) | pack_values(arguments)
+# Responses: payload length (u32) | request id (u32) | status (u8)    | pack_values(results)
+# A connection can have many requests in flight, responses carry the request id they answer.
+_FRAME = struct.Struct("<IIB")
+
+JOIN = 1
+LEAVE = 2
+SEND = 3
+SEND_BATCH = 4
+BROADCAST = 5
+FETCH = 6
+
+OK = 0
+ERROR = 1
+
+
+class ServerException(Exception):
+    """
+    A generic exception for problems reported by the network server
+    """
+
+    pass
+
+
+def _frame(request_id, code, values):
+    payload = pack_values(values)
+    return _FRAME.pack(len(payload), request_id, code) + payload
+
+
+async def _read_frame(reader):
+    header = await reader.readexactly(_FRAME.size)
+    length, request_id, code = _FRAME.unpack(header)
+    values, _ = unpack_values(await reader.readexactly(length), 0)
+    return request_id, code, values
+
+
+class NetworkServer:
+    """
+    Expose a CommunicationNetwork over TCP or a Unix socket so that many processes can share one network
+    """
+
+    def __init__(self, network):
+        """
+        :param network: the CommunicationNetwork to serve
+        """
+        self.network = network
+        self._server = None
+
+    async def start(self, host="127.0.0.1", port=0, path=None):
+        """
+        Start listening, on a Unix socket if path is given, on host:port otherwise (port 0 picks a free port)
+        :return: the address the server listens on
+        """
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._serve, path=path)
+        else:
+            self._server = await asyncio.start_server(self._serve, host, port)
+        return self.address
+
+    @property
+    def address(self):
+        return self._server.sockets[0].getsockname()
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request_id, operation, arguments = await _read_frame(reader)
+                except asyncio.IncompleteReadError:
+                    break
+                try:
+                    writer.write(_frame(request_id, OK, self.handle(operation, arguments)))
+                except Exception as error:
+                    writer.write(_frame(request_id, ERROR, [str(error) or type(error).__name__]))
+                # only blocks when the client stopped reading and the socket buffer is full
+                await writer.drain()
+        finally:
+            writer.close()
+
+    def _send(self, sender, receiver, plain_content, priority, sequence=None):
+        person = self.network.persons.get(sender)
+        if person is None:
+            raise ServerException("Sender is not connected to network")
+        self.network.send(Message(sender, person._key.encode(plain_content), Priority(priority), receiver,
+                                  sequence=sequence))
+
+    def handle(self, operation, arguments):
+        """
+        Execute one request against the network
+        :param operation: one of the operation codes
+        :param arguments: the decoded arguments
+        :return: the list of values to answer with
+        """
+        network = self.network
+        if operation == SEND:
+            self._send(*arguments)
+            return []
+        if operation == SEND_BATCH:
+            # one status per message: None when delivered, the error text otherwise
+            results = []
+            for index in range(0, len(arguments), 5):
+                try:
+                    self._send(*arguments[index:index + 5])
+                    results.append(None)
+                except Exception as error:
+                    results.append(str(error) or type(error).__name__)
+            return results
+        if operation == FETCH:
+            person = network.persons.get(arguments[0])
+            if person is None:
+                raise ServerException("Person is not connected to network")
+            values = []
+            for message in person.get_all_messages():
+                values += [message.sender, message.content, int(message.priority), message.receiver]
+            return values
+        if operation == BROADCAST:
+            sender, plain_content, priority = arguments
+            person = network.persons.get(sender)
+            if person is None:
+                raise ServerException("Sender is not connected to network")
+            network.broadcast(Message(sender, person._key.encode(plain_content), Priority(priority), None))
+            return []
+        if operation == JOIN:
+            person_id, node_id, serialized_key = arguments
+            network.join_network(Person(person_id, Key.from_serialized(serialized_key)), node_id)
+            return []
+        if operation == LEAVE:
+            person = network.persons.get(arguments[0])
+            if person is None:
+                raise ServerException("Person is not connected to network")
+            network.leave_network(person)
+            return []
+        raise ServerException("Unknown operation " + str(operation))
+
+
+class _Connection:
+    """
+    One client connection with any number of requests in flight
+    """
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._task = asyncio.ensure_future(self._read_responses())
+
+    async def _read_responses(self):
+        try:
+            while True:
+                request_id, status, values = await _read_frame(self._reader)
+                future = self._pending.pop(request_id, None)
+                if future is None or future.done():
+                    continue
+                if status == OK:
+                    future.set_result(values)
+                else:
+                    future.set_exception(ServerException(values[0]))
+        except (asyncio.IncompleteReadError, ConnectionError) as error:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ServerException("Connection lost: " + str(error)))
+            self._pending.clear()
+
+    def request(self, operation, values):
+        request_id = next(self._ids) & 0xFFFFFFFF
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self._writer.write(_frame(request_id, operation, values))
+        return future
+
+    async def close(self):
+        self._writer.close()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+class NetworkClient:
+    """
+    Client of a NetworkServer. Keeps a pool of pipelined connections and groups small sends into batches.
+    Must be used from a running asyncio event loop
+    """
+
+    def __init__(self, host="127.0.0.1", port=None, path=None, pool_size=4, batch_size=64, batch_delay=0.001):
+        """
+        :param host: server host
+        :param port: server port
+        :param path: Unix socket path, used instead of host/port when given
+        :param pool_size: number of connections
+        :param batch_size: sends grouped in one request at most
+        :param batch_delay: seconds a send can wait for others before its batch is shipped
+        """
+        self.host = host
+        self.port = port
+        self.path = path
+        self.pool_size = pool_size
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._connections = []
+        self._next = 0
+        self._batch = []
+        self._batch_futures = []
+        self._batch_timer = None
+
+    async def connect(self):
+        for _ in range(self.pool_size):
+            if self.path is not None:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            else:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            self._connections.append(_Connection(reader, writer))
+        return self
+
+    def _connection(self):
+        connection = self._connections[self._next]
+        self._next = (self._next + 1) % len(self._connections)
+        return connection
+
+    async def _request(self, operation, values):
+        return await self._connection().request(operation, values)
+
+    async def join(self, person_id, node_id, serialized_key):
+        """
+        Register a person on the server
+        :param person_id: the id of the person
+        :param node_id: the node which will become the gateway for the person
+        :param serialized_key: the person's key as returned by Person.get_serialized_key
+        """
+        await self._request(JOIN, [person_id, node_id, serialized_key])
+
+    async def leave(self, person_id):
+        await self._request(LEAVE, [person_id])
+
+    def send(self, sender, receiver, plain_content, priority=Priority.LOW, sequence=None):
+        """
+        Queue a send, it is shipped with the others of its batch
+        :param sequence: see Message. A retry with the same sequence number is not delivered twice
+        :return: a future resolved once the server handled the message (raises ServerException on failure)
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._batch += [sender, receiver, plain_content, int(priority), sequence]
+        self._batch_futures.append(future)
+        if len(self._batch_futures) >= self.batch_size:
+            self.flush()
+        elif self._batch_timer is None:
+            self._batch_timer = asyncio.get_running_loop().call_later(self.batch_delay, self.flush)
+        return future
+
+    def flush(self):
+        """
+        Ship the queued sends now
+        """
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        if not self._batch_futures:
+            return
+        values, futures = self._batch, self._batch_futures
+        self._batch, self._batch_futures = [], []
+        # batches always use the first connection so that messages arrive in the order they were queued
+        request = self._connections[0].request(SEND_BATCH, values)
+
+        def settle(done):
+            if done.exception() is not None:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(done.exception())
+                return
+            for future, error in zip(futures, done.result()):
+                if future.done():
+                    continue
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(ServerException(error))
+        request.add_done_callback(settle)
+
+    async def broadcast(self, sender, plain_content, priority=Priority.LOW):
+        await self._request(BROADCAST, [sender, plain_content, int(priority)])
+
+    async def fetch(self, person_id):
+        """
+        Retrieve the decoded messages waiting for the person. Queued sends are shipped and waited for first
+        :return: the ORDERED list of messages
+        """
+        futures = list(self._batch_futures)
+        self.flush()
+        await asyncio.gather(*futures, return_exceptions=True)
+        values = await self._request(FETCH, [person_id])
+        return [Message(values[index], values[index + 1], Priority(values[index + 2]), values[index + 3])
+                for index in range(0, len(values), 4)]
+
+    async def close(self):
+        self.flush()
+        for connection in self._connections:
+            await connection.close()
+        self._connections = []
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
@@ -0,0 +1,310 @@
+import multiprocessing
+from collections import defaultdict, deque
+
+from .messaging import Key, Message, Priority
+from .person import Person
+
+# Commands sent to the workers. Every command is a tuple whose first item is one of these
+_JOIN = "join"
+_LEAVE = "leave"
+_KEYS = "keys"
+_DELIVER = "deliver"
+_RESTORE = "restore"
+_READ = "read"
+_STOP = "stop"
+
+
+class ShardingException(Exception):
+    """
+    A generic exception for problems in the sharded network
+    """
+
+    pass
+
+
+def partition(network, shards):
+    """
+    Split the nodes in `shards` groups of (almost) the same size. Nodes are taken in breadth first order so that
+    neighbours tend to end up in the same shard and most hops stay local
+    :param network: a CommunicationNetwork
+    :param shards: number of groups
+    :return: dict node_id -> shard index
+    """
+    order = []
+    seen = set()
+    for start in network.node_index_list:
+        if start in seen:
+            continue
+        seen.add(start)
+        queue = deque([start])
+        while queue:
+            node_id = queue.popleft()
+            order.append(node_id)
+            for neighbor, _ in network.network[node_id]:
+                if neighbor not in seen:
+                    seen.add(neighbor)
+                    queue.append(neighbor)
+    size = -(-len(order) // shards) if order else 1
+    return {node_id: index // size for index, node_id in enumerate(order)}
+
+
+def _pack(message):
+    # every field of the message: expiry, duplicate suppression and traces keep working across the pipes
+    trace = None if message.trace is None else tuple(message.trace)
+    return (message.sender, message.content, int(message.priority), message.receiver, message.deadline,
+            getattr(message, "sequence", None), trace, message.cost)
+
+
+def _unpack(fields):
+    sender, content, priority, receiver, deadline, sequence, trace, cost = fields
+    message = Message(sender, content, Priority(priority), receiver, trace=trace is not None, deadline=deadline,
+                      sequence=sequence)
+    if trace is not None:
+        message.trace.extend(trace)
+    message.cost = cost
+    return message
+
+
+def _worker_main(connection, node_ids):
+    """
+    Body of a worker process: owns the Node mailboxes of its nodes and the registry entries of the persons attached
+    to them, executes the commands sent by the coordinator until _STOP
+    """
+    # imported here so that the module can be loaded by the network module without a cycle
+    from .network import CommunicationNetwork, Node
+    local = CommunicationNetwork()
+    for node_id in node_ids:
+        local.add(Node(node_id))
+    registry = local._registry
+    while True:
+        command = connection.recv()
+        kind = command[0]
+        if kind == _DELIVER:
+            for node_id, fields in command[1]:
+                local.nodes[node_id].receive(_unpack(fields))
+        elif kind == _READ:
+            person = local.persons.get(command[1])
+            messages = person.get_all_messages() if person is not None else []
+            connection.send([_pack(message) for message in messages])
+        elif kind == _KEYS:
+            # keys of persons living on other shards, needed to decode their messages
+            for person_id, serialized_key in command[1]:
+                if person_id not in local.persons:
+                    registry.set_serialized_key(person_id, serialized_key)
+        elif kind == _JOIN:
+            _, person_id, node_id, serialized_key = command
+            if registry.get_key_id(person_id) is not None:
+                registry.delete(person_id)
+            local.join_network(Person(person_id, Key.from_serialized(serialized_key)), node_id)
+        elif kind == _LEAVE:
+            person = local.persons.get(command[1])
+            if person is not None:
+                local.leave_network(person)
+        elif kind == _RESTORE:
+            _, node_id, person_id, entries = command
+            local.nodes[node_id].put_mailbox(person_id, [_unpack(fields) for fields in entries])
+        elif kind == _STOP:
+            connection.close()
+            return
+
+
+class ShardedNetwork:
+    """
+    A CommunicationNetwork whose nodes are partitioned across worker processes.
+    Every worker owns the mailboxes of its nodes and the registry slice of the persons attached to them, and does the
+    delivery and decoding work for them. The coordinator (this object) keeps the global topology and the person ->
+    node index, computes the routes and ships the messages to the owning workers over pipes, batching deliveries.
+    The topology is fixed once the network is sharded. The persons of the network are bound to the coordinator:
+    their send and get_all_messages go through the shards. Groups and subscriptions are not supported.
+    """
+
+    def __init__(self, network, shards=2, batch_size=256, start_method=None):
+        """
+        Shard an existing network: nodes, links, registry and queued messages are moved to the workers
+        :param network: the CommunicationNetwork to shard. It is used afterwards as the routing table of the
+            coordinator, its mailboxes are emptied
+        :param shards: number of worker processes
+        :param batch_size: deliveries kept per shard before they are shipped
+        :param start_method: multiprocessing start method (None = platform default)
+        """
+        if shards < 1:
+            raise ShardingException("At least one shard is needed")
+        self.topology = network
+        self.batch_size = batch_size
+        self.owner = partition(network, shards)
+        self.shards = max(self.owner.values()) + 1 if self.owner else 1
+        self._routes = {}  # (source node, destination node) -> hops, the topology is fixed
+        self._outbox = defaultdict(list)
+        context = multiprocessing.get_context(start_method)
+        node_groups = defaultdict(list)
+        for node_id, shard in self.owner.items():
+            node_groups[shard].append(node_id)
+        self._connections = []
+        self._processes = []
+        for shard in range(self.shards):
+            parent, child = context.Pipe()
+            process = context.Process(target=_worker_main, args=(child, node_groups[shard]), daemon=True)
+            process.start()
+            child.close()
+            self._connections.append(parent)
+            self._processes.append(process)
+
+        registry = network._registry
+        keys = [(person_id, registry.get_serialized_key(person_id)) for person_id in registry.persons]
+        for connection in self._connections:
+            connection.send((_KEYS, keys))
+        for node_id, persons in registry.database.items():
+            for person_id in persons:
+                self._connection(node_id).send((_JOIN, person_id, node_id, registry.get_serialized_key(person_id)))
+        for node_id, node in network.nodes.items():
+            for person_id, messages in node.messages.items():
+                if messages:
+                    self._connection(node_id).send((_RESTORE, node_id, person_id,
+                                                    [_pack(message) for message in messages]))
+            node.messages.clear()
+        for person in network.persons.values():
+            person.network = self
+
+    def _connection(self, node_id):
+        if not self._connections:
+            raise ShardingException("The sharded network is closed")
+        return self._connections[self.owner[node_id]]
+
+
+    def join_network(self, person_id, node_id, serialized_key):
+        """
+        Register a person at the given node
+        - Fails with a RegistryException if the person is already registered
+        """
+        self.topology._registry.insert(person_id, node_id, serialized_key)
+        self.flush()
+        for shard, connection in enumerate(self._connections):
+            if shard == self.owner[node_id]:
+                connection.send((_JOIN, person_id, node_id, serialized_key))
+            else:
+                connection.send((_KEYS, [(person_id, serialized_key)]))
+
+    def leave_network(self, person_id):
+        """
+        Remove the person, its unread messages and its registry entries
+        """
+        if not self.topology._registry.is_connected(person_id):
+            raise ShardingException("Person is not connected to the network")
+        self.flush()
+        self.topology._registry.delete(person_id)
+        for connection in self._connections:
+            connection.send((_LEAVE, person_id))
+
+    def _route(self, source_node, destination_node):
+        route = self._routes.get((source_node, destination_node))
+        if route is None:
+            route = self._routes[(source_node, destination_node)] = self.topology.route(source_node, destination_node)
+        return route
+
+    def _deliver(self, message, source_node, destination_node):
+        for hop in self._route(source_node, destination_node):
+            self.forward(message, hop)
+        shard = self.owner[destination_node]
+        outbox = self._outbox[shard]
+        outbox.append((destination_node, _pack(message)))
+        if len(outbox) >= self.batch_size:
+            self._connections[shard].send((_DELIVER, outbox))
+            self._outbox[shard] = []
+
+    def forward(self, message, node_id):
+        """
+        Simulate the forward of the message to an (intermediate) node. Hops between nodes of different shards are the
+        ones that cross a process boundary, the delivery itself is shipped to the shard owning the last node
+        """
+        pass
+
+    def send(self, message):
+        """
+        Send the message to message.receiver
+        - Fail if the sender or the receiver are not registered
+        """
+        registry = self.topology._registry
+        source_node = registry.get_node_id(message.sender)
+        if source_node is None:
+            raise ShardingException("Sender is not connected to network")
+        destination_node = registry.get_node_id(message.receiver)
+        if destination_node is None:
+            raise ShardingException("Receiver is not connected to network")
+        self._deliver(message, source_node, destination_node)
+
+    def send_batch(self, messages):
+        """
+        Send the messages one by one, see send
+        """
+        for message in messages:
+            self.send(message)
+
+    def multicast_send(self, message, group_name):
+        raise ShardingException("Groups are not supported by the sharded network")
+
+    def watch(self, person):
+        # the mailboxes live in the workers, which have no way to call back into the coordinator
+        raise ShardingException("Subscriptions are not supported by the sharded network")
+
+    def unwatch(self, person_id):
+        pass
+
+    def broadcast(self, message):
+        """
+        Send the message to every connected person but the sender
+        - Fail if message.receiver is not None or the sender is not registered
+        """
+        if message.receiver is not None:
+            raise ShardingException("Reciever is not none")
+        source_node = self.topology._registry.get_node_id(message.sender)
+        if source_node is None:
+            raise ShardingException("Sender is not connected to network")
+        for node_id in self.topology.node_index_list:
+            self._deliver(message, source_node, node_id)
+
+    def flush(self):
+        """
+        Ship every pending delivery to its shard
+        """
+        for shard, outbox in self._outbox.items():
+            if outbox:
+                self._connections[shard].send((_DELIVER, outbox))
+        self._outbox.clear()
+
+    def get_all_messages(self, person_id):
+        """
+        Retrieve and decode (in the owning worker) all the messages waiting for the person
+        :return: the ORDERED list of decoded messages
+        """
+        node_id = self.topology._registry.get_node_id(person_id)
+        if node_id is None:
+            raise ShardingException("Person is not connected to the network")
+        self.flush()
+        connection = self._connection(node_id)
+        connection.send((_READ, person_id))
+        return [_unpack(fields) for fields in connection.recv()]
+
+    def read_messages(self, person):
+        """
+        Person.get_all_messages of the persons bound to this network
+        """
+        return self.get_all_messages(person.get_person_id())
+
+    def close(self):
+        """
+        Stop the workers. Undelivered batches are shipped first
+        """
+        self.flush()
+        for connection in self._connections:
+            connection.send((_STOP,))
+            connection.close()
+        for process in self._processes:
+            process.join()
+        self._connections = []
+        self._processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
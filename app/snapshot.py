@@ -0,0 +1,430 @@
+import os
+import struct
+import sys
+from array import array
+from collections import deque
+from itertools import accumulate
+
+from .messaging import Key, Message, Priority
+from .person import Person
+
+# File layout:
+#   MAGIC | version (u16) | sections...
+# every section is  tag (u8) | payload length (u64) | payload
+# so a reader can skip what it does not know and every bulk part is read with a single slice
+MAGIC = b"CNSNAP"
+VERSION = 1
+
+SECTION_NODES = 1
+SECTION_REGISTRY = 2
+SECTION_MESSAGES = 3
+SECTION_MAILBOXES = 4
+SECTION_CHECKPOINT = 5  # optional: id of the journal checkpoint the snapshot was taken at
+SECTION_GROUPS = 6  # optional: multicast groups and their members
+SECTION_DEADLINES = 7  # optional: expiry time of every message (None for no expiry), same order as SECTION_MESSAGES
+SECTION_SEQUENCES = 8  # optional: sequence number of every message (None if not numbered), same order as SECTION_MESSAGES
+SECTION_WINDOWS = 9  # optional: duplicate window of every node and sender, see Node.is_duplicate
+SECTION_DEFERRED = 10  # optional: messages waiting for admission, laid out like SECTION_MAILBOXES
+
+_HEADER = struct.Struct("<6sH")
+_SECTION = struct.Struct("<BQ")
+_COUNT = struct.Struct("<I")
+
+# kinds used to tag every packed value
+_NONE = 0
+_INT = 1
+_FLOAT = 2
+_STR = 3
+_BYTES = 4
+
+
+class SnapshotException(Exception):
+    """
+    A generic exception for problems while saving or loading a snapshot
+    """
+
+    pass
+
+
+def _u32_array(values):
+    packed = array("I", values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _read_u32_array(buffer, offset, count):
+    values = array("I")
+    values.frombytes(buffer[offset:offset + 4 * count])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values, offset + 4 * count
+
+
+# exact type -> kind, subclasses (e.g. IntEnum) are looked up by _kind_of
+_KINDS = {str: _STR, int: _INT, type(None): _NONE, float: _FLOAT, bytes: _BYTES}
+
+
+def _kind_of(value):
+    kind = _KINDS.get(type(value))
+    if kind is not None:
+        return kind
+    for value_type, kind in _KINDS.items():
+        if isinstance(value, value_type):
+            return kind
+    if isinstance(value, bytearray):
+        return _BYTES
+    raise SnapshotException("Cannot store a value of type " + type(value).__name__)
+
+
+def _pack_other(value):
+    if value is None:
+        return b""
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    if isinstance(value, int):
+        return str(int(value)).encode("ascii")
+    return repr(value).encode("ascii")
+
+
+def pack_values(values):
+    """
+    Pack a list of ids/costs/contents (None, int, float, str or bytes) in a single length-prefixed block
+    :param values: the list of values
+    :return: the packed bytes
+    """
+    # column wise: all the kinds, then all the lengths, then all the data
+    kinds = bytes([_KINDS.get(type(value)) or _kind_of(value) for value in values])
+    blobs = [value.encode("utf-8") if type(value) is str else
+             str(value).encode("ascii") if type(value) is int else _pack_other(value) for value in values]
+    return _COUNT.pack(len(kinds)) + kinds + _u32_array([len(blob) for blob in blobs]) + b"".join(blobs)
+
+
+def unpack_values(buffer, offset):
+    """
+    Read back a block written by pack_values
+    :param buffer: bytes or memoryview holding the block
+    :param offset: where the block starts
+    :return: (the list of values, offset right after the block)
+    """
+    (count,) = _COUNT.unpack_from(buffer, offset)
+    offset += _COUNT.size
+    kinds = bytes(buffer[offset:offset + count])
+    offset += count
+    lengths, offset = _read_u32_array(buffer, offset, count)
+    ends = list(accumulate(lengths))
+    position = ends[-1] if ends else 0
+    blob = bytes(buffer[offset:offset + position])
+    starts = [0] + ends[:-1]
+    if kinds.count(_STR) == count and blob.isascii():
+        # fast path for plain text columns: one decode, then slicing
+        text = blob.decode("ascii")
+        return [text[start:end] for start, end in zip(starts, ends)], offset + position
+    values = []
+    for kind, start, end in zip(kinds, starts, ends):
+        chunk = blob[start:end]
+        if kind == _STR:
+            values.append(chunk.decode("utf-8"))
+        elif kind == _INT:
+            values.append(int(chunk))
+        elif kind == _NONE:
+            values.append(None)
+        elif kind == _FLOAT:
+            values.append(float(chunk))
+        elif kind == _BYTES:
+            values.append(chunk)
+        else:
+            raise SnapshotException("Unknown value kind " + str(kind))
+    return values, offset + position
+
+
+def _section(tag, parts):
+    payload = b"".join(parts)
+    return _SECTION.pack(tag, len(payload)) + payload
+
+
+def _nodes_section(network):
+    node_ids = list(network.node_index_list)
+    position = {node_id: index for index, node_id in enumerate(node_ids)}
+    degrees = []
+    neighbors = []
+    costs = []
+    for node_id in node_ids:
+        links = network.network[node_id]
+        degrees.append(len(links))
+        for neighbor, cost in links:
+            neighbors.append(position[neighbor])
+            costs.append(cost)
+    return _section(SECTION_NODES, [pack_values(node_ids), _u32_array(degrees), _u32_array(neighbors),
+                                    pack_values(costs)])
+
+
+def _registry_section(registry):
+    person_ids = []
+    node_ids = []
+    for node_id, persons in registry.database.items():
+        for person_id in persons:
+            person_ids.append(person_id)
+            node_ids.append(node_id)
+    keys = [registry.get_serialized_key(person_id) for person_id in person_ids]
+    return _section(SECTION_REGISTRY, [pack_values(person_ids), pack_values(node_ids), pack_values(keys)])
+
+
+def _groups_section(registry):
+    names = list(registry.groups)
+    members = [person_id for name in names for person_id in registry.groups[name]]
+    return _section(SECTION_GROUPS, [pack_values(names), _u32_array([len(registry.groups[name]) for name in names]),
+                                     pack_values(members)])
+
+
+def _queues_parts(owners, person_ids, counts, entries):
+    return [_COUNT.pack(len(owners)), _u32_array(owners), pack_values(person_ids), _u32_array(counts),
+            _COUNT.pack(len(entries)), _u32_array(entries)]
+
+
+def _read_queues(section):
+    """
+    :return: list of (owner position, person_id, list of message indexes), see _queues_parts
+    """
+    (count,) = _COUNT.unpack_from(section, 0)
+    owners, offset = _read_u32_array(section, _COUNT.size, count)
+    person_ids, offset = unpack_values(section, offset)
+    counts, offset = _read_u32_array(section, offset, count)
+    (total,) = _COUNT.unpack_from(section, offset)
+    entries, offset = _read_u32_array(section, offset + _COUNT.size, total)
+    queues = []
+    position = 0
+    for owner, person_id, size in zip(owners, person_ids, counts):
+        queues.append((owner, person_id, entries[position:position + size]))
+        position += size
+    return queues
+
+
+def _mailbox_sections(network):
+    # the same broadcast message sits in many mailboxes: store it once and refer to it by index
+    message_index = {}
+    messages = []
+    owners = []
+    person_ids = []
+    counts = []
+    entries = []
+    # same layout for the deferred messages, which share the messages of the mailboxes
+    deferred = ([], [], [], [])
+
+    def queue(parts, position, person_id, queued):
+        parts[0].append(position)
+        parts[1].append(person_id)
+        parts[2].append(len(queued))
+        for message in queued:
+            index = message_index.get(id(message))
+            if index is None:
+                index = len(messages)
+                message_index[id(message)] = index
+                messages.append(message)
+            parts[3].append(index)
+
+    for position, node_id in enumerate(network.node_index_list):
+        node = network.nodes[node_id]
+        for person_id, mailbox in node.messages.items():
+            if len(mailbox) != 0:
+                queue((owners, person_ids, counts, entries), position, person_id, mailbox)
+        for person_id, queued in node._deferred.items():
+            if queued:
+                queue(deferred, position, person_id, queued)
+    messages_section = _section(SECTION_MESSAGES, [
+        pack_values([message.sender for message in messages]),
+        pack_values([message.content for message in messages]),
+        bytes(int(message.priority) for message in messages),
+        pack_values([message.receiver for message in messages]),
+    ])
+    mailboxes_section = _section(SECTION_MAILBOXES, _queues_parts(owners, person_ids, counts, entries))
+    if deferred[0]:
+        mailboxes_section += _section(SECTION_DEFERRED, _queues_parts(*deferred))
+    deadlines = [message.deadline for message in messages]
+    if any(deadline is not None for deadline in deadlines):
+        messages_section += _section(SECTION_DEADLINES, [pack_values(deadlines)])
+    sequences = [message.sequence for message in messages]
+    if any(sequence is not None for sequence in sequences):
+        messages_section += _section(SECTION_SEQUENCES, [pack_values(sequences)])
+    return messages_section, mailboxes_section
+
+
+def _windows_section(network):
+    # a retried send after the load must still be found a duplicate
+    owners = []
+    senders = []
+    highest = []
+    seen = []
+    for position, node_id in enumerate(network.node_index_list):
+        for sender, window in network.nodes[node_id]._windows.items():
+            owners.append(position)
+            senders.append(sender)
+            highest.append(window[0])
+            seen.append(window[1])
+    return _section(SECTION_WINDOWS, [_COUNT.pack(len(owners)), _u32_array(owners), pack_values(senders),
+                                      pack_values(highest), pack_values(seen)])
+
+
+def save(network, path, checkpoint=None):
+    """
+    Write the whole state of the network (nodes, links, registry and unread messages) to a binary file.
+    The file is written next to the target and renamed so a crash never leaves a half written snapshot.
+    :param network: the CommunicationNetwork to store
+    :param path: destination file
+    :param checkpoint: id of the journal checkpoint this snapshot corresponds to, if any
+    :return:
+    """
+    messages_section, mailboxes_section = _mailbox_sections(network)
+    temporary_path = str(path) + ".tmp"
+    with open(temporary_path, "wb") as stream:
+        stream.write(_HEADER.pack(MAGIC, VERSION))
+        stream.write(_nodes_section(network))
+        stream.write(_registry_section(network._registry))
+        stream.write(messages_section)
+        stream.write(mailboxes_section)
+        if network._registry.groups:
+            stream.write(_groups_section(network._registry))
+        if any(network.nodes[node_id]._windows for node_id in network.node_index_list):
+            stream.write(_windows_section(network))
+        if checkpoint is not None:
+            stream.write(_section(SECTION_CHECKPOINT, [struct.pack("<Q", checkpoint)]))
+        stream.flush()
+        os.fsync(stream.fileno())
+    os.replace(temporary_path, path)
+
+
+def _read_sections(buffer):
+    if len(buffer) < _HEADER.size:
+        raise SnapshotException("Snapshot is truncated")
+    magic, version = _HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise SnapshotException("Not a network snapshot")
+    if version > VERSION:
+        raise SnapshotException("Unsupported snapshot version " + str(version))
+    sections = {}
+    offset = _HEADER.size
+    while offset < len(buffer):
+        tag, length = _SECTION.unpack_from(buffer, offset)
+        offset += _SECTION.size
+        if offset + length > len(buffer):
+            raise SnapshotException("Snapshot is truncated")
+        sections[tag] = buffer[offset:offset + length]
+        offset += length
+    for tag in (SECTION_NODES, SECTION_REGISTRY, SECTION_MESSAGES, SECTION_MAILBOXES):
+        if tag not in sections:
+            raise SnapshotException("Snapshot is missing section " + str(tag))
+    return sections
+
+
+def read_checkpoint(path):
+    """
+    :param path: the snapshot file
+    :return: the journal checkpoint id stored in the snapshot, 0 if there is none
+    """
+    with open(path, "rb") as stream:
+        sections = _read_sections(memoryview(stream.read()))
+    if SECTION_CHECKPOINT not in sections:
+        return 0
+    return struct.unpack_from("<Q", sections[SECTION_CHECKPOINT], 0)[0]
+
+
+def load(path, network_class, node_class):
+    """
+    Rebuild a network from a file written by save. The file is read with a single read and the
+    nodes and mailboxes are filled directly, without replaying add/link; the persons join in one join_network_many call.
+    :param path: the snapshot file
+    :param network_class: class of the network to build
+    :param node_class: class of the nodes to build
+    :return: the rebuilt network
+    """
+    with open(path, "rb") as stream:
+        buffer = memoryview(stream.read())
+    sections = _read_sections(buffer)
+    network = network_class()
+
+    # nodes and links
+    section = sections[SECTION_NODES]
+    node_ids, offset = unpack_values(section, 0)
+    degrees, offset = _read_u32_array(section, offset, len(node_ids))
+    neighbors, offset = _read_u32_array(section, offset, sum(degrees))
+    costs, offset = unpack_values(section, offset)
+    nodes = []
+    position = 0
+    for node_id, degree in zip(node_ids, degrees):
+        node = node_class(node_id)
+        node.network = network
+        nodes.append(node)
+        network.nodes[node_id] = node
+        network.node_index_list.append(node_id)
+        network.network[node_id] = [(node_ids[neighbors[index]], costs[index])
+                                    for index in range(position, position + degree)]
+        position += degree
+
+    # registry and persons
+    section = sections[SECTION_REGISTRY]
+    person_ids, offset = unpack_values(section, 0)
+    gateways, offset = unpack_values(section, offset)
+    keys, offset = unpack_values(section, offset)
+    registry = network._registry
+    # persons trained on the same text share one key object
+    shared_keys = {}
+    placements = []
+    for person_id, node_id, serialized_key in zip(person_ids, gateways, keys):
+        key = shared_keys.get(serialized_key)
+        if key is None:
+            key = shared_keys[serialized_key] = Key.from_serialized(serialized_key)
+        placements.append((Person(person_id, key), node_id, serialized_key))
+    network.join_network_many(placements)
+
+    # messages, stored once and shared between mailboxes
+    section = sections[SECTION_MESSAGES]
+    senders, offset = unpack_values(section, 0)
+    contents, offset = unpack_values(section, offset)
+    priorities = bytes(section[offset:offset + len(senders)])
+    offset += len(senders)
+    receivers, offset = unpack_values(section, offset)
+    messages = [Message(sender, content, Priority(priority), receiver)
+                for sender, content, priority, receiver in zip(senders, contents, priorities, receivers)]
+    if SECTION_DEADLINES in sections:
+        deadlines, _ = unpack_values(sections[SECTION_DEADLINES], 0)
+        for message, deadline in zip(messages, deadlines):
+            message.deadline = deadline
+    if SECTION_SEQUENCES in sections:
+        sequences, _ = unpack_values(sections[SECTION_SEQUENCES], 0)
+        for message, sequence in zip(messages, sequences):
+            message.sequence = sequence
+
+    # mailboxes
+    for owner, person_id, indexes in _read_queues(sections[SECTION_MAILBOXES]):
+        # the deadlines are indexed by the node
+        nodes[owner].put_mailbox(person_id, [messages[index] for index in indexes])
+    # deferred messages, admitted when their mailbox is read as before the save
+    if SECTION_DEFERRED in sections:
+        for owner, person_id, indexes in _read_queues(sections[SECTION_DEFERRED]):
+            nodes[owner]._deferred[person_id] = deque(messages[index] for index in indexes)
+
+    # duplicate windows
+    if SECTION_WINDOWS in sections:
+        section = sections[SECTION_WINDOWS]
+        (count,) = _COUNT.unpack_from(section, 0)
+        owners, offset = _read_u32_array(section, _COUNT.size, count)
+        senders, offset = unpack_values(section, offset)
+        highest, offset = unpack_values(section, offset)
+        seen, offset = unpack_values(section, offset)
+        for owner, sender, sequence, bitmap in zip(owners, senders, highest, seen):
+            nodes[owner]._windows[sender] = [sequence, bitmap]
+
+    # groups
+    if SECTION_GROUPS in sections:
+        section = sections[SECTION_GROUPS]
+        names, offset = unpack_values(section, 0)
+        sizes, offset = _read_u32_array(section, offset, len(names))
+        members, offset = unpack_values(section, offset)
+        position = 0
+        for name, size in zip(names, sizes):
+            registry.groups[name] = list(members[position:position + size])
+            registry.group_versions[name] = 0
+            position += size
+    return network
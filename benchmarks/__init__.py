@@ -0,0 +1,8 @@
+"""
+Performance benchmarks for the hot paths of the communication network (routing, registry, key codec, mailboxes).
+
+- standalone:      python -m benchmarks.runner --profile quick --output results.json
+- comparison:      python -m benchmarks.runner compare old.json new.json
+- pytest-benchmark: python -m pytest benchmarks/bench_hot_paths.py
+- import time:      python -m benchmarks.import_time --budget 0.1
+"""
@@ -0,0 +1,27 @@
+"""
+pytest-benchmark entry point, run it explicitly:
+
+    python -m pytest benchmarks/bench_hot_paths.py --benchmark-json results.json
+
+Set BENCHMARK_PROFILE=full to run the large scenarios.
+"""
+import os
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from benchmarks.scenarios import scenarios  # noqa: E402
+
+SCENARIOS = scenarios(os.environ.get("BENCHMARK_PROFILE", "quick"))
+
+
+@pytest.mark.parametrize("scenario", SCENARIOS, ids=[scenario.id for scenario in SCENARIOS])
+def test_hot_path(benchmark, scenario):
+    run, reset = scenario.setup()
+    benchmark.extra_info.update(scenario.params)
+    benchmark.extra_info["ops"] = scenario.ops
+    if reset is None:
+        benchmark(run)
+    else:
+        benchmark.pedantic(run, setup=reset, rounds=20)
@@ -0,0 +1,57 @@
+"""
+Cold start benchmark: time `import app.network` in fresh interpreters.
+
+    python -m benchmarks.import_time [--module app.network] [--repeat 5] [--budget 0.1]
+
+Exits with status 1 when the best time is over the budget (seconds), so it can guard short-lived CLI workers.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# measured inside the child so that starting the interpreter itself is not counted
+_PROBE = "import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+
+
+def import_time(module="app.network", repeat=5):
+    """
+    :param module: the module to import
+    :param repeat: number of fresh interpreters
+    :return: the list of import times in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", _PROBE.format(module=module)], cwd=_ROOT, check=True,
+                                capture_output=True, text=True).stdout
+        timings.append(float(output))
+    return timings
+
+
+def loaded_modules(module="app.network"):
+    """
+    :return: the names of the modules loaded by importing module in a fresh interpreter
+    """
+    probe = "import sys; import {module}; print(' '.join(sorted(sys.modules)))".format(module=module)
+    output = subprocess.run([sys.executable, "-c", probe], cwd=_ROOT, check=True, capture_output=True,
+                            text=True).stdout
+    return output.split()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmarks.import_time")
+    parser.add_argument("--module", default="app.network")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=0.1, help="max seconds for the best import")
+    args = parser.parse_args(argv)
+    timings = import_time(args.module, args.repeat)
+    best = min(timings)
+    print("import {0}: best {1:.1f} ms, worst {2:.1f} ms, budget {3:.1f} ms".format(
+        args.module, best * 1000, max(timings) * 1000, args.budget * 1000))
+    return 0 if best <= args.budget else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
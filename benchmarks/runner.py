@@ -0,0 +1,132 @@
+"""
+Standalone benchmark runner.
+
+    python -m benchmarks.runner [--profile quick|full] [--filter TEXT] [--repeat N] [--output results.json]
+    python -m benchmarks.runner compare old.json new.json [--threshold 0.10]
+
+The comparison exits with status 1 when at least one scenario got slower than the threshold allows.
+"""
+import argparse
+import datetime
+import gc
+import json
+import platform
+import statistics
+import sys
+import time
+
+from benchmarks.scenarios import scenarios, PROFILES
+
+
+def measure(scenario, repeat=5, min_time=0.2):
+    """
+    Time a scenario: every sample runs as many rounds as needed to last at least min_time
+    :return: dict with the timings in seconds per operation
+    """
+    run, reset = scenario.setup()
+    run()  # warm up
+    if reset is not None:
+        reset()
+    rounds = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            run()
+        elapsed = time.perf_counter() - start
+        if reset is not None:
+            reset()
+        if elapsed >= min_time or rounds >= 1 << 16:
+            break
+        rounds *= 2
+    samples = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        for _ in range(rounds):
+            run()
+        samples.append((time.perf_counter() - start) / (rounds * scenario.ops))
+        if reset is not None:
+            reset()
+    return {
+        "group": scenario.group,
+        "name": scenario.name,
+        "params": scenario.params,
+        "ops": scenario.ops * rounds,
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.mean(samples),
+    }
+
+
+def run_all(profile="quick", pattern=None, repeat=5, stream=sys.stdout):
+    results = {}
+    for scenario in scenarios(profile):
+        if pattern is not None and pattern not in scenario.id:
+            continue
+        result = measure(scenario, repeat)
+        results[scenario.id] = result
+        stream.write("%-90s %12.3f us/op\n" % (scenario.id, result["median"] * 1e6))
+        stream.flush()
+    return {
+        "meta": {
+            "profile": profile,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        },
+        "results": results,
+    }
+
+
+def compare(old, new, threshold=0.10):
+    """
+    Compare two result files on the median time per operation
+    :param old: results dict of the baseline
+    :param new: results dict of the candidate
+    :param threshold: allowed slowdown (0.10 = 10%)
+    :return: list of (scenario id, old median, new median, ratio, regressed)
+    """
+    rows = []
+    for scenario_id, result in new["results"].items():
+        if scenario_id not in old["results"]:
+            continue
+        before = old["results"][scenario_id]["median"]
+        after = result["median"]
+        ratio = after / before if before > 0 else float("inf")
+        rows.append((scenario_id, before, after, ratio, ratio > 1 + threshold))
+    return rows
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "compare":
+        parser = argparse.ArgumentParser(prog="benchmarks.runner compare")
+        parser.add_argument("old")
+        parser.add_argument("new")
+        parser.add_argument("--threshold", type=float, default=0.10)
+        args = parser.parse_args(argv[1:])
+        with open(args.old) as stream:
+            old = json.load(stream)
+        with open(args.new) as stream:
+            new = json.load(stream)
+        rows = compare(old, new, args.threshold)
+        for scenario_id, before, after, ratio, regressed in rows:
+            print("%-90s %10.3f -> %10.3f us/op  x%.2f%s" % (scenario_id, before * 1e6, after * 1e6, ratio,
+                                                            "  REGRESSION" if regressed else ""))
+        return 1 if any(row[4] for row in rows) else 0
+
+    parser = argparse.ArgumentParser(prog="benchmarks.runner")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    parser.add_argument("--filter", default=None, help="only run scenarios whose id contains this text")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default=None, help="write the JSON results to this file")
+    args = parser.parse_args(argv)
+    results = run_all(args.profile, args.filter, args.repeat)
+    if args.output is not None:
+        with open(args.output, "w") as stream:
+            json.dump(results, stream, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+"""
+Parametrized benchmark scenarios. Every scenario builds its own network in setup() and returns the callable that is
+timed; one call of that callable is one "round" made of `ops` operations.
+"""
+import math
+import random
+
+from app.network import CommunicationNetwork, Mailbox, Node
+from app.messaging import Key, Message, Priority, MORSE, HUFFMAN
+from app.generator import TRAINING_TEXTS, attach_persons
+
+SHORT_TEXT = "meet me at 15"
+LONG_TEXT = " ".join(["the quick brown fox jumps over the lazy dog 42"] * 22)
+
+# sizes used by each profile
+PROFILES = {
+    "quick": {
+        "nodes": [10],
+        "persons": [1000],
+        "messages": [1000],
+        "lengths": ["short", "long"],
+        "codec_lengths": ["short", "long", "bulk"],
+    },
+    "full": {
+        "nodes": [10, 100, 1000, 10000],
+        "persons": [1000, 100000, 1000000],
+        "messages": [1000, 100000],
+        "lengths": ["short", "long"],
+        "codec_lengths": ["short", "long", "bulk"],
+    },
+}
+
+
+class Scenario:
+    """
+    A single benchmark case
+    """
+
+    def __init__(self, group, name, params, setup, ops):
+        """
+        :param group: hot path under test (routing, registry, codec, mailbox, delivery, traffic)
+        :param name: short name of the operation
+        :param params: dict with the parameters of this case
+        :param setup: callable building the state, returns (run, reset); reset may be None
+        :param ops: number of operations done by one call of run
+        """
+        self.group = group
+        self.name = name
+        self.params = params
+        self.setup = setup
+        self.ops = ops
+
+    @property
+    def id(self):
+        params = ",".join(str(key) + "=" + str(value) for key, value in sorted(self.params.items()))
+        return self.group + "." + self.name + "[" + params + "]"
+
+
+def build_topology(kind, nodes, seed=0):
+    """
+    Build a connected network with node ids 0..nodes-1 and random link costs
+    :param kind: "random" (random spanning tree + extra links) or "grid"
+    :param nodes: number of nodes
+    :param seed: random seed
+    :return: the network
+    """
+    generator = random.Random(seed)
+    cn = CommunicationNetwork()
+    node_objects = [Node(node_id) for node_id in range(nodes)]
+    for node in node_objects:
+        cn.add(node)
+    if kind == "grid":
+        side = math.ceil(math.sqrt(nodes))
+        for node_id in range(nodes):
+            if (node_id + 1) % side != 0 and node_id + 1 < nodes:
+                cn.link(node_objects[node_id], node_objects[node_id + 1], generator.randint(1, 10))
+            if node_id + side < nodes:
+                cn.link(node_objects[node_id], node_objects[node_id + side], generator.randint(1, 10))
+    elif kind == "random":
+        for node_id in range(1, nodes):
+            cn.link(node_objects[node_id], node_objects[generator.randrange(node_id)], generator.randint(1, 10))
+        # about one extra link every two nodes, to get some cycles
+        for _ in range(nodes // 2):
+            node_1, node_2 = generator.sample(range(nodes), 2)
+            if all(neighbor != node_2 for neighbor, _ in cn.network[node_1]):
+                cn.link(node_objects[node_1], node_objects[node_2], generator.randint(1, 10))
+    else:
+        raise ValueError("Unknown topology " + kind)
+    return cn
+
+
+def populate(cn, persons, seed=0):
+    """
+    Attach persons "p0".."pN" round robin to the nodes, see app.generator.attach_persons
+    :return: the list of persons
+    """
+    return attach_persons(cn, persons, seed)
+
+
+def _text(length):
+    if length == "bulk":
+        # a file-sized message, where encoding dominates
+        return " ".join([LONG_TEXT] * 64)
+    return SHORT_TEXT if length == "short" else LONG_TEXT
+
+
+def routing_scenario(topology, nodes):
+    def setup():
+        cn = build_topology(topology, nodes)
+        sources = random.Random(1).sample(range(nodes), min(5, nodes))
+
+        def run():
+            for source in sources:
+                CommunicationNetwork.find_shortest_for_all(cn.network, source)
+        return run, None
+    return Scenario("routing", "find_shortest_for_all", {"topology": topology, "nodes": nodes}, setup, 5)
+
+
+def route_scenario(topology, nodes, indexed=False):
+    def setup():
+        cn = build_topology(topology, nodes)
+        if indexed:
+            cn.build_routing_index()
+        generator = random.Random(4)
+        pairs = [(generator.randrange(nodes), generator.randrange(nodes)) for _ in range(20)]
+
+        def run():
+            for source, target in pairs:
+                cn.route(source, target)
+        return run, None
+    return Scenario("routing", "route_indexed" if indexed else "route", {"topology": topology, "nodes": nodes},
+                    setup, 20)
+
+
+def registry_scenario(persons, nodes):
+    def setup():
+        cn = build_topology("random", nodes)
+        populate(cn, persons)
+        generator = random.Random(2)
+        lookups = ["p" + str(generator.randrange(persons)) for _ in range(100)]
+        registry = cn._registry
+
+        def run():
+            for person_id in lookups:
+                registry.get_node_id(person_id)
+        return run, None
+    return Scenario("registry", "get_node_id", {"persons": persons, "nodes": nodes}, setup, 100)
+
+
+CODEC_NAMES = {MORSE: "morse", HUFFMAN: "huffman"}
+
+
+def codec_scenario(operation, length, codec=MORSE):
+    def setup():
+        key = Key(TRAINING_TEXTS[0], codec)
+        plain = _text(length)
+        encoded = key.encode(plain)
+
+        if operation == "encode":
+            def run():
+                for _ in range(100):
+                    key.encode(plain)
+        else:
+            def run():
+                for _ in range(100):
+                    key.decode(encoded)
+        return run, None
+    return Scenario("codec", operation, {"length": length, "codec": CODEC_NAMES[codec]}, setup, 100)
+
+
+def mailbox_scenario(messages):
+    def setup():
+        cn = build_topology("random", 2)
+        person = populate(cn, 1)[0]
+        node = cn.nodes[cn._registry.get_node_id(person.get_person_id())]
+        priorities = [Priority.LOW, Priority.MEDIUM, Priority.HIGH]
+        template = [Message("p0", "encoded", priorities[index % 3], "p0") for index in range(messages)]
+
+        def run():
+            node.messages[person.get_person_id()] = Mailbox(template)
+            node.get_all_messages(person)
+        return run, None
+    return Scenario("mailbox", "get_all_messages", {"messages": messages}, setup, messages)
+
+
+def delivery_scenario(mode, persons, messages, mix):
+    def setup():
+        cn = build_topology("random", 2)
+        people = populate(cn, persons)
+        registry = cn._registry
+        node = cn.nodes[0]
+        local = [person for person in people if registry.get_node_id(person.get_person_id()) == 0]
+        senders = [person.get_person_id() for person in people[:50]]
+        encoded = {sender: registry.get_key(sender).encode(SHORT_TEXT) for sender in senders}
+        priorities = [Priority.LOW, Priority.MEDIUM, Priority.HIGH]
+
+        def fill():
+            # new messages every round, decoded views are cached per message
+            if mix == "broadcast":
+                for index in range(messages // len(local)):
+                    sender = senders[index % len(senders)]
+                    message = Message(sender, encoded[sender], priorities[index % 3])
+                    for person in local:
+                        node.messages[person.get_person_id()].append(message)
+                return
+            for index in range(messages):
+                sender = senders[index % len(senders)]
+                receiver = local[index % len(local)].get_person_id()
+                node.messages[receiver].append(Message(sender, encoded[sender], priorities[index % 3], receiver))
+
+        if mode == "drain_all":
+            def run():
+                fill()
+                node.drain_all()
+        else:
+            def run():
+                fill()
+                for person in local:
+                    person.get_all_messages()
+        return run, None
+    # ops are delivered messages: the result is the per node delivery throughput
+    return Scenario("delivery", mode, {"persons": persons, "messages": messages, "mix": mix}, setup, messages)
+
+
+def traffic_scenario(mix, topology, nodes, persons, length):
+    def setup():
+        cn = build_topology(topology, nodes)
+        people = populate(cn, persons)
+        generator = random.Random(3)
+        plain = _text(length)
+        plan = []
+        for _ in range(100):
+            sender = people[generator.randrange(persons)]
+            broadcast = mix == "broadcast" or (mix == "mixed" and generator.random() < 0.1)
+            receiver = None if broadcast else people[generator.randrange(persons)].get_person_id()
+            plan.append((sender, receiver))
+
+        def run():
+            for sender, receiver in plan:
+                if receiver is None:
+                    sender.send_message_to_everyone(plain)
+                else:
+                    sender.send_message_to(receiver, plain)
+
+        def reset():
+            for node in cn.nodes.values():
+                node.messages.clear()
+        return run, reset
+    params = {"topology": topology, "nodes": nodes, "persons": persons, "length": length}
+    return Scenario("traffic", mix, params, setup, 100)
+
+
+def scenarios(profile="quick"):
+    """
+    :param profile: one of PROFILES
+    :return: the list of scenarios of the profile
+    """
+    sizes = PROFILES[profile]
+    result = []
+    for topology in ("random", "grid"):
+        for nodes in sizes["nodes"]:
+            result.append(routing_scenario(topology, nodes))
+            result.append(route_scenario(topology, nodes))
+            result.append(route_scenario(topology, nodes, indexed=True))
+    for persons in sizes["persons"]:
+        result.append(registry_scenario(persons, sizes["nodes"][0]))
+    for codec in CODEC_NAMES:
+        for length in sizes["codec_lengths"]:
+            result.append(codec_scenario("encode", length, codec))
+            result.append(codec_scenario("decode", length, codec))
+    for messages in sizes["messages"]:
+        result.append(mailbox_scenario(messages))
+        for mix in ("unicast", "broadcast"):
+            for mode in ("get_all_messages", "drain_all"):
+                result.append(delivery_scenario(mode, sizes["persons"][0], messages, mix))
+    for mix in ("unicast", "broadcast", "mixed"):
+        for nodes in sizes["nodes"]:
+            for length in sizes["lengths"]:
+                result.append(traffic_scenario(mix, "random", nodes, sizes["persons"][0], length))
+    return result
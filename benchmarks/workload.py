@@ -0,0 +1,58 @@
+"""
+Generate and replay workload traces, so that everyone benchmarks the same scenarios.
+
+    python -m benchmarks.workload generate trace.bin [--model grid] [--nodes 100] [--persons 1000]
+                                                     [--events 10000] [--seed 0]
+    python -m benchmarks.workload replay trace.bin [--repeat 3] [--profile DIR]
+
+Replay rebuilds the network recorded in the trace (not timed) and runs its events back to back.
+With --profile, one more replay runs under CommunicationNetwork.profile and its reports are written to DIR.
+"""
+import argparse
+import sys
+
+from app.generator import MODELS, generate_trace, write_trace, read_trace, replay
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmarks.workload")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate = commands.add_parser("generate")
+    generate.add_argument("path")
+    generate.add_argument("--model", choices=MODELS, default="grid")
+    generate.add_argument("--nodes", type=int, default=100)
+    generate.add_argument("--persons", type=int, default=1000)
+    generate.add_argument("--events", type=int, default=10000)
+    generate.add_argument("--seed", type=int, default=0)
+    run = commands.add_parser("replay")
+    run.add_argument("path")
+    run.add_argument("--repeat", type=int, default=3)
+    run.add_argument("--profile", metavar="DIR")
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        trace = generate_trace(args.model, args.nodes, args.persons, args.events, args.seed)
+        write_trace(args.path, trace)
+        print("{0} events on {1} ({2} nodes, {3} persons) written to {4}".format(
+            len(trace.events), args.model, args.nodes, args.persons, args.path))
+        return 0
+    trace = read_trace(args.path)
+    best = None
+    for _ in range(args.repeat):
+        result = replay(trace)
+        if best is None or result["seconds"] < best["seconds"]:
+            best = result
+    print("{0}: {1} events in {2:.3f} s, {3:.0f} events/s".format(
+        args.path, best["events"], best["seconds"], best["events_per_second"]))
+    for name, count in best["counts"].items():
+        print("  {0:<10} {1}".format(name, count))
+    if args.profile:
+        network = trace.build()
+        with network.profile(args.profile):
+            replay(trace, network)
+        print("profile written to {0}".format(args.profile))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
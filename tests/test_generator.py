@@ -0,0 +1,60 @@
+import pytest
+
+from app.journal import Journal, read_records, JOIN
+from app.registry import RegistryException
+from app.generator import (MODELS, SEND, LEAVE, LINK_DOWN, LINK_UP, build_network, attach_persons, generate_trace,
+                           write_trace, read_trace, replay, GeneratorException)
+
+
+def test_models_build_connected_networks():
+    for model in MODELS:
+        cn = build_network(model, 60, seed=4)
+        assert cn.node_index_list == list(range(60))
+        assert cn.is_valid()
+        # same seed, same network
+        assert build_network(model, 60, seed=4).network == cn.network
+    tree = build_network("tree", 60, branching=3)
+    assert sum(len(links) for links in tree.network.values()) == 2 * 59
+    with pytest.raises(GeneratorException):
+        build_network("ring", 10)
+
+    persons = attach_persons(cn, 100)
+    assert len(cn.persons) == 100 and cn._registry.get_node_id("p99") is not None
+    # keys are trained once and shared
+    assert len({id(person._key) for person in persons}) == len(cn._registry.keys)
+
+
+def test_attached_persons_join_like_join_network(tmp_path):
+    cn = build_network(MODELS[0], 10, seed=1)
+    cn.attach_journal(Journal(tmp_path / "network.wal", sync_interval=10))
+    cn.enable_metrics()
+    persons = attach_persons(cn, 20)
+    persons[0].get_all_messages()
+    assert cn.metrics()["calls"]["person.get_all_messages"] == 1
+    cn.disable_metrics()
+    # nobody joins when one of them is already there
+    with pytest.raises(RegistryException):
+        attach_persons(cn, 30)
+    assert len(cn.persons) == 20 and cn._registry.get_node_id("p25") is None
+    cn.detach_journal().close()
+    assert sum(operation == JOIN for operation, _ in read_records(tmp_path / "network.wal")) == 20
+
+
+def test_trace_round_trip_and_replay(tmp_path):
+    trace = generate_trace("grid", 36, 50, 2000, seed=2)
+    kinds = [event[0] for event in trace.events]
+    assert len(kinds) == 2000 and {SEND, LEAVE, LINK_DOWN, LINK_UP} <= set(kinds)
+    assert generate_trace("grid", 36, 50, 2000, seed=2).events == trace.events
+
+    path = tmp_path / "trace.bin"
+    write_trace(path, trace)
+    loaded = read_trace(path)
+    assert loaded.events == trace.events and (loaded.model, loaded.nodes, loaded.persons) == ("grid", 36, 50)
+
+    result = replay(loaded)
+    assert result["events"] == 2000 and result["events_per_second"] > 0
+    assert result["counts"]["send"] == kinds.count(SEND)
+
+    path.write_bytes(b"nope")
+    with pytest.raises(GeneratorException):
+        read_trace(path)
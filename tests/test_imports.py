@@ -0,0 +1,14 @@
+import app
+from benchmarks.import_time import loaded_modules
+
+
+def test_optional_subsystems_load_lazily():
+    modules = loaded_modules("app.network")
+    for heavy in ["asyncio", "multiprocessing", "app.metrics", "app.profiling", "app.sharding", "app.server"]:
+        assert heavy not in modules
+
+
+def test_package_exports():
+    assert app.CommunicationNetwork is app.network.CommunicationNetwork
+    assert app.Key is app.messaging.Key
+    assert "Person" in dir(app)
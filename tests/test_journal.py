@@ -0,0 +1,197 @@
+import time
+
+from app.network import Node, CommunicationNetwork
+from app.person import Person
+from app.messaging import Key, Message, Priority
+from app.journal import Journal, read_records, LINK, RECEIVE
+
+
+def test_recover_from_snapshot_and_journal(tmp_path):
+    """
+    Take a snapshot in the middle of the activity and check that snapshot + journal give back the same network
+    """
+    snapshot_path = tmp_path / "network.snap"
+    journal_path = tmp_path / "network.wal"
+
+    cn: CommunicationNetwork[int] = CommunicationNetwork()
+    cn.attach_journal(Journal(journal_path, sync_interval=10))
+    node_1 = Node(1)
+    node_2 = Node(2)
+    cn.add(node_1)
+    cn.add(node_2)
+    cn.link(node_1, node_2, 4)
+
+    alice = Person("alice", Key("this is a simple text to train create the key"))
+    bob = Person("bob", Key("this is another text. this is another text. bob"))
+    cn.join_network(alice, node_1.node_id)
+    cn.join_network(bob, node_2.node_id)
+    alice.send_message_to("bob", "before the snapshot")
+
+    cn.save(snapshot_path)
+
+    # everything after the snapshot lives only in the journal
+    node_3 = Node(3)
+    cn.add(node_3)
+    cn.link(node_2, node_3, 1)
+    carol = Person("carol", Key("carol carol carol"))
+    cn.join_network(carol, node_3.node_id)
+    bob.send_urgent_message_to_everyone("after the snapshot")
+    assert len(alice.get_all_messages()) == 1
+    cn.detach_journal().close()
+
+    records = read_records(journal_path)
+    assert any(operation == LINK for operation, _ in records)
+    assert any(operation == RECEIVE for operation, _ in records)
+
+    recovered = CommunicationNetwork.recover(snapshot_path, journal_path)
+    assert recovered.node_index_list == [1, 2, 3]
+    assert recovered.network == cn.network
+    assert recovered._registry.get_node_id("carol") == 3
+
+    # alice already read her message before the crash, so it is not delivered again
+    assert recovered.persons["alice"].get_all_messages() == []
+
+    messages_to_bob = recovered.persons["bob"].get_all_messages()
+    assert [message.content for message in messages_to_bob] == ["before the snapshot"]
+
+    messages_to_carol = recovered.persons["carol"].get_all_messages()
+    assert len(messages_to_carol) == 1
+    assert messages_to_carol[0].content == "after the snapshot"
+    assert messages_to_carol[0].priority == Priority.MEDIUM
+
+
+def test_refused_messages_are_not_recovered(tmp_path):
+    snapshot_path = tmp_path / "network.snap"
+    journal_path = tmp_path / "network.wal"
+    cn: CommunicationNetwork[int] = CommunicationNetwork()
+    cn.add(Node(1))
+    cn.save(snapshot_path)
+    cn.attach_journal(Journal(journal_path, sync_interval=10))
+    alice = Person("alice", Key("this is a simple text to train create the key"))
+    bob = Person("bob", Key("this is another text. this is another text. bob"))
+    cn.join_network(alice, 1)
+    cn.join_network(bob, 1)
+
+    # one admitted, one rejected, then one admitted, one deferred and one over the deferred bound
+    cn.set_admission(max_depth=1)
+    alice.send_message_to("bob", "kept")
+    alice.send_message_to("bob", "rejected")
+    assert [message.content for message in bob.get_all_messages()] == ["kept"]
+    cn.set_admission(max_depth=1, defer=True, max_deferred=1)
+    alice.send_message_to("bob", "read later")
+    alice.send_message_to("bob", "deferred")
+    alice.send_message_to("bob", "over the bound")
+    assert cn.edge_counters["admission_rejected"] == 2
+    assert [message.content for message in bob.get_all_messages()] == ["read later"]
+    numbered = Message("alice", alice._key.encode("numbered"), Priority.LOW, "bob", sequence=alice.next_sequence())
+    cn.set_admission(None)
+    cn.send(numbered)
+    cn.detach_journal().close()
+
+    recovered = CommunicationNetwork.recover(snapshot_path, journal_path)
+    assert [message.content for message in recovered.persons["bob"].get_all_messages()] == ["deferred", "numbered"]
+    # the sequences are journaled: a retry after the recovery is still a duplicate
+    recovered.send(numbered)
+    assert recovered.persons["bob"].get_all_messages() == []
+
+
+def test_deliveries_to_several_persons_of_a_node_are_recovered(tmp_path):
+    snapshot_path = tmp_path / "network.snap"
+    journal_path = tmp_path / "network.wal"
+    cn: CommunicationNetwork[int] = CommunicationNetwork()
+    cn.add(Node(1))
+    cn.add(Node(2))
+    cn.link(cn.nodes[1], cn.nodes[2], 1)
+    cn.save(snapshot_path)
+    cn.attach_journal(Journal(journal_path, sync_interval=10))
+    key = Key("this is a simple text to train create the key")
+    persons = {}
+    for person_id, node_id in [("alice", 1), ("bob", 2), ("carol", 2), ("dave", 2)]:
+        persons[person_id] = Person(person_id, key)
+        cn.join_network(persons[person_id], node_id)
+
+    # two members of the group on node 2, then a broadcast admitted by dave only and released to bob on his read
+    cn.create_group("team", ["bob", "carol"])
+    persons["alice"].send_message_to_group("team", "to the team")
+    cn.set_admission(max_depth=1, defer=True)
+    persons["alice"].send_message_to_everyone("to everyone")
+    assert [message.content for message in persons["bob"].get_all_messages()] == ["to the team"]
+    live = {person_id: [key.decode(message.content) for message in cn.nodes[2].messages[person_id]]
+            for person_id in ("bob", "carol", "dave")}
+    assert live == {"bob": ["to everyone"], "carol": ["to the team"], "dave": ["to everyone"]}
+    cn.detach_journal().close()
+
+    recovered = CommunicationNetwork.recover(snapshot_path, journal_path)
+    assert {person_id: [key.decode(message.content) for message in recovered.nodes[2].messages[person_id]]
+            for person_id in ("bob", "carol", "dave")} == live
+
+
+def test_deferred_messages_of_a_moved_person_are_recovered(tmp_path):
+    snapshot_path = tmp_path / "network.snap"
+    journal_path = tmp_path / "network.wal"
+    cn: CommunicationNetwork[int] = CommunicationNetwork()
+    for node_id in (1, 2, 3):
+        cn.add(Node(node_id))
+    cn.link(cn.nodes[1], cn.nodes[2], 1)
+    cn.link(cn.nodes[2], cn.nodes[3], 1)
+    cn.save(snapshot_path)
+    cn.attach_journal(Journal(journal_path, sync_interval=10))
+    key = Key("this is a simple text to train create the key")
+    alice = Person("alice", key)
+    bob = Person("bob", key)
+    cn.join_network(alice, 1)
+    cn.join_network(bob, 1)
+
+    # deferred on node 1, still deferred on the full node 3, then admitted by node 2
+    cn.nodes[1].set_admission(max_depth=1, defer=True)
+    cn.nodes[3].set_admission(max_depth=1, defer=True)
+    for content in ("one", "two", "three"):
+        alice.send_message_to("bob", content)
+    cn.move_person(bob, 3)
+    assert [key.decode(message.content) for message in cn.nodes[3].messages["bob"]] == ["one"]
+    assert len(cn.nodes[3]._deferred["bob"]) == 2
+    cn.move_person(bob, 2)
+    assert [key.decode(message.content) for message in cn.nodes[2].messages["bob"]] == ["one", "two", "three"]
+    cn.detach_journal().close()
+
+    recovered = CommunicationNetwork.recover(snapshot_path, journal_path)
+    contents = [message.content for message in recovered.persons["bob"].get_all_messages()]
+    assert contents == ["one", "two", "three"]
+
+
+def test_torn_record_is_ignored(tmp_path):
+    journal_path = tmp_path / "network.wal"
+    journal = Journal(journal_path, sync_interval=0)
+    journal.append(LINK, 1, 2, 3)
+    journal.close()
+    with open(journal_path, "ab") as stream:
+        stream.write(b"\x40\x00\x00\x00\x01\x00\x00\x00\x03")
+
+    assert read_records(journal_path) == [(LINK, [1, 2, 3])]
+
+
+def test_group_commit_interval(tmp_path):
+    journal_path = tmp_path / "network.wal"
+    now = [0.0]
+    journal = Journal(journal_path, sync_interval=0.05, clock=lambda: now[0], background=False)
+    journal.append(LINK, 1, 2, 3)
+    now[0] = 0.04
+    assert not journal.flush_due() and read_records(journal_path) == []
+    journal.append(LINK, 2, 3, 4)
+    # the interval runs from the oldest pending record
+    now[0] = 0.05
+    assert journal.flush_due()
+    assert read_records(journal_path) == [(LINK, [1, 2, 3]), (LINK, [2, 3, 4])]
+    journal.append(LINK, 3, 4, 5)
+    journal.commit()
+    assert read_records(journal_path)[-1] == (LINK, [3, 4, 5])
+    journal.close()
+
+    # a quiet journal is still committed by the flusher thread, without another append
+    journal = Journal(journal_path, sync_interval=0.01)
+    journal.append(LINK, 4, 5, 6)
+    deadline = time.monotonic() + 5
+    while read_records(journal_path)[-1] != (LINK, [4, 5, 6]) and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert read_records(journal_path)[-1] == (LINK, [4, 5, 6])
+    journal.close()
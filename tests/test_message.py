@@ -1,29 +1,79 @@
-import pytest
-
-from network import Node, CommunicationNetwork, InvalidNetworkException
-from person import Person
-from messaging import Key, InvalidContentException
-from registry import Registry
-
-
-def test_message():
-    """
-    Create a valid network, then remove a node that makes it invalid, expect an InvalidNetworkException
-    :return:
-    """
-    key = Key("aaaaaaaaaaaaadsdsndks") # training text
-    
-    text = "i am here"
-    encoding = key.encode(text)
-    decoding = key.decode(encoding)
-
-    assert decoding == text
-
-    # checking the "." is used for most frequent
-    assert key.key[0] == "a"
-
-    with pytest.raises(InvalidContentException):
-        key.encode("asdklasA")
-
-    with pytest.raises(InvalidContentException):
-        key.decode("........")
+import pytest
+
+from app.network import Node, CommunicationNetwork, InvalidNetworkException
+from app.person import Person
+from app.messaging import Key, InvalidContentException, MORSE, HUFFMAN
+from app.registry import Registry
+
+
+def test_message():
+    """
+    Create a valid network, then remove a node that makes it invalid, expect an InvalidNetworkException
+    :return:
+    """
+    key = Key("aaaaaaaaaaaaadsdsndks") # training text
+    
+    text = "i am here"
+    encoding = key.encode(text)
+    decoding = key.decode(encoding)
+
+    assert decoding == text
+
+    # checking the "." is used for most frequent
+    assert key.key[0] == "a"
+
+    with pytest.raises(InvalidContentException):
+        key.encode("asdklasA")
+
+    with pytest.raises(InvalidContentException):
+        key.decode("........")
+
+
+def test_codecs():
+    training_text = "the quick brown fox jumps over the lazy dog 0123456789 " * 3 + "eeeeeee"
+    morse = Key(training_text)
+    huffman = Key(training_text, HUFFMAN)
+    text = "the lazy dog 42 meets xq7 and zz"
+    assert morse.decode(morse.encode(text)) == text
+    assert huffman.decode(huffman.encode(text)) == text
+    assert huffman.encode("") == bytes([0]) and huffman.decode(huffman.encode("")) == ""
+    # the 36 symbols have their own code, the least frequent one included
+    assert morse.decode(morse.encode(morse.key[-1])) == morse.key[-1]
+    # huffman packs bits into bytes
+    assert isinstance(huffman.encode(text), bytes)
+    assert len(huffman.encode(text)) < len(text) < len(morse.encode(text))
+
+    # the codec id travels with the serialized key
+    serialized = Key.serialize(huffman)
+    assert Key.codec_of(serialized)[0] == HUFFMAN
+    assert Key.codec_of(Key.serialize(morse))[0] == MORSE
+    rebuilt = Key.from_serialized(serialized)
+    assert rebuilt.key == huffman.key
+    assert rebuilt.decode(huffman.encode(text)) == text
+
+    # encoded two chars at a time from HuffmanCodec._SHORT chars on, odd lengths included
+    assert huffman.decode(huffman.encode(text + "e")) == text + "e"
+    assert huffman.decode(huffman.encode(text * 3 + "e")) == text * 3 + "e"
+    assert huffman.decode(huffman.encode(text * 50)) == text * 50
+    with pytest.raises(InvalidContentException):
+        huffman.encode("Upper case")
+    with pytest.raises(InvalidContentException):
+        huffman.encode(text * 3 + "Upper case")
+    with pytest.raises(InvalidContentException):
+        huffman.encode("caf\u00e9 \u4e00")
+    with pytest.raises(InvalidContentException):
+        huffman.decode(bytes([9, 1]))
+
+
+def test_persons_with_different_codecs():
+    cn: CommunicationNetwork[int] = CommunicationNetwork()
+    node_1 = Node(1)
+    cn.add(node_1)
+    alice = Person("alice", Key("this is a simple text to train create the key", HUFFMAN))
+    bob = Person("bob", Key("dave dave dave daaaaaaaaavvvvveeeee"))
+    cn.join_network(alice, node_1.node_id)
+    cn.join_network(bob, node_1.node_id)
+    alice.send_message_to("bob", "hi bob")
+    bob.send_message_to("alice", "hi alice")
+    assert [message.content for message in bob.get_all_messages()] == ["hi bob"]
+    assert [message.content for message in alice.get_all_messages()] == ["hi alice"]
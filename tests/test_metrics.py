@@ -0,0 +1,57 @@
+from app.network import Node, CommunicationNetwork
+from app.person import Person
+from app.messaging import Key
+from app.metrics import bucket_of, bucket_bounds
+
+
+def test_metrics_on_hot_paths():
+    cn: CommunicationNetwork[int] = CommunicationNetwork()
+    node_1 = Node(1)
+    node_2 = Node(2)
+    cn.add(node_1)
+    cn.add(node_2)
+    cn.link(node_1, node_2, 1)
+    alice = Person("alice", Key("this is a simple text to train create the key"))
+    cn.join_network(alice, node_1.node_id)
+
+    cn.enable_metrics()
+    # persons joining after enable_metrics are instrumented as well
+    bob = Person("bob", Key("this is another text. bob"))
+    cn.join_network(bob, node_2.node_id)
+
+    alice.send_message_to("bob", "hi bob")
+    alice.send_message_to("bob", "hi again")
+    bob.send_message_to_everyone("hello all")
+
+    snapshot = cn.metrics()
+    assert snapshot["calls"]["send"] == 2
+    assert snapshot["calls"]["broadcast"] == 1
+    assert snapshot["calls"]["key.encode"] == 3
+    assert snapshot["calls"]["node.receive"] == 4
+    assert snapshot["mailbox_depth"] == {1: 1, 2: 2}
+    assert snapshot["counters"][("link_forwards", (("source", 1), ("target", 2)))] == 2
+    assert snapshot["counters"][("link_forwards", (("source", 2), ("target", 1)))] == 1
+    assert snapshot["latency"]["send"]["p50"] <= snapshot["latency"]["send"]["max"] * 1.07
+
+    bob.get_all_messages()
+    snapshot = cn.metrics()
+    assert snapshot["calls"]["person.get_all_messages"] == 1
+    assert snapshot["calls"]["key.decode"] == 2
+    assert snapshot["mailbox_depth"][2] == 0
+
+    text = cn.metrics(format="prometheus")
+    assert 'communication_network_calls_total{op="send"} 2' in text
+    assert 'communication_network_mailbox_depth{node="1"} 1' in text
+
+    # once disabled the original methods are back
+    cn.disable_metrics()
+    assert "send" not in vars(cn)
+    assert "receive" not in vars(node_1)
+    assert not hasattr(Key.encode, "__wrapped__")
+
+
+def test_histogram_buckets():
+    for value in [0, 1, 31, 32, 33, 1000, 123456789]:
+        lowest, highest = bucket_bounds(bucket_of(value))
+        assert lowest <= value <= highest
+        assert highest - lowest <= max(1, value // 16)
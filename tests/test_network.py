@@ -1,8 +1,11 @@
+import time
+
 import pytest
 
-from network import Node, CommunicationNetwork, InvalidNetworkException
-from person import Person
-from messaging import Key, Priority, Message
+from app.network import Node, CommunicationNetwork, InvalidNetworkException
+from app.person import Person
+from app.messaging import Key, Priority, Message
+from app import routing
 
 def test_removing_not_fails_if_invalid():
     """
@@ -96,3 +99,407 @@ def test_removing_not_fails_if_invalid():
 
     
 test_removing_not_fails_if_invalid()
+
+
+def test_route_tracing_and_cost():
+    """
+    node_10 --1-- node_11 --2-- node_12, plus an expensive direct link node_10 --10-- node_12
+    Traced messages record the cheapest route and its cost
+    """
+    cn: CommunicationNetwork[int] = CommunicationNetwork()
+    node_10 = Node(10)
+    node_11 = Node(11)
+    node_12 = Node(12)
+    cn.add(node_10)
+    cn.add(node_11)
+    cn.add(node_12)
+    cn.link(node_10, node_11, 1)
+    cn.link(node_11, node_12, 2)
+    cn.link(node_10, node_12, 10)
+
+    alice = Person("alice", Key("this is a simple text to train create the key"))
+    bob = Person("bob", Key("dave dave dave daaaaaaaaavvvvveeeee"))
+    cn.join_network(alice, node_10.node_id)
+    cn.join_network(bob, node_12.node_id)
+
+    message = Message("alice", alice._key.encode("hi bob"), Priority.LOW, "bob", trace=True)
+    cn.send(message)
+    assert message.trace == [(10, 11, 12)]
+    assert message.cost == 3
+
+    broadcast = Message("alice", alice._key.encode("hi all"), Priority.LOW, None, trace=True)
+    cn.broadcast(broadcast)
+    assert broadcast.trace == [(10,), (10, 11), (10, 11, 12)]
+    assert broadcast.cost == 4
+
+    # without tracing nothing is recorded
+    untraced = Message("alice", alice._key.encode("hi"), Priority.LOW, "bob")
+    cn.send(untraced)
+    assert untraced.trace is None
+
+    # one message every two is traced
+    cn.set_trace_sampling(2)
+    messages = [Message("alice", alice._key.encode("hi"), Priority.LOW, "bob") for _ in range(4)]
+    for sampled in messages:
+        cn.send(sampled)
+    assert [sampled.trace is not None for sampled in messages] == [False, True, False, True]
+
+    assert [message.content for message in bob.get_all_messages()] == ["hi bob", "hi all", "hi", "hi", "hi", "hi",
+                                                                       "hi"]
+
+
+def test_batching_and_coalescing():
+    cn: CommunicationNetwork[int] = CommunicationNetwork()
+    node_1 = Node(1)
+    node_2 = Node(2)
+    node_3 = Node(3)
+    cn.add(node_1)
+    cn.add(node_2)
+    cn.add(node_3)
+    cn.link(node_1, node_2, 1)
+    cn.link(node_2, node_3, 1)
+
+    alice = Person("alice", Key("this is a simple text to train create the key"))
+    bob = Person("bob", Key("dave dave dave daaaaaaaaavvvvveeeee"))
+    cn.join_network(alice, node_1.node_id)
+    cn.join_network(bob, node_3.node_id)
+
+    # a batch is routed and forwarded once
+    forwarded = []
+    cn.forward = lambda message, node: forwarded.append(node.node_id)
+    alice.send_batch("bob", ["one", "two", "three"])
+    assert forwarded == [2, 3]
+    assert [message.content for message in bob.get_all_messages()] == ["one", "two", "three"]
+
+    # with coalescing the sends are held until a read, or until max_messages of them are waiting
+    forwarded.clear()
+    cn.enable_coalescing(window=60, max_messages=3)
+    alice.send_message_to("bob", "a")
+    alice.send_message_to("bob", "b")
+    assert forwarded == []
+    alice.send_message_to("bob", "c")
+    assert forwarded == [2, 3]
+    alice.send_message_to("bob", "d")
+    assert [message.content for message in bob.get_all_messages()] == ["a", "b", "c", "d"]
+
+    # a batch does not overtake the held sends
+    alice.send_message_to("bob", "first")
+    alice.send_batch("bob", ["second"])
+    assert [message.content for message in bob.get_all_messages()] == ["first", "second"]
+    cn.disable_coalescing()
+
+    # the window is enforced by a timer, without another call
+    cn.enable_coalescing(window=0.01, max_messages=3)
+    alice.send_message_to("bob", "alone")
+    deadline = time.monotonic() + 5
+    while not node_3.messages["bob"] and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert len(node_3.messages["bob"]) == 1
+    assert [message.content for message in bob.get_all_messages()] == ["alone"]
+    cn.disable_coalescing()
+
+    # removing a node delivers the messages held from or to it, a later broadcast finds nothing held for it
+    cn.remove(node_3)
+    node_3 = Node(3)
+    cn.add(node_3)
+    cn.link(node_1, node_3, 1)
+    carol = Person("carol", Key("carol carol carol"))
+    cn.join_network(carol, node_3.node_id)
+    cn.enable_coalescing(window=60, max_messages=3)
+    alice.send_message_to("carol", "to a removed node")
+    carol.send_message_to("alice", "from a removed node")
+    cn.remove(node_3)
+    assert cn._held == {}
+    alice.send_message_to_everyone("after the removal")
+    assert [message.content for message in alice.get_all_messages()] == ["from a removed node"]
+    cn.disable_coalescing()
+
+
+def test_multicast_group():
+    cn: CommunicationNetwork[int] = CommunicationNetwork()
+    nodes = [Node(node_id) for node_id in range(6)]
+    for node in nodes:
+        cn.add(node)
+    # a star around node 0 plus a chain 3 - 4 - 5
+    cn.link(nodes[0], nodes[1], 1)
+    cn.link(nodes[0], nodes[2], 1)
+    cn.link(nodes[0], nodes[3], 1)
+    cn.link(nodes[3], nodes[4], 1)
+    cn.link(nodes[4], nodes[5], 1)
+
+    key = Key("this is a simple text to train create the key")
+    persons = {}
+    for person_id, node_id in [("alice", 1), ("bob", 2), ("carol", 5), ("dave", 5), ("erin", 4)]:
+        persons[person_id] = Person(person_id, key)
+        cn.join_network(persons[person_id], node_id)
+    cn.create_group("team", ["alice", "bob", "carol", "dave"])
+
+    forwarded = []
+    cn.forward = lambda message, node: forwarded.append(node.node_id)
+    persons["alice"].send_message_to_group("team", "hello team")
+    # the sender node, then every edge of the tree 1-0-2, 0-3-4-5 once, even if carol and dave share node 5
+    assert sorted(forwarded) == [0, 1, 2, 3, 4, 5]
+    for person_id in ["bob", "carol", "dave"]:
+        assert [message.content for message in persons[person_id].get_all_messages()] == ["hello team"]
+    assert persons["alice"].get_all_messages() == []
+    assert persons["erin"].get_all_messages() == []
+
+    # the tree and the way in from every sending node are cached until the membership changes
+    tree = cn._multicast_trees["team"][2]
+    searches = []
+    original_shortest_paths = routing.shortest_paths
+    routing.shortest_paths = lambda graph, source: searches.append(source) or original_shortest_paths(graph, source)
+    try:
+        persons["bob"].send_message_to_group("team", "again")
+        persons["bob"].send_message_to_group("team", "and again")
+        persons["alice"].send_message_to_group("team", "once more")
+    finally:
+        routing.shortest_paths = original_shortest_paths
+    assert searches == [2]
+    assert cn._multicast_trees["team"][2] is tree
+    cn.leave_network(persons["dave"])
+    persons["bob"].send_message_to_group("team", "again")
+    assert cn._multicast_trees["team"][2] is not tree
+    assert cn._registry.get_group("team") == ["alice", "bob", "carol"]
+
+
+def test_message_expiry_and_limits():
+    cn: CommunicationNetwork[int] = CommunicationNetwork()
+    node_1 = Node(1)
+    node_2 = Node(2)
+    cn.add(node_1)
+    cn.add(node_2)
+    cn.link(node_1, node_2, 1)
+    key = Key("this is a simple text to train create the key")
+    alice = Person("alice", key)
+    bob = Person("bob", key)
+    carol = Person("carol", key)
+    cn.join_network(alice, node_1.node_id)
+    cn.join_network(bob, node_2.node_id)
+    cn.join_network(carol, node_2.node_id)
+
+    # expired messages are not read, and a sweep evicts them without reading
+    cn.send(Message("alice", key.encode("old"), Priority.LOW, "bob", deadline=time.time() - 1))
+    cn.send(Message("alice", key.encode("soon"), Priority.LOW, "bob", deadline=time.time() + 0.05))
+    alice.send_message_to_everyone("later", ttl=60)
+    assert len(node_2.messages["bob"]) == 2
+    assert cn.expire(time.time() + 61) == 3
+    assert node_2.messages["bob"] == [] and node_2.messages["carol"] == []
+    cn.send(Message("alice", key.encode("soon"), Priority.LOW, "bob", deadline=time.time() + 0.01))
+    alice.send_message_to("bob", "kept")
+    time.sleep(0.02)
+    assert [message.content for message in bob.get_all_messages()] == ["kept"]
+
+    # caps drop the lowest priority, oldest message first
+    cn.set_limits(max_messages=3, max_messages_per_person=2)
+    alice.send_message_to("bob", "low 1")
+    alice.send_very_urgent_message_to("bob", "high")
+    alice.send_message_to("bob", "low 2")
+    assert [key.decode(message.content) for message in node_2.messages["bob"]] == ["high", "low 2"]
+    alice.send_urgent_message_to("carol", "medium")
+    alice.send_urgent_message_to("carol", "medium 2")
+    assert sum(len(mailbox) for mailbox in node_2.messages.values()) == 3
+    assert [message.content for message in bob.get_all_messages()] == ["high"]
+    assert [message.content for message in carol.get_all_messages()] == ["medium", "medium 2"]
+
+    # read messages do not stay behind in the arrival and expiry queues
+    cn.set_limits(max_messages=1000, max_messages_per_person=1000)
+    for round_number in range(20):
+        for index in range(50):
+            alice.send_message_to("bob", "read %d" % index, ttl=60)
+        bob.get_all_messages()
+    assert sum(map(len, node_2._arrivals.values())) <= 2 * 64 + 50
+    assert len(node_2._expiry) <= 2 * 64 + 50
+
+
+def test_move_person_keeps_the_mailbox(tmp_path):
+    from app.journal import Journal
+
+    cn: CommunicationNetwork[int] = CommunicationNetwork()
+    cn.attach_journal(Journal(tmp_path / "network.wal"))
+    nodes = [Node(node_id) for node_id in range(3)]
+    for node in nodes:
+        cn.add(node)
+    cn.link(nodes[0], nodes[1], 1)
+    cn.link(nodes[1], nodes[2], 1)
+    key = Key("this is a simple text to train create the key")
+    alice = Person("alice", key)
+    bob = Person("bob", key)
+    cn.join_network(alice, 0)
+    cn.join_network(bob, 1)
+    alice.send_message_to("bob", "first")
+    alice.send_urgent_message_to("bob", "second")
+    mailbox = nodes[1].messages["bob"]
+
+    cn.move_person(bob, 2)
+    assert cn._registry.get_node_id("bob") == 2
+    assert list(cn._registry.database[1]) == [] and list(cn._registry.database[2]) == ["bob"]
+    # the same list, nothing copied
+    assert nodes[2].messages["bob"] is mailbox and "bob" not in nodes[1].messages
+    alice.send_message_to("bob", "third")
+    with pytest.raises(InvalidNetworkException):
+        cn.move_person(bob, 7)
+    cn.detach_journal().close()
+
+    recovered = CommunicationNetwork.recover(None, tmp_path / "network.wal")
+    assert recovered._registry.get_node_id("bob") == 2
+    assert [message.content for message in bob.get_all_messages()] == ["second", "first", "third"]
+    assert [message.content for message in recovered.persons["bob"].get_all_messages()] == ["second", "first",
+                                                                                            "third"]
+
+    # the old gateway is gone with its messages, the person is attached again with an empty mailbox
+    cn.link(nodes[0], nodes[2], 1)
+    alice.send_message_to("bob", "lost")
+    cn.remove(nodes[2])
+    cn.move_person(bob, 0)
+    assert cn._registry.get_node_id("bob") == 0
+    assert bob.get_all_messages() == []
+    alice.send_message_to("bob", "after the move")
+    assert [message.content for message in bob.get_all_messages()] == ["after the move"]
+
+
+def test_rate_limits_and_admission():
+    from app.ratelimit import RateLimitException
+
+    cn: CommunicationNetwork[int] = CommunicationNetwork()
+    node_1 = Node(1)
+    node_2 = Node(2)
+    cn.add(node_1)
+    cn.add(node_2)
+    cn.link(node_1, node_2, 1)
+    key = Key("this is a simple text to train create the key")
+    alice = Person("alice", key)
+    bob = Person("bob", key)
+    cn.join_network(alice, node_1.node_id)
+    cn.join_network(bob, node_2.node_id)
+
+    now = [0.0]
+    cn.set_rate_limit(2, burst=3, clock=lambda: now[0])
+    cn.set_rate_limit(None, priority=Priority.HIGH)
+    routed = []
+    cn.get_shortest_path = lambda message, receiver: routed.append(message) or [receiver]
+    for _ in range(3):
+        alice.send_message_to("bob", "hi")
+    with pytest.raises(RateLimitException):
+        alice.send_message_to("bob", "one too many")
+    with pytest.raises(RateLimitException):
+        alice.send_message_to_everyone("hello")
+    # refused before any routing, high priority is not limited, tokens come back with time
+    assert len(routed) == 3
+    alice.send_very_urgent_message_to("bob", "urgent")
+    now[0] += 0.5
+    alice.send_message_to("bob", "again")
+    assert cn.edge_counters["rate_limited"] == 2
+    assert len(bob.get_all_messages()) == 5
+    # a batch over the limit takes no tokens, the smaller one after it still fits
+    now[0] += 1
+    with pytest.raises(RateLimitException):
+        alice.send_batch("bob", ["one", "two", "three"])
+    alice.send_batch("bob", ["one", "two"])
+    assert [message.content for message in bob.get_all_messages()] == ["one", "two"]
+    assert cn.edge_counters["rate_limited"] == 3
+    cn.set_rate_limit(None)
+
+    # a full mailbox rejects, or defers until it is read
+    cn.set_admission(max_depth=2)
+    for index in range(3):
+        alice.send_message_to("bob", "rejected " + str(index))
+    assert cn.edge_counters["admission_rejected"] == 1
+    assert [message.content for message in bob.get_all_messages()] == ["rejected 0", "rejected 1"]
+    cn.set_admission(max_depth=2, defer=True)
+    for index in range(5):
+        alice.send_message_to("bob", str(index))
+    assert cn.edge_counters["admission_deferred"] == 3
+    assert [message.content for message in bob.get_all_messages()] == ["0", "1"]
+    assert [message.content for message in bob.get_all_messages()] == ["2", "3"]
+    cn.set_admission(None)
+    assert [message.content for message in bob.get_all_messages()] == ["4"]
+
+
+def test_retried_sends_are_delivered_once():
+    from app.network import DUPLICATE_WINDOW
+
+    node = Node(1)
+    assert [node.is_duplicate("alice", sequence) for sequence in (5, 7, 6, 7, 5, 4)] == \
+        [False, False, False, True, True, False]
+    assert not node.is_duplicate("alice", 7 + DUPLICATE_WINDOW)
+    # out of the window: cannot be told apart from a replay
+    assert node.is_duplicate("alice", 7)
+    assert not node.is_duplicate("bob", 7)
+    assert len(node._windows) == 2
+
+    cn: CommunicationNetwork[int] = CommunicationNetwork()
+    node_1 = Node(1)
+    node_2 = Node(2)
+    cn.add(node_1)
+    cn.add(node_2)
+    cn.link(node_1, node_2, 1)
+    key = Key("this is a simple text to train create the key")
+    alice = Person("alice", key)
+    bob = Person("bob", key)
+    cn.join_network(alice, node_1.node_id)
+    cn.join_network(bob, node_2.node_id)
+
+    message = Message("alice", key.encode("once"), Priority.LOW, "bob", sequence=alice.next_sequence())
+    cn.send(message)
+    cn.send(message)
+    broadcast = Message("alice", key.encode("all"), Priority.LOW, None, sequence=alice.next_sequence())
+    cn.broadcast(broadcast)
+    cn.broadcast(broadcast)
+    cn.send_batch([message, Message("alice", key.encode("new"), Priority.LOW, "bob", sequence=alice.next_sequence())])
+    assert message.message_id == ("alice", message.sequence)
+    assert [message.content for message in bob.get_all_messages()] == ["once", "all", "new"]
+    # the broadcast retry is dropped by both nodes
+    assert cn.edge_counters["duplicates_suppressed"] == 4
+
+    # joining again with the same id does not make the new messages look like retries
+    cn.leave_network(alice)
+    alice = Person("alice", key)
+    cn.join_network(alice, node_1.node_id)
+    alice.send_message_to("bob", "back")
+    assert [message.content for message in bob.get_all_messages()] == ["back"]
+
+    # a message refused by admission control is not seen yet: its retry is delivered once there is room
+    cn.set_admission(max_depth=1)
+    alice.send_message_to("bob", "first")
+    refused = Message("alice", key.encode("retry"), Priority.LOW, "bob", sequence=alice.next_sequence())
+    cn.send(refused)
+    assert [message.content for message in bob.get_all_messages()] == ["first"]
+    cn.send(refused)
+    cn.send(refused)
+    cn.set_admission(None)
+    assert [message.content for message in bob.get_all_messages()] == ["retry"]
+
+
+def test_drain_all_reads_every_mailbox_of_the_node():
+    def build():
+        cn: CommunicationNetwork[int] = CommunicationNetwork()
+        node_1 = Node(1)
+        node_2 = Node(2)
+        cn.add(node_1)
+        cn.add(node_2)
+        cn.link(node_1, node_2, 1)
+        persons = {}
+        for name, node_id in [("alice", 2), ("bob", 1), ("carol", 1), ("dave", 1)]:
+            persons[name] = Person(name, Key("this is a simple text to train create the key " + name))
+            cn.join_network(persons[name], node_id)
+        persons["alice"].send_message_to("bob", "first")
+        persons["alice"].send_very_urgent_message_to("bob", "second")
+        persons["carol"].send_urgent_message_to("bob", "third")
+        persons["alice"].send_message_to_everyone("hello all")
+        persons["bob"].send_message_to("carol", "hi carol")
+        return cn, node_1
+
+    expected = {"bob": ["second", "third", "first", "hello all"], "carol": ["hello all", "hi carol"],
+                "dave": ["hello all"]}
+    cn, node = build()
+    drained = node.drain_all()
+    assert {person_id: [message.content for message in messages] for person_id, messages in drained.items()} == \
+        expected
+    # the broadcast is decoded once for the whole node
+    assert drained["bob"][3] is drained["carol"][0] is drained["dave"][0]
+    assert node.drain_all() == {"bob": [], "carol": [], "dave": []}
+    assert cn.persons["bob"].get_all_messages() == []
+
+    with pytest.raises(InvalidNetworkException):
+        Node(3).drain_all()
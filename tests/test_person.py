@@ -1,52 +1,148 @@
-import pytest
-
-from network import Node, CommunicationNetwork, InvalidNetworkException
-from person import Person
-from messaging import Key, Priority
-
-def test_person():
-    cn: CommunicationNetwork[int] = CommunicationNetwork()
-    node_1 = Node(1)
-    cn.add(node_1)
-    node_2 = Node(2)
-    cn.add(node_2)
-    cn.link(node_1, node_2, 1)
-
-    # Create the users with their Keys
-    alice = Person("alice", Key("this is a simple text to train create the key"))
-    dave = Person("dave", Key("dave dave dave daaaaaaaaavvvvveeeee"))
-
-    # Register the users inside the CommunicationNetwork at nodes node_1 and node_2
-    cn.join_network(alice, node_1.node_id)
-    cn.join_network(dave, node_2.node_id)
-
-    # Some messaging around = Note, it does it matter that one respond before getting the messages ;)
-    alice.send_message_to_everyone("tonight party rsvp me")
-    dave.send_message_to("alice", "count me")
-
-    # Read Messages
-    messages_to_alice = alice.get_all_messages()
-
-    # Re-send the message privately
-    dave.send_message_to("alice", "sorry cannot make it")
-    # Read More Messages
-    more_messages_to_alice = alice.get_all_messages()
-
-    # Assertions
-    assert len(messages_to_alice) == 1
-    # The first message is the one sent by carol to everybody since it has higher priority
-    assert messages_to_alice[0].sender == "dave"
-    assert messages_to_alice[0].content == "count me"
-    assert messages_to_alice[0].priority == Priority.LOW
-    assert messages_to_alice[0].receiver == "alice"
-
-    dave.send_urgent_message_to("alice", "hey wattsapp")
-    dave.send_very_urgent_message_to("alice", "hey wattsapp")
-    dave.send_message_to("alice", "asd askdnkajsd")
-    dave.send_message_to_everyone("asfnsdk")
-
-    dave.send_very_urgent_message_to_everyone("sdadas")
-    dave.send_urgent_message_to_everyone("dsaasdas")
-    
-    alice_messages = alice.get_all_messages()
-test_person()
\ No newline at end of file
+import asyncio
+
+import pytest
+
+from app.network import Node, CommunicationNetwork, InvalidNetworkException
+from app.person import Person
+from app.messaging import Key, Priority
+
+def test_person():
+    cn: CommunicationNetwork[int] = CommunicationNetwork()
+    node_1 = Node(1)
+    cn.add(node_1)
+    node_2 = Node(2)
+    cn.add(node_2)
+    cn.link(node_1, node_2, 1)
+
+    # Create the users with their Keys
+    alice = Person("alice", Key("this is a simple text to train create the key"))
+    dave = Person("dave", Key("dave dave dave daaaaaaaaavvvvveeeee"))
+
+    # Register the users inside the CommunicationNetwork at nodes node_1 and node_2
+    cn.join_network(alice, node_1.node_id)
+    cn.join_network(dave, node_2.node_id)
+
+    # Some messaging around = Note, it does it matter that one respond before getting the messages ;)
+    alice.send_message_to_everyone("tonight party rsvp me")
+    dave.send_message_to("alice", "count me")
+
+    # Read Messages
+    messages_to_alice = alice.get_all_messages()
+
+    # Re-send the message privately
+    dave.send_message_to("alice", "sorry cannot make it")
+    # Read More Messages
+    more_messages_to_alice = alice.get_all_messages()
+
+    # Assertions
+    assert len(messages_to_alice) == 1
+    # The first message is the one sent by carol to everybody since it has higher priority
+    assert messages_to_alice[0].sender == "dave"
+    assert messages_to_alice[0].content == "count me"
+    assert messages_to_alice[0].priority == Priority.LOW
+    assert messages_to_alice[0].receiver == "alice"
+
+    dave.send_urgent_message_to("alice", "hey wattsapp")
+    dave.send_very_urgent_message_to("alice", "hey wattsapp")
+    dave.send_message_to("alice", "asd askdnkajsd")
+    dave.send_message_to_everyone("asfnsdk")
+
+    dave.send_very_urgent_message_to_everyone("sdadas")
+    dave.send_urgent_message_to_everyone("dsaasdas")
+    
+    alice_messages = alice.get_all_messages()
+test_person()
+
+def test_subscribe_instead_of_polling():
+    cn: CommunicationNetwork[int] = CommunicationNetwork()
+    node_1 = Node(1)
+    node_2 = Node(2)
+    cn.add(node_1)
+    cn.add(node_2)
+    cn.link(node_1, node_2, 1)
+    alice = Person("alice", Key("this is a simple text to train create the key"))
+    dave = Person("dave", Key("dave dave dave daaaaaaaaavvvvveeeee"))
+    cn.join_network(alice, node_1.node_id)
+    cn.join_network(dave, node_2.node_id)
+
+    # without an event loop the callback runs as soon as the message lands
+    received = []
+    subscription = alice.subscribe(lambda person: received.extend(person.get_all_messages()))
+    dave.send_message_to("alice", "count me")
+    dave.send_message_to_everyone("party")
+    assert [message.content for message in received] == ["count me", "party"]
+
+    subscription.cancel()
+    dave.send_message_to("alice", "not notified")
+    assert len(received) == 2
+
+    async def listen():
+        wakeups = []
+        alice.subscribe(lambda person: wakeups.append(len(cn.nodes[1].messages["alice"])))
+        stream = alice.messages()
+        first = await stream.__anext__()
+        # a burst of messages wakes the subscribers once
+        for index in range(3):
+            dave.send_message_to("alice", "burst " + str(index))
+        contents = []
+        for _ in range(3):
+            contents.append((await asyncio.wait_for(stream.__anext__(), 1)).content)
+        await stream.aclose()
+        return first.content, contents, wakeups
+
+    first, contents, wakeups = asyncio.run(listen())
+    assert first == "not notified"
+    assert contents == ["burst 0", "burst 1", "burst 2"]
+    assert wakeups == [3]
+
+    # the loop of that subscriber is closed now: it is dropped instead of failing the sender
+    dave.send_message_to("alice", "after the loop")
+    assert alice._subscriptions == []
+
+    # a failing callback does not stop the delivery to the other receivers
+    bob = Person("bob", Key("bob bob bob"))
+    cn.join_network(bob, node_1.node_id)
+    failing = alice.subscribe(lambda person: 1 / 0)
+    heard = []
+    bob.subscribe(lambda person: heard.append(person.get_person_id()))
+    dave.send_message_to_everyone("everyone")
+    assert failing.errors == 1 and isinstance(failing.last_error, ZeroDivisionError)
+    assert heard == ["bob"] and cn.edge_counters["callback_errors"] == 1
+    assert [message.content for message in bob.get_all_messages()] == ["everyone"]
+
+    # notified once the delivery is journaled, and once for a whole batch
+    alice.get_all_messages()
+    journaled = []
+    cn.journal = type("Journal", (), {"append": lambda self, *record: journaled.append(record)})()
+    failing.cancel()
+    calls = []
+    alice.subscribe(lambda person: calls.append((len(journaled), len(person.get_all_messages()))))
+    dave.send_batch("alice", ["one", "two", "three"])
+    assert calls == [(3, 3)]
+    cn.journal = None
+
+
+def test_broadcast_decoded_once():
+    cn: CommunicationNetwork[int] = CommunicationNetwork()
+    node_1 = Node(1)
+    cn.add(node_1)
+    alice = Person("alice", Key("this is a simple text to train create the key"))
+    cn.join_network(alice, node_1.node_id)
+    readers = [Person("reader" + str(index), Key("dave dave dave daaaaaaaaavvvvveeeee")) for index in range(3)]
+    for reader in readers:
+        cn.join_network(reader, node_1.node_id)
+
+    decoded = []
+    original_decode = Key.decode
+    Key.decode = lambda key, content: decoded.append(content) or original_decode(key, content)
+    try:
+        alice.send_message_to_everyone("hello all")
+        views = [reader.get_all_messages()[0] for reader in readers]
+    finally:
+        Key.decode = original_decode
+    assert len(decoded) == 1
+    assert all(view is views[0] for view in views)
+    assert views[0].content == "hello all"
+    # the view is shared, so it cannot be changed by one of the readers
+    with pytest.raises(AttributeError):
+        views[0].content = "changed"
@@ -0,0 +1,44 @@
+from app.network import Node, CommunicationNetwork
+from app.person import Person
+from app.messaging import Key
+
+
+def test_profile_attributes_operations(tmp_path):
+    cn: CommunicationNetwork[int] = CommunicationNetwork()
+    node_1 = Node(1)
+    node_2 = Node(2)
+    cn.add(node_1)
+    cn.add(node_2)
+    cn.link(node_1, node_2, 1)
+    alice = Person("alice", Key("this is a simple text to train create the key"))
+    cn.join_network(alice, node_1.node_id)
+
+    with cn.profile(tmp_path) as profiler:
+        # persons joining while profiling have their reads profiled as well
+        bob = Person("bob", Key("this is another text. bob"))
+        cn.join_network(bob, node_2.node_id)
+        carol = Person("carol", Key("carol carol carol"))
+        cn.join_network_many([(carol, node_2.node_id, carol.get_serialized_key())])
+        alice.send_message_to("bob", "hi bob")
+        alice.send_message_to("bob", "hi again")
+        bob.send_message_to_everyone("hello all")
+        assert len(bob.get_all_messages()) == 2
+        assert len(alice.get_all_messages()) == 1
+        assert len(carol.get_all_messages()) == 1
+        cn.unlink(node_1, node_2)
+        cn.leave_network(bob)
+
+    calls = {operation: totals["calls"] for operation, totals in profiler.operations.items()}
+    assert calls == {"send": 2, "broadcast": 1, "multicast": 0, "join": 2, "leave": 1, "link": 1, "read": 3}
+    assert profiler.operations["send"]["allocated"] != 0 and profiler.snapshot is not None
+    assert profiler.stats("multicast") is None
+
+    for name in ["report.txt", "stacks.collapsed", "send.pstats", "read.pstats"]:
+        assert (tmp_path / name).exists()
+    assert not (tmp_path / "multicast.pstats").exists()
+    stacks = (tmp_path / "stacks.collapsed").read_text().split()
+    assert any(line.startswith("send;") for line in stacks)
+    assert "broadcast" in profiler.report()
+
+    # the original methods are back
+    assert "send" not in vars(cn) and "get_all_messages" not in vars(alice)
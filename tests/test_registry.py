@@ -1,38 +1,60 @@
-import pytest
-
-from network import Node, CommunicationNetwork, InvalidNetworkException
-from person import Person
-from messaging import Key
-from registry import Registry, RegistryException
-
-
-def test_registry():
-    """
-    Create a valid network, then remove a node that makes it invalid, expect an InvalidNetworkException
-    :return:
-    """
-    reg = Registry()
-    
-    alice = Person("alice", Key("this is a simple text to train create the key"))
-    bob = Person(
-        "bob",
-        Key("this is another text. this is another text. this is another text. bob"),
-    )
-
-    reg.insert(bob._id, 1, "saldmsla")
-
-    assert reg.is_connected(bob._id)
-
-    reg.delete(bob._id)
-
-    assert reg.is_connected(bob._id) == False
-
-    assert reg.get_serialized_key(alice._id) is None
-
-    assert reg.get_node_id(alice._key) is None
-    
-    reg.insert(bob._id, 1, "saldmsla")
-    
-    with pytest.raises(RegistryException):
-        reg.insert(bob._id, 1, "saldmsla")
-
+import pytest
+
+from app.network import Node, CommunicationNetwork, InvalidNetworkException
+from app.person import Person
+from app.messaging import Key
+from app.registry import Registry, RegistryException
+
+
+def test_registry():
+    """
+    Create a valid network, then remove a node that makes it invalid, expect an InvalidNetworkException
+    :return:
+    """
+    reg = Registry()
+    
+    alice = Person("alice", Key("this is a simple text to train create the key"))
+    bob = Person(
+        "bob",
+        Key("this is another text. this is another text. this is another text. bob"),
+    )
+
+    reg.insert(bob._id, 1, "saldmsla")
+
+    assert reg.is_connected(bob._id)
+
+    reg.delete(bob._id)
+
+    assert reg.is_connected(bob._id) == False
+
+    assert reg.get_serialized_key(alice._id) is None
+
+    assert reg.get_node_id(alice._key) is None
+    
+    reg.insert(bob._id, 1, "saldmsla")
+    
+    with pytest.raises(RegistryException):
+        reg.insert(bob._id, 1, "saldmsla")
+
+
+
+def test_registry_shares_keys():
+    reg = Registry()
+    key = Key("this is a simple text to train create the key")
+    serialized_key = Key.serialize(key)
+    reg.insert("alice", 1, serialized_key)
+    reg.insert("bob", 2, serialized_key)
+    reg.insert("carol", 2, Key.serialize(Key("dave dave dave daaaaaaaaavvvvveeeee")))
+
+    # one record for the two persons with the same key, and one decoded Key
+    assert reg.get_key_id("alice") == reg.get_key_id("bob") != reg.get_key_id("carol")
+    assert len(reg.keys) == 2
+    assert reg.get_key("alice") is reg.get_key("bob")
+    assert reg.get_serialized_key("bob") == serialized_key
+
+    # the record goes away with its last user
+    reg.delete("alice")
+    assert reg.get_serialized_key("bob") == serialized_key
+    reg.delete("bob")
+    assert len(reg.keys) == 1
+    assert reg.get_key("bob") is None
@@ -0,0 +1,232 @@
+import random
+
+import pytest
+
+from app import routing
+from app.messaging import Key
+from app.network import CommunicationNetwork, Node
+from app.person import Person
+from app.routing import (shortest_paths, shortest_path, bidirectional_shortest_path, ContractionHierarchy,
+                         shortest_path_dag, pick_path, k_shortest_paths, ForwardingTables,
+                         RoutingException)
+
+
+def grid(side):
+    generator = random.Random(7)
+    graph = {node_id: [] for node_id in range(side * side)}
+    for node_id in range(side * side):
+        neighbors = [node_id + 1] if (node_id + 1) % side else []
+        if node_id + side < side * side:
+            neighbors.append(node_id + side)
+        for neighbor in neighbors:
+            cost = generator.randint(1, 10)
+            graph[node_id].append((neighbor, cost))
+            graph[neighbor].append((node_id, cost))
+    return graph
+
+
+class CountingGraph(dict):
+    """
+    Counts the nodes whose links were looked at
+    """
+
+    def __init__(self, graph):
+        super().__init__(graph)
+        self.touched = set()
+
+    def __getitem__(self, node_id):
+        self.touched.add(node_id)
+        return super().__getitem__(node_id)
+
+
+def path_cost(graph, path):
+    return sum(min(cost for neighbor, cost in graph[a] if neighbor == b) for a, b in zip(path, path[1:]))
+
+
+def test_point_to_point_matches_full_search():
+    graph = grid(20)
+    generator = random.Random(1)
+    for _ in range(50):
+        source, target = generator.randrange(400), generator.randrange(400)
+        distances, _ = shortest_paths(graph, source)
+        for search in (shortest_path, bidirectional_shortest_path):
+            cost, path = search(graph, source, target)
+            assert cost == distances[target]
+            assert path[0] == source and path[-1] == target
+            assert path_cost(graph, path) == cost
+
+
+def test_local_queries_touch_a_small_part_of_the_graph():
+    graph = CountingGraph(grid(100))
+    cost, path = bidirectional_shortest_path(graph, 5050, 5052)
+    assert len(graph.touched) < 10000 // 20
+
+    disconnected = {1: [(2, 1)], 2: [(1, 1)], 3: []}
+    with pytest.raises(RoutingException):
+        bidirectional_shortest_path(disconnected, 1, 3)
+    with pytest.raises(RoutingException):
+        shortest_path(disconnected, 1, 3)
+
+
+def test_contraction_hierarchy_matches_full_search():
+    graph = grid(20)
+    hierarchy = ContractionHierarchy(graph)
+    generator = random.Random(3)
+    for _ in range(100):
+        source, target = generator.randrange(400), generator.randrange(400)
+        distances, _ = shortest_paths(graph, source)
+        cost, path = hierarchy.query(source, target)
+        assert cost == distances[target]
+        assert path[0] == source and path[-1] == target
+        assert path_cost(graph, path) == cost
+
+    hierarchy = ContractionHierarchy({1: [(2, 1)], 2: [(1, 1)], 3: []})
+    with pytest.raises(RoutingException):
+        hierarchy.query(1, 3)
+
+
+def test_routing_index_goes_stale_on_topology_changes():
+    network = CommunicationNetwork()
+    nodes = [Node(node_id) for node_id in range(4)]
+    for node in nodes:
+        network.add(node)
+    network.link(nodes[0], nodes[1], 1)
+    network.link(nodes[1], nodes[2], 1)
+    network.link(nodes[0], nodes[3], 5)
+    network.link(nodes[3], nodes[2], 5)
+    assert not network.routing_index_is_fresh()
+    network.build_routing_index()
+    assert network.routing_index_is_fresh()
+    assert network.route(0, 2) == [1, 2]
+
+    # the index still knows the old link, the plain search is used until it is rebuilt
+    network.unlink(nodes[1], nodes[2])
+    assert not network.routing_index_is_fresh()
+    assert network.route(0, 2) == [3, 2]
+    network.build_routing_index()
+    assert network.route(0, 2) == [3, 2]
+
+
+def test_equal_cost_dag_and_k_shortest_paths():
+    # 3x3 grid with unit costs: 6 cheapest paths between opposite corners
+    graph = {node_id: [] for node_id in range(9)}
+    for node_id in range(9):
+        for neighbor in ([node_id + 1] if node_id % 3 != 2 else []) + ([node_id + 3] if node_id < 6 else []):
+            graph[node_id].append((neighbor, 1))
+            graph[neighbor].append((node_id, 1))
+    distances, predecessors = shortest_path_dag(graph, 0)
+    paths = {tuple(pick_path(predecessors, 8, key)) for key in range(100)}
+    assert len(paths) == 6
+    assert all(path_cost(graph, path) == distances[8] == 4 for path in paths)
+
+    found = k_shortest_paths(graph, 0, 8, 8)
+    assert [cost for cost, _ in found] == [4] * 6 + [6, 6]
+    assert len({tuple(path) for _, path in found}) == 8
+    assert all(path_cost(graph, path) == cost and len(set(path)) == len(path) for cost, path in found)
+    assert len(k_shortest_paths({1: [(2, 1)], 2: [(1, 1)]}, 1, 2, 3)) == 1
+
+
+def test_multipath_spreads_the_link_load():
+    # two equal cost paths 0-1-3 and 0-2-3, and a longer one 0-4-3
+    network = CommunicationNetwork()
+    nodes = [Node(node_id) for node_id in range(5)]
+    for node in nodes:
+        network.add(node)
+    for a, b, cost in ((0, 1, 1), (1, 3, 1), (0, 2, 1), (2, 3, 1), (0, 4, 2), (4, 3, 2)):
+        network.link(nodes[a], nodes[b], cost)
+    alice = Person("alice", Key("a text to train the key of alice"))
+    bob = Person("bob", Key("a text to train the key of bob"))
+    network.join_network(alice, 0)
+    network.join_network(bob, 3)
+
+    def first_hops():
+        network.enable_metrics()
+        for _ in range(200):
+            alice.send_message_to("bob", "hi")
+        counters = network.metrics()["counters"]
+        network.disable_metrics()
+        return {hop: counters.get(("link_forwards", (("source", 0), ("target", hop))), 0) for hop in (1, 2, 4)}
+
+    assert sorted(first_hops().values()) == [0, 0, 200]
+    network.set_multipath(routing.ECMP)
+    hops = first_hops()
+    assert hops[4] == 0 and hops[1] > 50 and hops[2] > 50
+    network.set_multipath(routing.K_SHORTEST, k=3)
+    hops = first_hops()
+    assert all(count > 30 for count in hops.values())
+    assert len(bob.get_all_messages()) == 600
+
+
+def test_forwarding_tables_route_around_failures():
+    graph = grid(10)
+    tables = ForwardingTables(graph)
+    generator = random.Random(5)
+    for _ in range(50):
+        source, target = generator.randrange(100), generator.randrange(100)
+        path = tables.path(source, target)
+        assert path_cost(graph, path) == tables.distance(source, target)
+
+    # computed per destination when first routed to, and kept by the next tables unless a change affects it
+    assert len(tables._trees) <= 50
+    detour = {node_id: list(links) for node_id, links in graph.items()}
+    detour[0].append((99, 1000))
+    detour[99].append((0, 1000))
+    tables = ForwardingTables(detour)
+    for target in range(100):
+        tables.path(0, target)
+    assert len(ForwardingTables(graph, tables)._trees) == 100
+    shortcut = {node_id: list(links) for node_id, links in graph.items()}
+    shortcut[0].append((99, 1))
+    shortcut[99].append((0, 1))
+    updated = ForwardingTables(shortcut, tables)
+    assert len(updated._trees) < 100
+    fresh = ForwardingTables(shortcut)
+    for _ in range(50):
+        source, target = generator.randrange(100), generator.randrange(100)
+        assert path_cost(shortcut, updated.path(source, target)) == fresh.distance(source, target)
+
+    # ring 0-1-2-3-4-0: the primary from 0 to 2 goes through 1, the alternate through 4
+    ring = {node_id: [] for node_id in range(5)}
+    for node_id in range(5):
+        ring[node_id].append(((node_id + 1) % 5, 1))
+        ring[(node_id + 1) % 5].append((node_id, 1))
+    tables = ForwardingTables(ring)
+    assert tables.path(0, 2) == [0, 1, 2]
+    assert tables.path(0, 2, failed_nodes={1}) == [0, 4, 3, 2]
+    assert tables.path(0, 2, failed_links={(0, 1), (1, 0)}) == [0, 4, 3, 2]
+    # no loop-free alternate from 1 towards 2 in a ring this size: the caller has to search
+    with pytest.raises(RoutingException):
+        tables.path(0, 2, failed_links={(1, 2), (2, 1)})
+    with pytest.raises(RoutingException):
+        tables.path(0, 2, failed_nodes={1, 3})
+
+
+def test_fast_reroute_keeps_delivering_through_churn():
+    network = CommunicationNetwork()
+    nodes = [Node(node_id) for node_id in range(6)]
+    for node in nodes:
+        network.add(node)
+    for node_id in range(6):
+        network.link(nodes[node_id], nodes[(node_id + 1) % 6], 1)
+    network.link(nodes[0], nodes[3], 10)
+    alice = Person("alice", Key("a text to train the key of alice"))
+    bob = Person("bob", Key("a text to train the key of bob"))
+    network.join_network(alice, 0)
+    network.join_network(bob, 2)
+    network.enable_fast_reroute()
+    assert network.route(0, 2) == [1, 2]
+
+    network.forward = lambda message, node: hops.append(node.node_id)
+    hops = []
+    network.unlink(nodes[1], nodes[2])
+    alice.send_message_to("bob", "hi")
+    assert hops == [5, 4, 3, 2]
+    assert network.wait_for_routing_tables(timeout=5)
+    assert network.route(0, 2) == [5, 4, 3, 2]
+
+    network.remove(nodes[4])
+    assert 4 not in network.route(0, 2)
+    assert network.wait_for_routing_tables(timeout=5)
+    assert network.route(0, 2) == [3, 2]
+    assert [message.content for message in bob.get_all_messages()] == ["hi"]
+    network.disable_fast_reroute()
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from app.network import Node, CommunicationNetwork
+from app.person import Person
+from app.messaging import Key, Priority
+from app.server import NetworkServer, NetworkClient, ServerException
+
+
+def test_server_and_client_on_localhost():
+    cn: CommunicationNetwork[int] = CommunicationNetwork()
+    node_1 = Node(1)
+    node_2 = Node(2)
+    cn.add(node_1)
+    cn.add(node_2)
+    cn.link(node_1, node_2, 1)
+
+    alice = Person("alice", Key("this is a simple text to train create the key"))
+    bob = Person("bob", Key("dave dave dave daaaaaaaaavvvvveeeee"))
+
+    async def scenario():
+        server = NetworkServer(cn)
+        host, port = (await server.start())[:2]
+        async with NetworkClient(host, port, pool_size=2, batch_size=3) as client:
+            await client.join("alice", 1, alice.get_serialized_key())
+            await client.join("bob", 2, bob.get_serialized_key())
+
+            # small sends are grouped in batches and pipelined
+            sends = [client.send("alice", "bob", "message " + str(index)) for index in range(5)]
+            sends.append(client.send("alice", "bob", "urgent", Priority.HIGH))
+            await asyncio.gather(*sends)
+
+            await client.broadcast("bob", "hello all", Priority.MEDIUM)
+            messages_to_bob = await client.fetch("bob")
+            messages_to_alice = await client.fetch("alice")
+
+            with pytest.raises(ServerException):
+                await client.send("alice", "nobody", "lost")
+            with pytest.raises(ServerException):
+                await client.fetch("nobody")
+
+            await client.leave("bob")
+        await server.close()
+        return messages_to_bob, messages_to_alice
+
+    messages_to_bob, messages_to_alice = asyncio.run(scenario())
+    assert [message.content for message in messages_to_bob] == ["urgent"] + ["message " + str(index)
+                                                                            for index in range(5)]
+    assert messages_to_bob[0].priority == Priority.HIGH
+    assert messages_to_bob[1].sender == "alice"
+    assert len(messages_to_alice) == 1
+    assert messages_to_alice[0].content == "hello all"
+    assert messages_to_alice[0].receiver is None
+    assert "bob" not in cn.persons
@@ -0,0 +1,85 @@
+import time
+
+import pytest
+
+from app.network import Node, CommunicationNetwork
+from app.person import Person
+from app.messaging import Key, Message, Priority
+from app.sharding import partition, ShardingException
+
+
+def build_network():
+    """
+    node_1 --- node_2 --- node_3 --- node_4 with alice on node_1, bob on node_2 and carol on node_4
+    """
+    cn: CommunicationNetwork[int] = CommunicationNetwork()
+    nodes = [Node(node_id) for node_id in range(1, 5)]
+    for node in nodes:
+        cn.add(node)
+    for node_1, node_2 in zip(nodes, nodes[1:]):
+        cn.link(node_1, node_2, 1)
+    alice = Person("alice", Key("this is a simple text to train create the key"))
+    bob = Person("bob", Key("dave dave dave daaaaaaaaavvvvveeeee"))
+    carol = Person("carol", Key("carol carol carol"))
+    cn.join_network(alice, 1)
+    cn.join_network(bob, 2)
+    cn.join_network(carol, 4)
+    return cn, alice, bob, carol
+
+
+def test_partition_keeps_neighbours_together():
+    cn, _, _, _ = build_network()
+    assert partition(cn, 2) == {1: 0, 2: 0, 3: 1, 4: 1}
+
+
+def test_sharded_network():
+    cn, alice, bob, carol = build_network()
+    # a message queued before sharding moves to the worker with its node
+    alice.send_message_to("carol", "queued before")
+
+    with cn.shard(shards=2) as sharded:
+        assert sharded.shards == 2
+        sharded.send(Message("alice", alice._key.encode("hi bob"), Priority.LOW, "bob"))
+        sharded.send(Message("alice", alice._key.encode("hi carol"), Priority.HIGH, "carol"))
+        sharded.broadcast(Message("bob", bob._key.encode("hello all"), Priority.MEDIUM, None))
+
+        messages_to_carol = sharded.get_all_messages("carol")
+        assert [message.content for message in messages_to_carol] == ["hi carol", "hello all", "queued before"]
+        assert messages_to_carol[0].priority == Priority.HIGH
+        assert sharded.get_all_messages("carol") == []
+
+        messages_to_bob = sharded.get_all_messages("bob")
+        assert [message.content for message in messages_to_bob] == ["hi bob"]
+
+        dave = Person("dave", Key("dave the new one"))
+        sharded.join_network("dave", 3, dave.get_serialized_key())
+        sharded.send(Message("dave", dave._key.encode("i am new"), Priority.LOW, "alice"))
+        messages_to_alice = sharded.get_all_messages("alice")
+        assert [message.content for message in messages_to_alice] == ["hello all", "i am new"]
+
+        sharded.leave_network("bob")
+        with pytest.raises(ShardingException):
+            sharded.send(Message("alice", "", Priority.LOW, "bob"))
+
+
+def test_persons_and_message_fields_across_shards():
+    cn, alice, bob, carol = build_network()
+    alice.send_message_to("carol", "queued before", ttl=60)
+    with cn.shard(shards=2) as sharded:
+        # the persons are bound to the coordinator
+        alice.send_urgent_message_to("carol", "through the person")
+        retried = Message("bob", bob._key.encode("only once"), Priority.LOW, "carol", sequence=7)
+        sharded.send(retried)
+        sharded.send(retried)
+        sharded.send(Message("bob", bob._key.encode("too late"), Priority.LOW, "carol", deadline=time.time() - 1))
+        messages_to_carol = carol.get_all_messages()
+        assert [message.content for message in messages_to_carol] == ["through the person", "queued before",
+                                                                      "only once"]
+        assert messages_to_carol[1].deadline is not None
+        assert carol.get_all_messages() == []
+        # the workers cannot call back: subscribing fails and leaves nothing behind
+        with pytest.raises(ShardingException):
+            carol.subscribe(lambda person: None)
+        assert carol._subscriptions == []
+    with pytest.raises(ShardingException):
+        carol.get_all_messages()
@@ -6,9 +6,9 @@ import string
 # Make it possible to specificy a list of calls that are expected on the mock objects
 from unittest.mock import call
 
-from network import CommunicationNetwork, Node
-from person import Person
-from messaging import Key, Priority, Message
+from app.network import CommunicationNetwork, Node
+from app.person import Person
+from app.messaging import Key, Priority, Message
 
 
 def test_communicate_over_simple_network():
@@ -0,0 +1,104 @@
+import pytest
+
+from app.network import Node, CommunicationNetwork
+from app.person import Person
+from app.messaging import Key, Message, Priority
+from app.snapshot import SnapshotException
+
+
+def test_save_and_load_network(tmp_path):
+    """
+    Build a network with queued messages, save it, load it back and check that nothing is lost
+    """
+    cn: CommunicationNetwork[int] = CommunicationNetwork()
+    node_1 = Node(1)
+    node_2 = Node(2)
+    node_3 = Node(3)
+    cn.add(node_1)
+    cn.add(node_2)
+    cn.add(node_3)
+    cn.link(node_1, node_2, 1)
+    cn.link(node_2, node_3, 2)
+    cn.link(node_1, node_3, 10)
+
+    alice = Person("alice", Key("this is a simple text to train create the key"))
+    bob = Person("bob", Key("this is another text. this is another text. bob"))
+    carol = Person("carol", Key("carol carol carol"))
+    cn.join_network(alice, node_1.node_id)
+    cn.join_network(bob, node_3.node_id)
+    cn.join_network(carol, node_3.node_id)
+
+    alice.send_message_to("bob", "hi bob")
+    alice.send_urgent_message_to_everyone("party tonight")
+
+    path = tmp_path / "network.snap"
+    cn.save(path)
+    restored = CommunicationNetwork.load(path)
+
+    assert restored.node_index_list == [1, 2, 3]
+    assert restored.network == cn.network
+    assert restored._registry.get_node_id("bob") == 3
+    assert restored._registry.get_serialized_key("alice") == alice.get_serialized_key()
+
+    # the broadcast message is stored once and shared again between the mailboxes
+    assert restored.nodes[3].messages["bob"][1] is restored.nodes[3].messages["carol"][0]
+
+    messages_to_bob = restored.persons["bob"].get_all_messages()
+    assert len(messages_to_bob) == 2
+    assert messages_to_bob[0].content == "party tonight"
+    assert messages_to_bob[0].priority == Priority.MEDIUM
+    assert messages_to_bob[0].receiver is None
+    assert messages_to_bob[1].content == "hi bob"
+    assert messages_to_bob[1].receiver == "bob"
+
+    # the restored network keeps working
+    restored.persons["carol"].send_message_to("alice", "see you")
+    assert restored.persons["alice"].get_all_messages()[0].content == "see you"
+
+
+def test_load_rejects_invalid_file(tmp_path):
+    path = tmp_path / "broken.snap"
+    path.write_bytes(b"not a snapshot at all")
+    with pytest.raises(SnapshotException):
+        CommunicationNetwork.load(path)
+
+
+def test_retry_after_load_is_a_duplicate(tmp_path):
+    cn: CommunicationNetwork[int] = CommunicationNetwork()
+    cn.add(Node(1))
+    alice = Person("alice", Key("this is a simple text to train create the key"))
+    bob = Person("bob", Key("this is another text. this is another text. bob"))
+    cn.join_network(alice, 1)
+    cn.join_network(bob, 1)
+    unread = Message("alice", alice._key.encode("unread"), Priority.LOW, "bob", sequence=alice.next_sequence())
+    read = Message("alice", alice._key.encode("read"), Priority.LOW, "bob", sequence=alice.next_sequence())
+    cn.send(read)
+    assert [message.content for message in bob.get_all_messages()] == ["read"]
+    cn.send(unread)
+
+    path = tmp_path / "network.snap"
+    cn.save(path)
+    restored = CommunicationNetwork.load(path)
+    assert restored.nodes[1].messages["bob"][0].sequence == unread.sequence
+    # neither the queued message nor the one read before the save is stored twice
+    restored.send(unread)
+    restored.send(read)
+    assert [message.content for message in restored.persons["bob"].get_all_messages()] == ["unread"]
+
+
+def test_deferred_messages_are_saved(tmp_path):
+    cn: CommunicationNetwork[int] = CommunicationNetwork()
+    cn.add(Node(1))
+    key = Key("this is a simple text to train create the key")
+    cn.join_network(Person("a", key), 1)
+    cn.join_network(Person("b", key), 1)
+    cn.set_admission(max_depth=1, defer=True)
+    cn.persons["a"].send_message_to("b", "one")
+    cn.persons["a"].send_message_to("b", "two")
+
+    path = tmp_path / "network.snap"
+    cn.save(path)
+    restored = CommunicationNetwork.load(path)
+    # b reads 'one', then 'two' is admitted
+    assert [message.content for message in restored.persons["b"].get_all_messages()] == ["one"]
+    assert [message.content for message in restored.persons["b"].get_all_messages()] == ["two"]